@@ -0,0 +1,168 @@
+from athena.federation.utils import AthenaSDKUtils
+
+# Java SDK `Marker.Bound` values
+EXACTLY = 'EXACTLY'
+ABOVE = 'ABOVE'
+BELOW = 'BELOW'
+
+
+def decode_block_values(block):
+    """Returns the values of the first column of an encoded Block as Python objects"""
+    records = AthenaSDKUtils.decode_pyarrow_records(
+        block['schema'], block['records'])
+    return records.column(0).to_pylist()
+
+
+class Marker:
+    def __init__(self, value, bound, unbounded=False) -> None:
+        self.value = value
+        self.bound = bound
+        self.unbounded = unbounded
+
+    @classmethod
+    def from_dict(cls, marker):
+        if marker.get('nullValue'):
+            return cls(None, marker.get('bound'), unbounded=True)
+        return cls(decode_block_values(marker['valueBlock'])[0], marker.get('bound'))
+
+    @property
+    def inclusive(self):
+        return self.bound == EXACTLY
+
+
+class Range:
+    def __init__(self, low, high) -> None:
+        self.low = low
+        self.high = high
+
+    def is_single_value(self):
+        return (not self.low.unbounded and not self.high.unbounded
+                and self.low.inclusive and self.high.inclusive
+                and self.low.value == self.high.value)
+
+    def contains(self, value):
+        low, high = self.low, self.high
+        if not low.unbounded and (value < low.value or (value == low.value and not low.inclusive)):
+            return False
+        if not high.unbounded and (value > high.value or (value == high.value and not high.inclusive)):
+            return False
+        return True
+
+
+class ValueSet:
+    def __init__(self, null_allowed=False) -> None:
+        self.null_allowed = null_allowed
+
+    def values(self):
+        """
+        If the set is a list of discrete values, returns them, otherwise None.
+        """
+        return None
+
+    def contains(self, value):
+        """Whether a (non-null) value is in the set, erring on the side of True"""
+        return True
+
+
+class AllOrNoneValueSet(ValueSet):
+    def __init__(self, all, null_allowed=False) -> None:
+        super().__init__(null_allowed)
+        self.all = all
+
+    def values(self):
+        return None if self.all else []
+
+    def contains(self, value):
+        return self.all
+
+
+class EquatableValueSet(ValueSet):
+    def __init__(self, values, white_list=True, null_allowed=False) -> None:
+        super().__init__(null_allowed)
+        self._values = values
+        self.white_list = white_list
+
+    def values(self):
+        return self._values if self.white_list else None
+
+    def contains(self, value):
+        return (value in self._values) == self.white_list
+
+
+class SortedRangeSet(ValueSet):
+    def __init__(self, ranges, null_allowed=False) -> None:
+        super().__init__(null_allowed)
+        self.ranges = ranges
+
+    def values(self):
+        if all(r.is_single_value() for r in self.ranges):
+            return [r.low.value for r in self.ranges]
+        return None
+
+    def contains(self, value):
+        return any(r.contains(value) for r in self.ranges)
+
+    def span(self):
+        """
+        Returns the (low, high) Markers that cover every range in the set.
+        """
+        return self.ranges[0].low, self.ranges[-1].high
+
+
+def parse_value_set(value_set):
+    set_type = value_set.get('@type')
+    null_allowed = value_set.get('nullAllowed', False)
+    if set_type == 'EquatableValueSet':
+        return EquatableValueSet(decode_block_values(value_set['valueBlock']),
+                                 value_set.get('whiteList', True), null_allowed)
+    if set_type == 'SortedRangeSet':
+        ranges = [Range(Marker.from_dict(r['low']), Marker.from_dict(r['high']))
+                  for r in value_set.get('ranges', [])]
+        return SortedRangeSet(ranges, null_allowed)
+    if set_type == 'AllOrNoneValueSet':
+        return AllOrNoneValueSet(value_set.get('all', True), null_allowed)
+    raise ValueError("Unsupported ValueSet type: %s" % set_type)
+
+
+def parse_constraints(constraints):
+    """
+    Parses the `summary` of the constraints Athena sends with GetSplits/ReadRecords
+    requests into a dict of column name => ValueSet.
+    """
+    summary = (constraints or {}).get('summary') or {}
+    return {column: parse_value_set(value_set) for column, value_set in summary.items()}
+
+
+def parse_like_expressions(constraints):
+    """
+    Returns a list of (column, pattern) tuples for any `LIKE` expressions that were pushed down.
+    Only newer versions of the SDK send these.
+    """
+    likes = []
+    for expression in (constraints or {}).get('expression') or []:
+        if expression.get('@type') != 'FunctionCallExpression':
+            continue
+        function_name = expression.get('functionName', {}).get('functionName', '')
+        if function_name not in ('$like', '$like_pattern'):
+            continue
+
+        arguments = expression.get('arguments', [])
+        columns = [a['columnName'] for a in arguments if a.get('@type') == 'VariableExpression']
+        patterns = [decode_block_values(a['valueBlock'])[0]
+                    for a in arguments if a.get('@type') == 'ConstantExpression']
+        if len(columns) == 1 and len(patterns) == 1:
+            likes.append((columns[0], patterns[0]))
+    return likes
+
+
+def parse_limit(constraints):
+    """
+    Returns the row limit Athena pushed down, or None if there isn't one.
+    Only newer versions of the SDK send these, with -1 meaning no limit.
+    A limit on an ordered query (top-N) says nothing about which rows we can skip.
+    """
+    constraints = constraints or {}
+    limit = constraints.get('limit')
+    if limit is None or int(limit) < 0 or constraints.get('orderByClause'):
+        return None
+    return int(limit)
@@ -13,6 +13,11 @@ class AthenaFederator(metaclass=ABCMeta):
         """Basic ping request that returns metadata about this connector"""
         raise NotImplementedError
 
+    @abstractmethod
+    def GetDataSourceCapabilitiesRequest(self) -> models.GetDataSourceCapabilitiesResponse:
+        """Which query optimizations (like LIMIT pushdown) the connector supports"""
+        raise NotImplementedError
+
     @abstractmethod
     def ListSchemasRequest(self) -> models.ListSchemasResponse:
         """List different available databases for your connector"""
@@ -39,6 +44,6 @@ class AthenaFederator(metaclass=ABCMeta):
         raise NotImplementedError
 
     @abstractmethod
-    def ReadRecordsRequest(self) -> models.ReadRecordsResponse:
-        """The actual data!"""
+    def ReadRecordsRequest(self):
+        """The actual data! Returns either a ReadRecordsResponse or a RemoteReadRecordsResponse"""
         raise NotImplementedError
@@ -0,0 +1,127 @@
+import json
+import os
+import random
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+# Metrics are written to stdout in CloudWatch Embedded Metric Format, under this namespace
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'AthenaFederation')
+
+# DEBUG logs entire request and response payloads, INFO logs them with long strings
+# (like base64 record batches) truncated, anything else doesn't log them at all.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+# The fraction of invocations whose payloads are logged at INFO
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))
+
+MAX_LOGGED_STRING = 256
+
+
+class Metrics:
+    """
+    Collects timings, counters and memory usage for a single invocation.
+
+    Timers accumulate, so a phase that runs many times (like fetching each page of
+    messages) is reported as its total time. Everything is emitted as one EMF line.
+    """
+
+    def __init__(self, namespace=METRICS_NAMESPACE, dimensions=None, clock=time.perf_counter) -> None:
+        self.namespace = namespace
+        self.dimensions = dict(dimensions or {})
+        self.clock = clock
+        # name => [value, unit]
+        self.values = {}
+
+    @contextmanager
+    def timer(self, phase):
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self.count(phase + 'Time', (self.clock() - started) * 1000, 'Milliseconds')
+
+    def timed(self, phase, iterable):
+        """Yields from `iterable`, timing how long each item takes to produce"""
+        iterator = iter(iterable)
+        while True:
+            with self.timer(phase):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name, value=1, unit='Count'):
+        current = self.values.setdefault(name, [0, unit])
+        current[0] += value
+
+    def peak(self, name, value, unit='Bytes'):
+        current = self.values.setdefault(name, [value, unit])
+        current[0] = max(current[0], value)
+
+    def record_memory(self):
+        # Requests that never touched Arrow shouldn't pay to import it
+        pa = sys.modules.get('pyarrow')
+        if pa is not None:
+            self.peak('ArrowAllocatedBytes', pa.total_allocated_bytes())
+            self.peak('ArrowPeakBytes', pa.default_memory_pool().max_memory())
+        # ru_maxrss is in kilobytes on Linux
+        self.peak('MaxRSSBytes', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+    def __getitem__(self, name):
+        return self.values[name][0]
+
+    def __contains__(self, name):
+        return name in self.values
+
+    def as_emf(self, timestamp=None):
+        document = {
+            "_aws": {
+                "Timestamp": int((timestamp or time.time()) * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [sorted(self.dimensions)],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in self.values.items()]
+                }]
+            }
+        }
+        document.update(self.dimensions)
+        document.update((name, value) for name, (value, _) in self.values.items())
+        return document
+
+    def emit(self):
+        print(json.dumps(self.as_emf(), separators=(',', ':')))
+
+
+def payload_size(payload):
+    """Roughly how many bytes a JSON payload is, without actually serializing it"""
+    if isinstance(payload, str):
+        return len(payload)
+    if isinstance(payload, dict):
+        return sum(len(k) + payload_size(v) for k, v in payload.items())
+    if isinstance(payload, (list, tuple)):
+        return sum(payload_size(v) for v in payload)
+    return 8
+
+
+def truncate(payload, limit=MAX_LOGGED_STRING):
+    """Shortens every long string inside a payload"""
+    if isinstance(payload, str):
+        return payload if len(payload) <= limit else "%s...<%d chars>" % (payload[:limit], len(payload))
+    if isinstance(payload, dict):
+        return {k: truncate(v, limit) for k, v in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return [truncate(v, limit) for v in payload]
+    return payload
+
+
+def should_log_payloads(level=LOG_LEVEL, sample_rate=LOG_SAMPLE_RATE):
+    if level == 'DEBUG':
+        return True
+    return level == 'INFO' and random.random() < sample_rate
+
+
+def log_payload(payload, level=LOG_LEVEL):
+    print(payload if level == 'DEBUG' else truncate(payload))
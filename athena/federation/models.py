@@ -1,18 +1,34 @@
+import functools
 from uuid import uuid4
 
-from athena.federation.utils import AthenaSDKUtils
-
-import pyarrow as pa
-
+# The version of the federation protocol we speak, sent with every PingResponse
 # https://github.com/awslabs/aws-athena-query-federation/blob/master/athena-federation-sdk/src/main/java/com/amazonaws/athena/connector/lambda/handlers/FederationCapabilities.java#L33
 CAPABILITIES = 23
 
+# Query optimizations are advertised separately, in a GetDataSourceCapabilitiesResponse
+# https://github.com/awslabs/aws-athena-query-federation/blob/master/athena-federation-sdk/src/main/java/com/amazonaws/athena/connector/lambda/metadata/optimizations/DataSourceOptimizations.java
+SUPPORTS_LIMIT_PUSHDOWN = 'supports_limit_pushdown'
+LIMIT_PUSHDOWN_INTEGER_CONSTANT = 'integer_constant'
+
+
+def _encode(pya_obj):
+    # Arrow is imported on first use, so metadata requests that don't need it start faster
+    from athena.federation.utils import AthenaSDKUtils
+    return AthenaSDKUtils.encode_pyarrow_object(pya_obj)
+
+
+@functools.lru_cache(maxsize=None)
+def _default_partition_config():
+    """The single partition we return when a layout doesn't have any of its own"""
+    return GetTableLayoutResponse(None, None, None, {'partitionId': [1]}).encoded_partition_config()
+
 
 class PingResponse:
-    def __init__(self, catalogName, queryId, sourceType) -> None:
+    def __init__(self, catalogName, queryId, sourceType, capabilities=CAPABILITIES) -> None:
         self.catalogName = catalogName
         self.queryId = queryId
         self.sourceType = sourceType
+        self.capabilities = capabilities
 
     def as_dict(self):
         return {
@@ -20,7 +36,30 @@ class PingResponse:
             "catalogName":  self.catalogName,
             "queryId": self.queryId,
             "sourceType": self.sourceType,
-            "capabilities": CAPABILITIES
+            "capabilities": self.capabilities
+        }
+
+
+class GetDataSourceCapabilitiesResponse:
+    request_type = 'GET_DATASOURCE_CAPABILITIES'
+
+    def __init__(self, catalogName, capabilities=None) -> None:
+        """
+        `capabilities` maps each optimization we support to a list of its sub types,
+        e.g. `{SUPPORTS_LIMIT_PUSHDOWN: [LIMIT_PUSHDOWN_INTEGER_CONSTANT]}`
+        """
+        self.catalogName = catalogName
+        self.capabilities = capabilities or {}
+
+    def as_dict(self):
+        return {
+            "@type": "GetDataSourceCapabilitiesResponse",
+            "catalogName": self.catalogName,
+            "capabilities": {
+                optimization: [{"subType": sub_type, "properties": []} for sub_type in sub_types]
+                for optimization, sub_types in self.capabilities.items()
+            },
+            "requestType": self.request_type
         }
 
 
@@ -52,9 +91,9 @@ class TableDefinition:
 class ListTablesResponse:
     requestType = 'LIST_TABLES'
 
-    def __init__(self, catalogName, tableDefinitions=[]) -> None:
+    def __init__(self, catalogName, tableDefinitions=None) -> None:
         self.catalogName = catalogName
-        self.tables = tableDefinitions
+        self.tables = tableDefinitions if tableDefinitions is not None else []
 
     def addTableDefinition(self, schemaName, tableName) -> None:
         self.tables.append(TableDefinition(schemaName, tableName))
@@ -71,19 +110,20 @@ class ListTablesResponse:
 class GetTableResponse:
     request_type = 'GET_TABLE'
 
-    def __init__(self, catalogName, databaseName, tableName, schema) -> None:
+    def __init__(self, catalogName, databaseName, tableName, schema, partitionColumns=None) -> None:
         self.catalogName = catalogName
         self.databaseName = databaseName
         self.tableName = tableName
         self.schema = schema
+        self.partitionColumns = partitionColumns or []
 
     def as_dict(self):
         return {
             "@type": "GetTableResponse",
             "catalogName": self.catalogName,
             "tableName": {'schemaName': self.databaseName, 'tableName': self.tableName},
-            "schema": {"schema": AthenaSDKUtils.encode_pyarrow_object(self.schema)},
-            "partitionColumns": [],
+            "schema": {"schema": _encode(self.schema)},
+            "partitionColumns": list(self.partitionColumns),
             "requestType": self.request_type
         }
 
@@ -100,33 +140,35 @@ class GetTableLayoutResponse:
     def encoded_partition_config(self):
         """
         Encodes the schema and each record in the partition config.
+        Partitions are either a RecordBatch or a dict of column name => values.
         """
-        partition_keys = self.partitions.keys()
-        data = [pa.array(self.partitions[key]) for key in partition_keys]
-        batch = pa.RecordBatch.from_arrays(data, list(partition_keys))
+        import pyarrow as pa
+
+        if isinstance(self.partitions, pa.RecordBatch):
+            batch = self.partitions
+        else:
+            partition_keys = self.partitions.keys()
+            data = [pa.array(self.partitions[key]) for key in partition_keys]
+            batch = pa.RecordBatch.from_arrays(data, list(partition_keys))
         return {
             "aId": str(uuid4()),
-            "schema": AthenaSDKUtils.encode_pyarrow_object(batch.schema),
-            "records": AthenaSDKUtils.encode_pyarrow_object(batch)
+            "schema": _encode(batch.schema),
+            "records": _encode(batch)
         }
 
     def as_dict(self):
         # If _no_ partition_config is provided, we *must* return at least 1 partition
         # otherwise Athena will not know to retrieve data.
         if self.partitions is None:
-            self.partitions = {'partitionId': [1]}
-            # self.partitions = {
-            #     'schema': pa.schema([('partitionId', pa.int32())]),
-            #     'records': {
-            #         'partitionId': [1]
-            #     },
-            # }
+            partitions = dict(_default_partition_config(), aId=str(uuid4()))
+        else:
+            partitions = self.encoded_partition_config()
 
         return {
             "@type": "GetTableLayoutResponse",
             "catalogName": self.catalogName,
             "tableName": {'schemaName': self.databaseName, 'tableName': self.tableName},
-            "partitions": self.encoded_partition_config(),
+            "partitions": partitions,
             "requestType": self.request_type
         }
 
@@ -134,16 +176,20 @@ class GetTableLayoutResponse:
 class GetSplitsResponse:
     request_type = 'GET_SPLITS'
 
-    def __init__(self, catalogName, splits) -> None:
+    def __init__(self, catalogName, splits, continuationToken=None) -> None:
+        """
+        If there's a `continuationToken`, Athena asks for more splits by sending it back with another GetSplitsRequest
+        """
         self.catalogName = catalogName
         self.splits = splits
+        self.continuationToken = continuationToken
 
     def as_dict(self):
         return {
             "@type": "GetSplitsResponse",
             "catalogName": self.catalogName,
             "splits": self.splits,
-            "continuationToken": None,
+            "continuationToken": self.continuationToken,
             "requestType": self.request_type
         }
 
@@ -152,18 +198,51 @@ class ReadRecordsResponse:
     request_type = 'READ_RECORDS'
 
     def __init__(self, catalogName, schema, records) -> None:
+        """
+        `records` may either be a single RecordBatch or an iterable of RecordBatches
+        """
         self.catalogName = catalogName
         self.schema = schema
         self.records = records
 
     def as_dict(self):
+        import pyarrow as pa
+        from athena.federation.utils import AthenaSDKUtils
+
+        records = self.records
+        if not isinstance(records, pa.RecordBatch):
+            records = AthenaSDKUtils.combine_record_batches(self.schema, records)
+
         return {
             "@type": "ReadRecordsResponse",
             "catalogName": self.catalogName,
             "records": {
                 "aId": str(uuid4()),
-                "schema": AthenaSDKUtils.encode_pyarrow_object(self.schema),
-                "records": AthenaSDKUtils.encode_pyarrow_object(self.records)
+                "schema": _encode(self.schema),
+                "records": _encode(records)
             },
             "requestType": self.request_type
         }
+
+
+class RemoteReadRecordsResponse:
+    request_type = 'READ_RECORDS'
+
+    def __init__(self, catalogName, schema, remoteBlocks, encryptionKey=None) -> None:
+        """
+        `remoteBlocks` is a list of the S3SpillLocations our records were written to
+        """
+        self.catalogName = catalogName
+        self.schema = schema
+        self.remoteBlocks = remoteBlocks
+        self.encryptionKey = encryptionKey
+
+    def as_dict(self):
+        return {
+            "@type": "RemoteReadRecordsResponse",
+            "catalogName": self.catalogName,
+            "schema": {"schema": _encode(self.schema)},
+            "remoteBlocks": self.remoteBlocks,
+            "encryptionKey": self.encryptionKey,
+            "requestType": self.request_type
+        }
@@ -0,0 +1,190 @@
+import base64
+import os
+from uuid import uuid4
+
+import pyarrow as pa
+
+from athena.federation.metrics import Metrics
+from athena.federation.utils import AthenaSDKUtils
+import athena.federation.models as models
+
+# Lambda responses are capped at 6MB and the inline records are base64 encoded,
+# which adds a third on top. So we spill anything beyond 4MB of Arrow data.
+MAX_INLINE_BYTES = int(os.environ.get('MAX_INLINE_BYTES', 4 * 1024 * 1024))
+# What Athena asks for by default with `maxBlockSize`
+MAX_BLOCK_BYTES = 16000000
+
+
+class S3Storage:
+    """Writes spilled blocks (or any other objects) to S3"""
+
+    def __init__(self, client=None) -> None:
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            # boto3 is included in the Lambda runtime, so we only import it if we actually spill
+            import boto3
+            self._client = boto3.client('s3')
+        return self._client
+
+    def put(self, bucket, key, data):
+        self.client.put_object(Bucket=bucket, Key=key, Body=data)
+
+    def get(self, bucket, key):
+        """Returns the object's contents, or None if it doesn't exist"""
+        try:
+            return self.client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def delete(self, bucket, key):
+        self.client.delete_object(Bucket=bucket, Key=key)
+
+    def list(self, bucket, prefix):
+        """Returns the key of every object under `prefix`"""
+        keys = []
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+            keys.extend(item['Key'] for item in page.get('Contents', []))
+        return keys
+
+
+class LocalStorage:
+    """Writes spilled blocks to the local filesystem, mostly useful for testing"""
+
+    def __init__(self, root) -> None:
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def put(self, bucket, key, data):
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Like an S3 put, nobody sees the file until it's complete
+        partial = os.path.join(os.path.dirname(path), '.%s.partial' % uuid4())
+        with open(partial, 'wb') as block:
+            block.write(data)
+        os.replace(partial, path)
+
+    def get(self, bucket, key):
+        """Returns the file's contents, or None if it doesn't exist"""
+        try:
+            with open(self._path(bucket, key), 'rb') as block:
+                return block.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, bucket, key):
+        try:
+            os.remove(self._path(bucket, key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, bucket, prefix):
+        """Returns the key of every file under `prefix`, skipping ones that are still being written"""
+        root = self._path(bucket, '')
+        keys = []
+        for directory, _, names in os.walk(self._path(bucket, prefix.rpartition('/')[0])):
+            for name in names:
+                key = os.path.relpath(os.path.join(directory, name), root).replace(os.sep, '/')
+                if not name.startswith('.') and key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+
+def _aes_gcm(encryption_key):
+    # Only needed if Athena asks us to encrypt spilled data
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    return AESGCM(base64.b64decode(encryption_key['key'])), base64.b64decode(encryption_key['nonce'])
+
+
+def encode_block(batch, encryption_key=None):
+    data = AthenaSDKUtils.serialize_pyarrow_object(batch).to_pybytes()
+    if encryption_key is not None:
+        aes, nonce = _aes_gcm(encryption_key)
+        data = aes.encrypt(nonce, data, None)
+    return data
+
+
+def decode_block(schema, data, encryption_key=None):
+    """The inverse of `encode_block`"""
+    if encryption_key is not None:
+        aes, nonce = _aes_gcm(encryption_key)
+        data = aes.decrypt(nonce, data, None)
+    return AthenaSDKUtils.deserialize_pyarrow_records(schema, data)
+
+
+class BlockSpiller:
+    """
+    Keeps record batches in memory until they cross `max_inline_bytes`, after which
+    every batch is written as its own block underneath the split's spill location.
+    Batches bigger than `max_block_bytes` are split across several blocks.
+    Without a spill location, everything is returned inline.
+    """
+
+    def __init__(self, spill_location, storage=None, max_inline_bytes=MAX_INLINE_BYTES,
+                 encryption_key=None, metrics=None, max_block_bytes=MAX_BLOCK_BYTES) -> None:
+        self.spill_location = spill_location
+        self.storage = storage or S3Storage()
+        self.max_inline_bytes = max_inline_bytes
+        self.max_block_bytes = max_block_bytes
+        self.encryption_key = encryption_key
+        self.metrics = metrics or Metrics()
+        self.inline_batches = []
+        self.inline_bytes = 0
+        self.remote_blocks = []
+
+    @property
+    def spilled(self):
+        return len(self.remote_blocks) > 0
+
+    def add(self, batch) -> None:
+        self.metrics.count('Rows', batch.num_rows)
+        self.metrics.peak('ArrowAllocatedBytes', pa.total_allocated_bytes())
+        if self.spilled:
+            self._spill(batch)
+            return
+
+        self.inline_batches.append(batch)
+        self.inline_bytes += pa.ipc.get_record_batch_size(batch)
+        if self.inline_bytes > self.max_inline_bytes and self.spill_location is not None:
+            for inline_batch in self.inline_batches:
+                self._spill(inline_batch)
+            self.inline_batches = []
+            self.inline_bytes = 0
+
+    def _spill(self, batch):
+        if batch.num_rows > 1 and pa.ipc.get_record_batch_size(batch) > self.max_block_bytes:
+            # Slices only serialize their own rows, so halving them is cheap
+            half = batch.num_rows // 2
+            self._spill(batch.slice(0, half))
+            self._spill(batch.slice(half))
+            return
+
+        bucket = self.spill_location['bucket']
+        key = "%s/%s" % (self.spill_location['key'].rstrip('/'), uuid4())
+        with self.metrics.timer('Encode'):
+            data = encode_block(batch, self.encryption_key)
+        with self.metrics.timer('Spill'):
+            self.storage.put(bucket, key, data)
+        self.metrics.count('SpilledBytes', len(data), 'Bytes')
+        self.remote_blocks.append({
+            "@type": "S3SpillLocation",
+            "bucket": bucket,
+            "key": key,
+            "directory": False
+        })
+
+    def response(self, catalogName, schema, batches):
+        """
+        Consumes every batch and returns either an inline or a remote ReadRecordsResponse.
+        """
+        for batch in batches:
+            self.add(batch)
+
+        if self.spilled:
+            return models.RemoteReadRecordsResponse(
+                catalogName, schema, self.remote_blocks, self.encryption_key)
+        return models.ReadRecordsResponse(catalogName, schema, self.inline_batches)
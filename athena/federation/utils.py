@@ -1,21 +1,64 @@
 import base64
+from collections import OrderedDict
 
 import pyarrow as pa
 
+# Schemas are usually static, so we remember the encoding of the last few we've seen.
+# Keyed by id(), with the schema itself kept alive alongside its encoding.
+MAX_CACHED_SCHEMAS = 128
+_encoded_schemas = OrderedDict()
+_parsed_schemas = OrderedDict()
+
+
+def _remember(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > MAX_CACHED_SCHEMAS:
+        cache.popitem(last=False)
+
 
 class AthenaSDKUtils:
-    def encode_pyarrow_object(pya_obj):
+    def serialize_pyarrow_object(pya_obj):
         """
-        Encodes either a PyArrow Schema or set of Records to Base64.
+        Serializes either a PyArrow Schema or set of Records to bytes.
         I'm not entirely sure why, but I had to cut off the first 4 characters
         of the `serialize()` output to be compatible with the Java SDK.
         """
+        return pya_obj.serialize().slice(4)
+
+    def encode_pyarrow_object(pya_obj):
+        """
+        Encodes either a PyArrow Schema or set of Records to Base64.
+        """
+        if isinstance(pya_obj, pa.Schema):
+            return AthenaSDKUtils.encode_pyarrow_schema(pya_obj)
         return base64.b64encode(
-            pya_obj.serialize().slice(4)
+            AthenaSDKUtils.serialize_pyarrow_object(pya_obj)
         ).decode('utf-8')
 
+    def encode_pyarrow_schema(pya_schema):
+        """
+        Encodes a PyArrow Schema to Base64, memoizing the result for schemas we've
+        already encoded (or parsed with `parse_encoded_schema`).
+        """
+        cached = _encoded_schemas.get(id(pya_schema))
+        if cached is not None and cached[0] is pya_schema:
+            return cached[1]
+
+        encoded = base64.b64encode(
+            AthenaSDKUtils.serialize_pyarrow_object(pya_schema)
+        ).decode('utf-8')
+        _remember(_encoded_schemas, id(pya_schema), (pya_schema, encoded))
+        return encoded
+
     def parse_encoded_schema(b64_schema):
-        return pa.read_schema(pa.BufferReader(base64.b64decode(b64_schema)))
+        schema = _parsed_schemas.get(b64_schema)
+        if schema is None:
+            schema = pa.read_schema(pa.BufferReader(base64.b64decode(b64_schema)))
+            _remember(_parsed_schemas, b64_schema, schema)
+            # The same schema is usually encoded again for the response
+            _remember(_encoded_schemas, id(schema), (schema, b64_schema))
+        return schema
 
     def encode_pyarrow_records(pya_schema, record_hash):
         return pa.RecordBatch.from_arrays(
@@ -29,4 +72,27 @@ class AthenaSDKUtils:
         Returns just the records as the schema will be included with that
         """
         pa_schema = AthenaSDKUtils.parse_encoded_schema(b64_schema)
-        return pa.read_record_batch(base64.b64decode(b64_records), pa_schema)
+        return AthenaSDKUtils.deserialize_pyarrow_records(pa_schema, base64.b64decode(b64_records))
+
+    def deserialize_pyarrow_records(pa_schema, data):
+        return pa.read_record_batch(data, pa_schema)
+
+    def combine_record_batches(pya_schema, batches):
+        """
+        Merges a series of RecordBatches into the single batch that an inline
+        ReadRecordsResponse can carry.
+        """
+        batches = list(batches)
+        if len(batches) == 1:
+            return batches[0]
+        if len(batches) == 0:
+            return pa.RecordBatch.from_arrays(
+                [pa.array([], type=field.type) for field in pya_schema],
+                schema=pya_schema
+            )
+
+        table = pa.Table.from_batches(batches, schema=pya_schema).combine_chunks()
+        return pa.RecordBatch.from_arrays(
+            [column.chunk(0) for column in table.columns],
+            schema=pya_schema
+        )
@@ -0,0 +1,144 @@
+"""
+End-to-end benchmark of the connector against a synthetic Gmail backend.
+
+Drives `lambda_handler` through the same sequence of requests Athena makes, with
+`bench.driver.FederationDriver` reading one split at a time:
+Ping => GetTable => GetTableLayout => GetSplits => ReadRecords (once per split)
+
+    python -m bench.benchmark --messages 10000 --latency 0.05 --throttle 0.01
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import tempfile
+import time
+
+import pyarrow as pa
+
+# gathena reads this when it plans splits, for their spill locations
+os.environ.setdefault('TARGET_BUCKET', 'bench-spill-bucket')
+# The connector's own quota throttle would otherwise dominate every run.
+# Use --quota to model Gmail's per-user limit on the fake backend instead.
+os.environ.setdefault('GMAIL_QUOTA_UNITS_PER_SEC', '1000000000')
+
+import gathena  # noqa: E402
+from athena.federation.spill import LocalStorage  # noqa: E402
+from bench.driver import FederationDriver, ScanResult  # noqa: E402
+from bench.fake_gmail import FakeGmail  # noqa: E402
+from gmail.labels import clear_labels  # noqa: E402
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class Benchmark:
+    def __init__(self, backend, table='All Mail', spill_dir=None, limit=None, columns=None, summary=None) -> None:
+        self.backend = backend
+        self.table = table
+        self.limit = limit
+        # The query's constraints, as the `summary` Athena sends
+        self.summary = summary or {}
+        # The columns the query selects, all of them by default
+        self.columns = columns
+        self.storage = LocalStorage(spill_dir or tempfile.mkdtemp(prefix='gathena-spill-'))
+        # The first event sent for each request type
+        self.events = {}
+        self.driver = FederationDriver(self.handle, gathena.CATALOG_NAME, self.storage, workers=1)
+
+    @contextlib.contextmanager
+    def patched(self):
+        """Points the connector at our fake backend and a local spill directory"""
+        storage = self.storage
+        backend = self.backend
+        original_service = gathena.GmailAthena._get_gmail_service
+        original_storage = gathena.GmailAthena._spill_storage
+        gathena.GmailAthena._get_gmail_service = lambda self: backend
+        gathena.GmailAthena._spill_storage = lambda self: storage
+        clear_labels()
+        try:
+            yield
+        finally:
+            gathena.GmailAthena._get_gmail_service = original_service
+            gathena.GmailAthena._spill_storage = original_storage
+            clear_labels()
+
+    def handle(self, event, context):
+        self.events.setdefault(event['@type'], event)
+        return gathena.lambda_handler(event, context)
+
+    def run(self):
+        constraints = {"@type": "Constraints", "summary": self.summary}
+        if self.limit is not None:
+            constraints["limit"] = self.limit
+        result = ScanResult()
+        started = time.perf_counter()
+
+        # The handler logs payloads and metrics, which we don't want to see
+        with self.patched(), contextlib.redirect_stdout(io.StringIO()):
+            self.driver.call("PingRequest", result)
+            self.driver.scan([("personal", self.table)], self.columns, constraints, result)
+
+        elapsed = time.perf_counter() - started
+        return {
+            'messages': self.backend.size,
+            'rows': result.rows,
+            'splits': result.splits,
+            'seconds': elapsed,
+            'rows_per_second': result.rows / elapsed if elapsed else 0.0,
+            'latency': {
+                request_type: {'count': len(values),
+                               'p50': percentile(values, 50),
+                               'p99': percentile(values, 99)}
+                for request_type, values in result.latencies.items()
+            },
+            'api_calls': dict(self.backend.calls),
+            'throttles': self.backend.throttles,
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            # The pool's high-water mark, over every request
+            'peak_arrow_bytes': pa.default_memory_pool().max_memory(),
+        }
+
+
+def report(results):
+    print("%(messages)d messages => %(rows)d rows in %(splits)d splits, %(seconds).2fs (%(rows_per_second).0f rows/s)"
+          % results)
+    print("%-24s %6s %10s %10s" % ("request", "count", "p50 ms", "p99 ms"))
+    for request_type, stats in results['latency'].items():
+        print("%-24s %6d %10.1f %10.1f" % (request_type, stats['count'], stats['p50'] * 1000, stats['p99'] * 1000))
+    print("api calls: %s, throttled: %d" % (
+        ", ".join("%s=%d" % c for c in sorted(results['api_calls'].items())), results['throttles']))
+    print("peak RSS: %.1f MB, peak Arrow allocation: %.1f MB" % (
+        results['peak_rss_bytes'] / 1024 / 1024, results['peak_arrow_bytes'] / 1024 / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10000, help="size of the synthetic mailbox")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds per HTTP round trip")
+    parser.add_argument('--throttle', type=float, default=0.0, help="fraction of requests that get a 429")
+    parser.add_argument('--quota', type=int, default=None, help="quota units per second before 429s")
+    parser.add_argument('--table', default='All Mail')
+    parser.add_argument('--limit', type=int, default=None, help="push down a LIMIT")
+    parser.add_argument('--columns', default=None, help="comma separated columns to select, defaults to all")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    backend = FakeGmail(args.messages, latency=args.latency, throttle_rate=args.throttle, quota=args.quota)
+    columns = args.columns.split(',') if args.columns else None
+    results = Benchmark(backend, table=args.table, limit=args.limit, columns=columns).run()
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Cold start benchmark: how long each request type takes in a brand new Lambda container.
+
+Every request runs in a fresh Python process, against the synthetic Gmail backend,
+and we report how long importing the handler took, how long the first call took
+(including anything it imported lazily) and whether it had to load Arrow or the
+Google client libraries.
+
+    python -m bench.coldstart --runs 5
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# In the order Athena sends them
+REQUEST_TYPES = [
+    'PingRequest',
+    'GetDataSourceCapabilitiesRequest',
+    'ListSchemasRequest',
+    'ListTablesRequest',
+    'GetTableRequest',
+    'GetTableLayoutRequest',
+    'GetSplitsRequest',
+    'ReadRecordsRequest',
+]
+
+
+def request_events(messages, start, spill_dir):
+    """Runs a whole query once, in this process, to get a realistic event for every request type"""
+    from bench.benchmark import Benchmark
+    from bench.fake_gmail import FakeGmail
+
+    benchmark = Benchmark(FakeGmail(messages, start=start), spill_dir=spill_dir)
+    benchmark.run()
+    with benchmark.patched(), contextlib.redirect_stdout(io.StringIO()):
+        benchmark.driver.call('GetDataSourceCapabilitiesRequest')
+        benchmark.driver.call('ListSchemasRequest')
+        benchmark.driver.call('ListTablesRequest', schemaName='personal')
+    return benchmark.events
+
+
+def measure(job):
+    """Imports the handler and makes a single request, in what must be a fresh process"""
+    from bench.fake_gmail import FakeGmail
+    backend = FakeGmail(job['messages'], start=job['start'])
+
+    started = time.perf_counter()
+    import gathena
+    imported = time.perf_counter()
+
+    def gmail_service(self):
+        # The real service pays for importing the client library, so we do too
+        import gmail.service  # noqa: F401
+        return backend
+
+    def spill_storage(self):
+        from athena.federation.spill import LocalStorage
+        return LocalStorage(job['spill_dir'])
+
+    gathena.GmailAthena._get_gmail_service = gmail_service
+    gathena.GmailAthena._spill_storage = spill_storage
+    with contextlib.redirect_stdout(io.StringIO()):
+        gathena.lambda_handler(job['event'], None)
+    finished = time.perf_counter()
+
+    return {
+        'import_ms': (imported - started) * 1000,
+        'call_ms': (finished - imported) * 1000,
+        'arrow': 'pyarrow' in sys.modules,
+        'google': 'googleapiclient' in sys.modules,
+    }
+
+
+def measure_in_subprocess(job, env=None):
+    completed = subprocess.run(
+        [sys.executable, '-m', 'bench.coldstart', '--child'],
+        input=json.dumps(job), stdout=subprocess.PIPE, check=True, universal_newlines=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env)
+    return json.loads(completed.stdout)
+
+
+def run(messages=1000, runs=3, request_types=REQUEST_TYPES, spill_dir=None):
+    spill_dir = spill_dir or tempfile.mkdtemp(prefix='gathena-spill-')
+    start = int(time.time()) - messages * 600
+    events = request_events(messages, start, spill_dir)
+
+    results = {}
+    for request_type in request_types:
+        job = {'messages': messages, 'start': start, 'spill_dir': spill_dir, 'event': events[request_type]}
+        samples = [measure_in_subprocess(job) for _ in range(runs)]
+        results[request_type] = {
+            'import_ms': statistics.median(s['import_ms'] for s in samples),
+            'call_ms': statistics.median(s['call_ms'] for s in samples),
+            'arrow': samples[0]['arrow'],
+            'google': samples[0]['google'],
+        }
+    return results
+
+
+def report(results):
+    print("%-34s %10s %10s %10s %6s %7s" % ("request", "import ms", "call ms", "total ms", "arrow", "google"))
+    for request_type, stats in results.items():
+        print("%-34s %10.1f %10.1f %10.1f %6s %7s" % (
+            request_type, stats['import_ms'], stats['call_ms'], stats['import_ms'] + stats['call_ms'],
+            'yes' if stats['arrow'] else 'no', 'yes' if stats['google'] else 'no'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000, help="size of the synthetic mailbox")
+    parser.add_argument('--runs', type=int, default=3, help="cold starts per request type, we report the median")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(json.load(sys.stdin))))
+        return
+
+    results = run(args.messages, args.runs)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+
+if __name__ == '__main__':
+    main()
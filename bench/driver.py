@@ -0,0 +1,167 @@
+"""
+A stand-in for Athena, for benchmarks and load tests. It isn't part of the connector.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+import pyarrow as pa
+
+from athena.federation.spill import decode_block
+from athena.federation.utils import AthenaSDKUtils
+
+IDENTITY = {"id": "UNKNOWN", "principal": "UNKNOWN", "account": "123456789012",
+            "arn": "arn:aws:iam::123456789012:root", "tags": {}, "groups": []}
+
+# What Athena sends with every ReadRecordsRequest
+MAX_BLOCK_SIZE = 16000000
+MAX_INLINE_BLOCK_SIZE = 5242880
+
+
+class ScanError(Exception):
+    """Raised when a scan doesn't return what it should have"""
+
+
+class ScanResult:
+    def __init__(self) -> None:
+        self.rows = 0
+        self.batches = 0
+        self.splits = 0
+        self.spilled_splits = 0
+        # The most ReadRecordsRequests that were running at once
+        self.peak_concurrency = 0
+        self._running = 0
+        # split index => rows read for it
+        self.split_rows = {}
+        # request type => [seconds, ...]
+        self.latencies = {}
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, request_type, seconds):
+        with self._lock:
+            self.latencies.setdefault(request_type, []).append(seconds)
+
+    def started_split(self):
+        with self._lock:
+            self._running += 1
+            self.peak_concurrency = max(self.peak_concurrency, self._running)
+
+    def add_split(self, index, batches, spilled):
+        with self._lock:
+            self._running -= 1
+            rows = sum(batch.num_rows for batch in batches)
+            self.split_rows[index] = rows
+            self.rows += rows
+            self.batches += len(batches)
+            self.spilled_splits += int(spilled)
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+class FederationDriver:
+    """
+    Plays Athena's part of the federation protocol against a Lambda handler, in process.
+
+    A scan goes the way Athena runs a query: GetTable, GetTableLayout, then GetSplits until
+    there's no continuation token, with every split read by a ReadRecordsRequest as soon as
+    it's planned, `workers` at a time. Several tables are planned at the same time.
+    Inline records are decoded from their base64 encoding and spilled blocks are read back
+    from `storage`.
+    """
+
+    def __init__(self, handler, catalog_name, storage=None, workers=8, identity=IDENTITY,
+                 max_inline_block_size=MAX_INLINE_BLOCK_SIZE) -> None:
+        self.handler = handler
+        self.catalog_name = catalog_name
+        self.storage = storage
+        self.workers = workers
+        self.identity = identity
+        self.max_inline_block_size = max_inline_block_size
+        self.query_id = str(uuid4())
+
+    def call(self, request_type, result=None, **fields):
+        event = dict({"@type": request_type, "identity": self.identity, "catalogName": self.catalog_name,
+                      "queryId": self.query_id}, **fields)
+        started = time.perf_counter()
+        response = self.handler(event, None)
+        if result is not None:
+            result.record(request_type, time.perf_counter() - started)
+        return response
+
+    def scan(self, tables, columns=None, constraints=None, result=None):
+        """
+        Reads every row of the given (schema name, table name) tables, like a `UNION ALL`
+        of them. `columns` limits the columns each ReadRecordsRequest asks for.
+        """
+        constraints = constraints or {"@type": "Constraints", "summary": {}}
+        result = result or ScanResult()
+        started = time.perf_counter()
+        futures = []
+        lock = threading.Lock()
+
+        def plan(schema_name, table_name):
+            for split, schema, table in self._plan(schema_name, table_name, columns, constraints, result):
+                with lock:
+                    futures.append(readers.submit(self._read, len(futures), split, schema, table, constraints, result))
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='driver-read') as readers:
+            with ThreadPoolExecutor(max_workers=len(tables), thread_name_prefix='driver-plan') as planners:
+                for planned in [planners.submit(plan, *table) for table in tables]:
+                    planned.result()
+            for future in futures:
+                future.result()
+        result.splits = len(futures)
+        result.seconds = time.perf_counter() - started
+        return result
+
+    def _plan(self, schema_name, table_name, columns, constraints, result):
+        """Yields (split, schema, table) for every split of the table, as GetSplits returns them"""
+        table = {"schemaName": schema_name, "tableName": table_name}
+        response = self.call("GetTableRequest", result, tableName=table)
+        schema = AthenaSDKUtils.parse_encoded_schema(response['schema']['schema'])
+        partition_columns = response.get('partitionColumns', [])
+        if columns:
+            schema = pa.schema([schema.field(name) for name in columns])
+
+        layout = self.call("GetTableLayoutRequest", result, tableName=table, constraints=constraints,
+                           schema=response['schema'], partitionCols=partition_columns)
+        continuation_token = None
+        while True:
+            response = self.call("GetSplitsRequest", result, tableName=table, constraints=constraints,
+                                 partitions=layout['partitions'], partitionCols=partition_columns,
+                                 continuationToken=continuation_token)
+            for split in response['splits']:
+                yield split, schema, table
+            continuation_token = response.get('continuationToken')
+            if not continuation_token:
+                return
+
+    def _read(self, index, split, schema, table, constraints, result):
+        result.started_split()
+        response = self.call("ReadRecordsRequest", result, tableName=table, constraints=constraints,
+                             schema={"schema": AthenaSDKUtils.encode_pyarrow_object(schema)}, split=split,
+                             maxBlockSize=MAX_BLOCK_SIZE, maxInlineBlockSize=self.max_inline_block_size)
+        batches = self.decode(response, schema)
+        for batch in batches:
+            if batch.schema != schema:
+                raise ScanError("Split %d returned columns %s, not %s" % (index, batch.schema.names, schema.names))
+        result.add_split(index, batches, response['@type'] == 'RemoteReadRecordsResponse')
+
+    def decode(self, response, schema):
+        """Returns the RecordBatches in an inline or remote ReadRecordsResponse"""
+        if response['@type'] == 'RemoteReadRecordsResponse':
+            return [decode_block(schema, self.storage.get(block['bucket'], block['key']),
+                                 response.get('encryptionKey'))
+                    for block in response['remoteBlocks']]
+        records = response['records']
+        return [AthenaSDKUtils.decode_pyarrow_records(records['schema'], records['records'])]
+
+
+def check_rows(result, expected):
+    """Raises a ScanError unless the scan read exactly `expected` rows"""
+    if result.rows != expected:
+        raise ScanError("Read %d rows from %d splits, expected %d" % (result.rows, result.splits, expected))
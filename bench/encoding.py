@@ -0,0 +1,41 @@
+"""
+Micro-benchmark for the schema encoding memo used by every response.
+
+    python -m bench.encoding
+"""
+import base64
+import timeit
+
+import pyarrow as pa
+
+from athena.federation.utils import AthenaSDKUtils
+
+SCHEMA = pa.schema([
+    ('messageId', pa.string()),
+    ('subject', pa.string()),
+    ('from', pa.string()),
+    ('sentDate', pa.timestamp('ms', tz='UTC')),
+])
+
+
+def legacy_encode(pya_obj):
+    # What `encode_pyarrow_object` used to do for every schema
+    return base64.b64encode(pya_obj.serialize().slice(4)).decode('utf-8')
+
+
+def bench(label, fn, number):
+    seconds = timeit.timeit(fn, number=number) / number
+    print("%-28s %10.3f ms" % (label, seconds * 1000))
+    return seconds
+
+
+def main():
+    assert legacy_encode(SCHEMA) == AthenaSDKUtils.encode_pyarrow_object(SCHEMA)
+
+    old = bench("schema (legacy)", lambda: legacy_encode(SCHEMA), 10000)
+    new = bench("schema (memoized)", lambda: AthenaSDKUtils.encode_pyarrow_object(SCHEMA), 10000)
+    print("%-28s %10.2fx" % ("speedup", old / new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""
+A synthetic, in-memory Gmail API backend for benchmarking the connector offline.
+
+Messages are generated on demand from their index, so a mailbox of a million
+messages costs no more memory than one of a thousand. Message `i` was sent
+`interval` seconds after message `i - 1`, the last one just now, and listing
+returns newest first, like Gmail.
+
+Only the parts of the search syntax the connector generates for date windows
+(`after:`/`before:`) and `labelIds=` are honoured, everything else matches all messages.
+"""
+import base64
+import random
+import re
+import threading
+import time
+
+LABELS = ['INBOX', 'SENT', 'IMPORTANT', 'Label_1', 'Label_2']
+LABEL_NAMES = {'INBOX': 'INBOX', 'SENT': 'SENT', 'IMPORTANT': 'IMPORTANT',
+               'Label_1': 'Receipts', 'Label_2': 'Travel'}
+
+
+def http_error(status):
+    # Imported here so the cold start benchmark can time the connector importing it
+    import httplib2
+    from googleapiclient.errors import HttpError
+    return HttpError(httplib2.Response({'status': status}), b'{}')
+
+
+class FakeRequest:
+    def __init__(self, backend, fn, units=5) -> None:
+        self.backend = backend
+        self.fn = fn
+        self.units = units
+
+    def execute(self, http=None):
+        self.backend.round_trip()
+        return self.fn()
+
+
+class FakeBatch:
+    def __init__(self, backend) -> None:
+        self.backend = backend
+        self.requests = []
+
+    def add(self, request, callback, request_id=None):
+        self.requests.append((request_id or str(len(self.requests)), request, callback))
+
+    def execute(self, http=None):
+        # One round trip for the whole batch
+        self.backend.round_trip()
+        for request_id, request, callback in self.requests:
+            error = self.backend.batch_error(request.units)
+            if error is not None:
+                callback(request_id, None, error)
+            else:
+                callback(request_id, request.fn(), None)
+
+
+def list_page(items, page_token, max_results):
+    """The slice of `items` a list call returns, and the token for the next page if there is one"""
+    start = int(page_token or 0)
+    end = start + max_results
+    return items[start:end], str(end) if end < len(items) else None
+
+
+class Resource:
+    """Stands in for `service.users()`, `.messages()`, `.labels()` etc."""
+
+    def __init__(self, backend) -> None:
+        self.backend = backend
+
+    def messages(self):
+        return Messages(self.backend)
+
+    def threads(self):
+        return Threads(self.backend)
+
+    def labels(self):
+        return Labels(self.backend)
+
+    def history(self):
+        return History(self.backend)
+
+    def getProfile(self, userId):
+        def _get():
+            self.backend.count('users.getProfile')
+            return {'emailAddress': self.backend.email_address, 'historyId': str(self.backend.history_id)}
+        return FakeRequest(self.backend, _get, units=1)
+
+
+class Messages(Resource):
+    def list(self, userId, q=None, labelIds=None, maxResults=100, pageToken=None):
+        def _list():
+            self.backend.count('messages.list', q=q, labelIds=labelIds, maxResults=maxResults, pageToken=pageToken)
+            matches = self.backend.matching(q, labelIds)
+            page, next_page_token = list_page(matches, pageToken, maxResults)
+            response = {'resultSizeEstimate': len(matches)}
+            if len(page):
+                response['messages'] = [{'id': self.backend.message_id(m), 'threadId': self.backend.thread_id(m)}
+                                        for m in page]
+            if next_page_token:
+                response['nextPageToken'] = next_page_token
+            return response
+        return FakeRequest(self.backend, _list)
+
+    def get(self, userId, id, format='full', metadataHeaders=None):
+        def _get():
+            self.backend.count('messages.get', id=id, format=format, metadataHeaders=metadataHeaders)
+            self.backend.formats.add(format)
+            return self.backend.message(self.backend.message_key(id), format, metadataHeaders)
+        return FakeRequest(self.backend, _get)
+
+
+class Threads(Resource):
+    def list(self, userId, q=None, labelIds=None, maxResults=100, pageToken=None):
+        def _list():
+            self.backend.count('threads.list', q=q, labelIds=labelIds, maxResults=maxResults, pageToken=pageToken)
+            matches = self.backend.matching_threads(q, labelIds)
+            page, next_page_token = list_page(matches, pageToken, maxResults)
+            response = {'resultSizeEstimate': len(matches)}
+            if len(page):
+                response['threads'] = [{'id': self.backend.thread_id(m)} for m in page]
+            if next_page_token:
+                response['nextPageToken'] = next_page_token
+            return response
+        return FakeRequest(self.backend, _list, units=10)
+
+    def get(self, userId, id, format='full', metadataHeaders=None):
+        def _get():
+            self.backend.count('threads.get', id=id, format=format, metadataHeaders=metadataHeaders)
+            self.backend.formats.add(format)
+            return {'id': id, 'historyId': str(self.backend.history_id),
+                    'messages': [self.backend.message(m, format, metadataHeaders)
+                                 for m in self.backend.thread_messages(id)]}
+        return FakeRequest(self.backend, _get, units=10)
+
+
+class Labels(Resource):
+    def list(self, userId):
+        def _list():
+            self.backend.count('labels.list')
+            return {'labels': [{'id': label_id, 'name': name}
+                               for name, label_id in self.backend.labels_by_name.items()]}
+        return FakeRequest(self.backend, _list, units=1)
+
+
+class History(Resource):
+    def list(self, userId, startHistoryId, historyTypes=None, pageToken=None):
+        def _list():
+            self.backend.count('history.list', startHistoryId=startHistoryId)
+            if int(startHistoryId) < self.backend.oldest_history_id:
+                raise http_error(404)
+            records = [r for r in self.backend.history_records if int(r['id']) > int(startHistoryId)]
+            return {'history': records, 'historyId': str(self.backend.history_id)}
+        return FakeRequest(self.backend, _list, units=2)
+
+
+class FakeGmail:
+    """
+    A synthetic mailbox of `size` messages.
+
+    - `latency` is the time in seconds each HTTP round trip (a list call or a whole batch) takes
+    - `throttle_rate` is the fraction of batched requests that fail with a 429
+    - `quota` is the number of quota units per second we allow before returning 429s
+
+    Messages are referred to by their index. Subclasses can serve a different mailbox
+    by overriding the methods under "Messages", as the unit tests' fake does.
+    """
+
+    def __init__(self, size, latency=0.0, throttle_rate=0.0, quota=None,
+                 start=None, interval=600, senders=200, seed=0, record_requests=False) -> None:
+        self.size = size
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.quota = quota
+        if start is None:
+            start = int(time.time()) - size * interval
+        self.start_ms = start * 1000
+        self.interval_ms = interval * 1000
+        self.senders = senders
+        self.email_address = 'bench@example.com'
+        self.labels_by_name = {LABEL_NAMES[label_id]: label_id for label_id in LABELS}
+        # name => number of calls, e.g. 'messages.get'
+        self.calls = {}
+        # Every call as a (name, arguments) tuple, in order. Off by default, since a
+        # benchmark's calls would take more memory than the connector.
+        self.requests = [] if record_requests else None
+        # Every `format` messages.get was called with
+        self.formats = set()
+        self.throttles = 0
+        # Errors the next few batched requests fail with, see `fail_with`
+        self.errors = []
+        self.history_records = []
+        self.history_id = 1
+        # History from before this has expired, so listing it is a 404
+        self.oldest_history_id = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._quota_window = (0, 0)
+
+    # The parts of the googleapiclient service the connector uses
+    def users(self):
+        return Resource(self)
+
+    def new_batch_http_request(self):
+        return FakeBatch(self)
+
+    def round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def count(self, name, **arguments):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.requests is not None:
+                self.requests.append((name, arguments))
+
+    def call_count(self, name):
+        return self.calls.get(name, 0)
+
+    def fail_with(self, *statuses):
+        """The next few batched requests will fail with these HTTP statuses"""
+        self.errors.extend(http_error(status) for status in statuses)
+
+    def record_history(self, **changes):
+        """Records a history entry, e.g. `messagesDeleted=[{'message': {'id': '1'}}]`"""
+        self.history_id += 1
+        self.history_records.append(dict(changes, id=str(self.history_id)))
+
+    def batch_error(self, units):
+        """The error a batched request fails with, if any"""
+        with self._lock:
+            if self.errors:
+                return self.errors.pop(0)
+        return http_error(429) if self.throttled(units) else None
+
+    def throttled(self, units):
+        with self._lock:
+            throttle = self.throttle_rate and self._random.random() < self.throttle_rate
+            if self.quota:
+                second, used = self._quota_window
+                now = int(time.monotonic())
+                used = used if now == second else 0
+                throttle = throttle or used + units > self.quota
+                self._quota_window = (now, used if throttle else used + units)
+            if throttle:
+                self.throttles += 1
+            return throttle
+
+    # Messages
+    def message_key(self, message_id):
+        """The index of the message with the given ID"""
+        return int(message_id, 16)
+
+    def message_id(self, i):
+        return '%012x' % i
+
+    def thread_id(self, i):
+        # Every three messages make up a conversation
+        return '%012x' % (i - i % 3)
+
+    def thread_messages(self, thread_id):
+        """The indexes of the messages in the thread, oldest first"""
+        t = int(thread_id, 16)
+        return range(t, min(t + 3, self.size))
+
+    def internal_date(self, i):
+        return self.start_ms + i * self.interval_ms
+
+    def label_ids(self, i):
+        return [label_id for n, label_id in enumerate(LABELS) if i % (n + 2) == 0]
+
+    def headers(self, i):
+        sender = i % self.senders
+        return [
+            {'name': 'Subject', 'value': 'Synthetic message %d' % i},
+            {'name': 'From', 'value': 'Sender %d <sender%d@example%d.com>' % (sender, sender, sender % 7)},
+            {'name': 'To', 'value': self.email_address},
+            {'name': 'Cc', 'value': 'Sender %d <sender%d@example%d.com>' % (sender + 1, sender + 1, (sender + 1) % 7)},
+        ]
+
+    def body(self, i):
+        """A multipart/alternative payload, with base64url-encoded parts like `format=full` returns"""
+        text = ('Hello,\n\nThis is synthetic message %d.\n' % i) * (1 + i % 20)
+
+        def part(mime_type, value):
+            data = base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii').rstrip('=')
+            return {'mimeType': mime_type, 'filename': '',
+                    'headers': [{'name': 'Content-Type', 'value': '%s; charset="UTF-8"' % mime_type}],
+                    'body': {'size': len(value), 'data': data}}
+
+        return [part('text/plain', text), part('text/html', '<p>%s</p>' % text.replace('\n', '<br>'))]
+
+    def message(self, i, format='full', metadata_headers=None):
+        message = {
+            'id': self.message_id(i),
+            'threadId': self.thread_id(i),
+            'labelIds': self.label_ids(i),
+            'snippet': 'Synthetic message %d' % i,
+            'sizeEstimate': 1024 + i % 4096,
+            'historyId': str(self.history_id),
+            'internalDate': str(self.internal_date(i)),
+        }
+        if format == 'minimal':
+            return message
+        headers = self.headers(i)
+        if format == 'metadata' and metadata_headers:
+            wanted = set(h.lower() for h in metadata_headers)
+            headers = [h for h in headers if h['name'].lower() in wanted]
+        message['payload'] = {'mimeType': 'text/plain', 'headers': headers}
+        if format == 'full':
+            message['payload'].update(mimeType='multipart/alternative', parts=self.body(i))
+        return message
+
+    def matching(self, q, label_ids=None):
+        """Returns the indexes of matching messages, newest first, as a `range`"""
+        low, high = 0, self.size
+        for op, value in re.findall(r'(after|before):(\d+)', q or ''):
+            # Index of the first message sent at or after the given time
+            boundary = -(-(int(value) * 1000 - self.start_ms) // self.interval_ms)
+            boundary = min(max(boundary, 0), self.size)
+            if op == 'after':
+                low = max(low, boundary)
+            else:
+                high = min(high, boundary)
+
+        matches = range(high - 1, low - 1, -1)
+        if label_ids and len(matches):
+            # Messages are labelled when their index is a multiple of (label position + 2).
+            # We only support listing a single label at a time.
+            if label_ids[0] not in LABELS:
+                return range(0)
+            step = LABELS.index(label_ids[0]) + 2
+            first = matches[0] - matches[0] % step
+            matches = range(first, low - 1, -step)
+        return matches
+
+    def matching_threads(self, q, label_ids=None):
+        """The first message of every thread with a matching message, newest first"""
+        return list(dict.fromkeys(i - i % 3 for i in self.matching(q, label_ids)))
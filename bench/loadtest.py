@@ -0,0 +1,128 @@
+"""
+Load test of the connector's split fan-out against synthetic Gmail mailboxes.
+
+A local driver plays Athena, calling `lambda_handler` with GetTable, GetTableLayout and
+GetSplits, then running every split's ReadRecordsRequest concurrently. Each combination
+of split size and worker count is run against fresh mailboxes, and the rows read are
+checked against what the mailboxes hold.
+
+    python -m bench.loadtest --messages 20000 --accounts 2 --split-sizes 500,2000 --workers 1,4,16
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+
+# gathena reads this when it plans splits, for their spill locations
+os.environ.setdefault('TARGET_BUCKET', 'bench-spill-bucket')
+# Each fake mailbox models Gmail's per-user quota itself, with --quota
+os.environ.setdefault('GMAIL_QUOTA_UNITS_PER_SEC', '1000000000')
+
+import gathena  # noqa: E402
+import gmail.splits  # noqa: E402
+from athena.federation.spill import LocalStorage  # noqa: E402
+from bench.benchmark import percentile  # noqa: E402
+from bench.driver import MAX_INLINE_BLOCK_SIZE, FederationDriver, check_rows  # noqa: E402
+from bench.fake_gmail import LABEL_NAMES, FakeGmail  # noqa: E402
+from gmail.labels import ALL_MAIL, THREAD_MESSAGES, THREADS, clear_labels  # noqa: E402
+
+
+@contextlib.contextmanager
+def patched(backends, storage, split_size):
+    """Points the connector at a fake mailbox per account, a local spill directory and the given split size"""
+    original_service = gathena.GmailAthena._get_gmail_service
+    original_storage = gathena.GmailAthena._spill_storage
+    original_split_size = gmail.splits.TARGET_SPLIT_SIZE
+    gathena.GmailAthena._get_gmail_service = lambda self: backends[self._account()]
+    gathena.GmailAthena._spill_storage = lambda self: storage
+    gmail.splits.TARGET_SPLIT_SIZE = split_size
+    clear_labels()
+    try:
+        yield
+    finally:
+        gathena.GmailAthena._get_gmail_service = original_service
+        gathena.GmailAthena._spill_storage = original_storage
+        gmail.splits.TARGET_SPLIT_SIZE = original_split_size
+        clear_labels()
+
+
+def expected_rows(backend, table):
+    """How many rows a scan of `table` should return from the fake mailbox"""
+    if table.lower() == THREADS.lower():
+        return len(backend.matching_threads(None))
+    if table.lower() in (ALL_MAIL.lower(), THREAD_MESSAGES.lower()):
+        return len(backend.matching(None))
+    label_ids = [label_id for label_id, name in LABEL_NAMES.items() if name.lower() == table.lower()]
+    return len(backend.matching(None, label_ids))
+
+
+def run(messages=10000, accounts=1, split_size=2000, workers=4, latency=0.0, quota=None,
+        table=ALL_MAIL, columns=None, spill_dir=None, max_inline_block_size=MAX_INLINE_BLOCK_SIZE):
+    """Scans `table` in every account at once, like a UNION ALL, and returns the driver's results"""
+    backends = {'mailbox%d' % i: FakeGmail(messages, latency=latency, quota=quota, seed=i)
+                for i in range(1, accounts + 1)}
+    storage = LocalStorage(spill_dir or tempfile.mkdtemp(prefix='gathena-spill-'))
+    driver = FederationDriver(gathena.lambda_handler, gathena.CATALOG_NAME, storage, workers=workers,
+                              max_inline_block_size=max_inline_block_size)
+
+    with patched(backends, storage, split_size):
+        # The handler prints its metrics, which we don't want to see
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = driver.scan([(account, table) for account in backends], columns=columns)
+
+    check_rows(result, sum(expected_rows(backend, table) for backend in backends.values()))
+    reads = result.latencies.get('ReadRecordsRequest', [])
+    return {
+        'accounts': accounts,
+        'split_size': split_size,
+        'workers': workers,
+        'splits': result.splits,
+        'rows': result.rows,
+        'seconds': result.seconds,
+        'rows_per_second': result.rows_per_second,
+        'peak_concurrency': result.peak_concurrency,
+        'spilled_splits': result.spilled_splits,
+        'read_p50': percentile(reads, 50),
+        'read_p99': percentile(reads, 99),
+        'throttles': sum(backend.throttles for backend in backends.values()),
+    }
+
+
+def report(results):
+    print("%8s %10s %7s %6s %8s %8s %10s %9s %9s %9s" % (
+        "accounts", "split size", "workers", "splits", "rows", "seconds", "rows/s", "p50 ms", "p99 ms", "throttled"))
+    for r in results:
+        print("%8d %10d %7d %6d %8d %8.2f %10.0f %9.1f %9.1f %9d" % (
+            r['accounts'], r['split_size'], r['workers'], r['splits'], r['rows'], r['seconds'],
+            r['rows_per_second'], r['read_p50'] * 1000, r['read_p99'] * 1000, r['throttles']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10000, help="size of each synthetic mailbox")
+    parser.add_argument('--accounts', type=int, default=1, help="how many mailboxes to scan at once")
+    parser.add_argument('--split-sizes', default='2000', help="comma separated messages per split")
+    parser.add_argument('--workers', default='1,4,16', help="comma separated concurrent ReadRecords calls")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds per HTTP round trip")
+    parser.add_argument('--quota', type=int, default=None, help="quota units per second per mailbox")
+    parser.add_argument('--table', default=ALL_MAIL)
+    parser.add_argument('--columns', default=None, help="comma separated columns to select, defaults to all")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    columns = args.columns.split(',') if args.columns else None
+    results = [
+        run(args.messages, args.accounts, split_size, workers, args.latency, args.quota, args.table, columns)
+        for split_size in [int(s) for s in args.split_sizes.split(',')]
+        for workers in [int(w) for w in args.workers.split(',')]
+    ]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,141 +1,361 @@
-import pickle
 import os
-import time
 
-from googleapiclient.discovery import build
-import pyarrow as pa
-
-from athena.federation.utils import AthenaSDKUtils
 from athena.federation.federator import AthenaFederator
 import athena.federation.models as models
+from athena.federation.metrics import Metrics, log_payload, payload_size, should_log_payloads
+from gmail.accounts import DEFAULT_ACCOUNT, default_store
+from gmail.labels import ALL_MAIL, THREAD_MESSAGES, THREAD_TABLES, THREADS, labels_for
 
+# Arrow and the Google client libraries take hundreds of milliseconds to import, so
+# they're imported by the requests that use them rather than here. That keeps cold
+# starts for metadata requests like Ping and ListSchemas fast.
 
 # These variables are used for S3 spill locations
-S3_BUCKET = os.environ['TARGET_BUCKET']
 CATALOG_NAME = "gmail"
-# S3_PREFIX = os.environ['TARGET_PREFIX'].rstrip('/')  # Ensure that the prefix does *not* have a slash at the end
+# Ensure that the prefix does *not* have a slash at the end
+S3_PREFIX = os.environ.get('TARGET_PREFIX', 'athena-spill').rstrip('/')
 
 
-# We maintain a cache of Label names to IDs as we allow people to query by Label name
-# e.g. SELECT * FROM "your.email"."All Mail"
-# "All Mail" is a reserved system label that _does not_ show up in `users.labels.list` response
+def spill_bucket():
+    # Only requests that spill need this, so it's read when they do
+    return os.environ['TARGET_BUCKET']
 
 
 class GmailAthena(AthenaFederator):
     def __init__(self, event) -> None:
         super().__init__(event)
+        self.metrics = Metrics(dimensions={'Connector': CATALOG_NAME, 'RequestType': event['@type']})
 
     def PingRequest(self) -> models.PingResponse:
         return models.PingResponse(CATALOG_NAME, self.event['queryId'], "gmail")
 
+    def GetDataSourceCapabilitiesRequest(self) -> models.GetDataSourceCapabilitiesResponse:
+        return models.GetDataSourceCapabilitiesResponse(CATALOG_NAME, {
+            models.SUPPORTS_LIMIT_PUSHDOWN: [models.LIMIT_PUSHDOWN_INTEGER_CONSTANT]
+        })
+
     def ListSchemasRequest(self):
-        return models.ListSchemasResponse(CATALOG_NAME, ['personal'])
+        # Every mailbox we have credentials for is its own schema
+        return models.ListSchemasResponse(CATALOG_NAME, default_store().accounts())
 
     def ListTablesRequest(self) -> models.ListTablesResponse:
+        # Every label is exposed as its own table, alongside "All Mail"
         tableResponse = models.ListTablesResponse(CATALOG_NAME)
-        tableResponse.addTableDefinition("personal", "All Mail")
+        for table_name in labels_for(self._account()).table_names(self._get_gmail_service()):
+            tableResponse.addTableDefinition(self._account(), table_name)
         return tableResponse
 
     def GetTableRequest(self) -> models.GetTableResponse:
-        schema = pa.schema([('messageId', pa.string()),
-                            ('subject', pa.string()),
-                            ('from', pa.string()),
-                            ('sentDate', pa.string()),
-                            ('meta_gmailquery', pa.string())])
+        from gmail.partitions import PARTITION_COLUMNS
+        from gmail.schema import table_schema, threads_schema
+
+        schema_name, table_name = self._table_name()
+        # Make sure the label actually exists
+        self._label_ids(self._get_gmail_service())
+        thread_table = self._thread_table()
+        if thread_table is None:
+            schema, partition_columns = table_schema(), PARTITION_COLUMNS
+        else:
+            # Threads span months, so these tables aren't partitioned
+            schema = threads_schema() if thread_table == THREADS else table_schema()
+            partition_columns = []
         tr = models.GetTableResponse(
-            CATALOG_NAME, "personal", "All Mail", schema)
+            CATALOG_NAME, schema_name, table_name, schema, partition_columns)
         return tr
 
     def GetTableLayoutRequest(self) -> models.GetTableLayoutResponse:
-        # There are a lot of search operators built into Gmail ( https://support.google.com/mail/answer/7190?hl=en )
-        # and, as such, probably a lot of things we _can_ partition on.
-        # We won't partition yet, but at the very least it probably makes sense to partition on date...
+        from athena.federation.constraints import parse_constraints
+        from gmail.partitions import month_partitions, partition_batch, prune_partitions
+        from gmail.query import GmailSearch
 
-        # The partition schema above was reused from CloudTrail example - we need to
-        # add (also?) the schema we want to pass back in a split?
-        # e.g. messageIds: pa.list_(pa.int64())
-        return models.GetTableLayoutResponse(CATALOG_NAME, "personal", "All Mail", None)
+        schema_name, table_name = self._table_name()
+        if self._thread_table() is not None:
+            return models.GetTableLayoutResponse(CATALOG_NAME, schema_name, table_name)
+
+        # Every month since the mailbox started is a partition, minus any that
+        # constraints on `year`, `month` or `sentDate` rule out.
+        constraints = self.event.get('constraints')
+        search = GmailSearch.from_constraints(constraints)
+        partitions = []
+        if not search.empty:
+            partitions = prune_partitions(month_partitions(), parse_constraints(constraints), search.window())
+        self.metrics.count('Partitions', len(partitions))
+        return models.GetTableLayoutResponse(CATALOG_NAME, schema_name, table_name, partition_batch(partitions))
 
     def GetSplitsRequest(self) -> models.GetSplitsResponse:
+        from gmail.partitions import partition_windows, read_partitions
+        from gmail.query import GmailSearch
+        from gmail.splits import list_splits, spill_location, split_properties
+
+        # We list every message the query needs here, once, and hand each split a batch of
+        # message IDs to fetch. Only the partitions Athena kept are listed, further narrowed
+        # by any constraints in the query. Big mailboxes are listed over several requests.
+        # The thread tables list (and so split up) threads rather than messages.
+        search = GmailSearch.from_constraints(self.event.get('constraints'))
+        partitions = read_partitions(self.event.get('partitions'))
+        if partitions is None:
+            ranges = [search.window()]
+        else:
+            ranges = [search.window(after, before) for after, before in partition_windows(partitions)]
+        # Newest first, so a LIMIT is satisfied by recent mail
+        queries = [query for after, before in reversed(ranges) for query in search.queries(after, before)]
+
+        batches, continuation_token, mailbox = [], None, None
+        if queries:
+            svc = self._get_gmail_service()
+            if self._thread_table() is None:
+                mailbox = self._sync_cache(svc)
+            with self.metrics.timer('List'):
+                batches, continuation_token = list_splits(
+                    svc, queries, self._label_ids(svc), self.event.get('continuationToken'), limit=search.limit,
+                    resource='messages' if self._thread_table() is None else 'threads')
+        self.metrics.count('Splits', len(batches))
+
         splits = [
             {
-                "spillLocation": {
-                    "@type": "S3SpillLocation",
-                    "bucket": S3_BUCKET,
-                    "key": "athena-spill/7b2b96c9-1be5-4810-ac2a-163f754e132c/1a50edb8-c4c7-41d7-8a0d-1ce8e510755f",
-                    "directory": True
-                },
-                "properties": {}
+                "spillLocation": spill_location(spill_bucket(), S3_PREFIX, self.event['queryId']),
+                "properties": split_properties(meta_query, message_ids, mailbox)
             }
+            for meta_query, message_ids in batches
         ]
-        return models.GetSplitsResponse(CATALOG_NAME, splits)
+        return models.GetSplitsResponse(CATALOG_NAME, splits, continuation_token)
+
+    def _sync_cache(self, svc):
+        """
+        Brings the message cache up to date, once per query, and returns the mailbox it's for.
+        Returns None if the cache is disabled.
+        """
+        import gmail.cache
+
+        if not gmail.cache.MESSAGE_CACHE:
+            return None
+        profile = svc.users().getProfile(userId='me').execute()
+        if not self.event.get('continuationToken'):
+            with self.metrics.timer('CacheSync'):
+                gmail.cache.MessageCache.for_mailbox(profile['emailAddress']).sync(svc, profile.get('historyId'))
+        return profile['emailAddress']
+
+    def ReadRecordsRequest(self):
+        from athena.federation.spill import MAX_BLOCK_BYTES, MAX_INLINE_BYTES, BlockSpiller
+        from athena.federation.utils import AthenaSDKUtils
+        from gmail.query import GmailSearch
+        from gmail.splits import unpack_message_ids
 
-    def ReadRecordsRequest(self) -> models.ReadRecordsResponse:
         schema = AthenaSDKUtils.parse_encoded_schema(
             self.event['schema']['schema'])
 
-        # Try to get a list of message IDs from the gmail API
+        # Our split already lists exactly which messages to read
+        search = GmailSearch.from_constraints(self.event.get('constraints'))
+        split = self.event.get('split', {})
+        properties = split.get('properties', {})
+        message_ids = unpack_message_ids(properties)
+        meta_query = properties.get('meta_gmailquery', '')
+
+        # Results that are too big to return inline get spilled to S3
+        spiller = BlockSpiller(
+            split.get('spillLocation'),
+            self._spill_storage(),
+            max_inline_bytes=min(MAX_INLINE_BYTES, self.event.get('maxInlineBlockSize', MAX_INLINE_BYTES)),
+            encryption_key=split.get('encryptionKey'),
+            metrics=self.metrics,
+            max_block_bytes=self.event.get('maxBlockSize', MAX_BLOCK_BYTES))
+
         svc = self._get_gmail_service()
-        message_list = self._get_messages(svc)
-        records = {k: [] for k in schema.names}
-
-        # Create a function to process messages from the batch request
-        def process_message(request_id, response, exception):
-            if exception is not None:
-                # Do something with the exception
-                print("oops", exception)
-            else:
-                # Do something with the response
-                records['messageId'].append(response['id'])
-                records['subject'].append(
-                    [h['value'] for h in response.get("payload").get("headers") if h['name'] == 'Subject'][0])
-                records['from'].append(
-                    [h['value'] for h in response.get("payload").get("headers") if h['name'] == 'From'][0])
-                records['sentDate'].append(time.strftime(
-                    '%Y-%m-%d %H:%M:%S', time.localtime(int(response.get("internalDate"))/1000)))
-                records['meta_gmailquery'].append("")
-
-        # Create a new batch request that fetches each message from the API
-        batch = svc.new_batch_http_request()
-        for msg in message_list['messages']:
-            batch.add(svc.users().messages().get(
-                userId='me', id=msg['id']), callback=process_message)
-        batch.execute()
-        # .execute() is a blocking function
-
-        # Convert the records to pyarrow records
-        pa_records = AthenaSDKUtils.encode_pyarrow_records(schema, records)
-        return models.ReadRecordsResponse(CATALOG_NAME, schema, pa_records)
+        return spiller.response(
+            CATALOG_NAME, schema,
+            self._read_batches(svc, schema, meta_query, message_ids, search.limit, properties.get('mailbox')))
+
+    def _table_name(self):
+        table = self.event.get('tableName') or {}
+        return table.get('schemaName', DEFAULT_ACCOUNT), table.get('tableName', ALL_MAIL)
+
+    def _account(self):
+        """The mailbox we're querying, whose name is the schema name"""
+        return self.event.get('schemaName') or self._table_name()[0]
+
+    def _thread_table(self):
+        """Which of the thread tables we're reading, if any"""
+        table_name = self._table_name()[1].lower()
+        for name in THREAD_TABLES:
+            if name.lower() == table_name:
+                return name
+        return None
+
+    def _label_ids(self, svc):
+        """Label tables are listed with `labelIds=`, rather than a free-text search"""
+        label_id = labels_for(self._account()).label_id(svc, self._table_name()[1])
+        return [label_id] if label_id is not None else None
+
+    def _read_batches(self, svc, schema, meta_query, message_ids, limit=None, mailbox=None):
+        """
+        Fetches the given messages a page at a time and yields size-capped RecordBatches as we go.
+        If there's a `limit`, we stop fetching as soon as we have that many rows.
+
+        If the split says which `mailbox` it's for and caching is enabled, messages in the cache
+        are returned as they are first, and only the rest are fetched (and then cached).
+
+        The thread tables are given thread IDs instead, and fetch each conversation with a single
+        `threads.get`. "Threads" gets a row per thread, "Thread Messages" a row per message in them.
+        """
+        from gmail.cache import MessageCache, project
+
+        plan, builder, append = self._row_builder(schema)
+        request_kwargs = plan.request_kwargs()
+
+        # Messages we've seen before can come straight from the cache, if it's enabled
+        cache = MessageCache.for_mailbox(mailbox) if self._thread_table() is None else None
+        if cache is not None and not cache.can_serve(plan, schema):
+            cache = None
+        if cache is not None:
+            # We build rows with every column the cache keeps, and pick the query's out of them
+            request_kwargs = cache.request_kwargs()
+            builder = cache.builder()
+            append = builder.append_message
+            cached, message_ids, limit = self._lookup_cached(cache, message_ids, limit)
+            for batch in cached:
+                yield project(batch, schema, meta_query)
+
+        for batch in self._fetch_batches(svc, request_kwargs, plan.wants_body, builder, append,
+                                         meta_query, message_ids, limit):
+            if cache is not None:
+                cache.add(batch)
+                batch = project(batch, schema, meta_query)
+            yield batch
+
+        if cache is not None:
+            with self.metrics.timer('CacheSave'):
+                cache.save()
+            self.metrics.count('CacheHits', cache.hits)
+            self.metrics.count('CacheMisses', cache.misses)
+
+    def _row_builder(self, schema):
+        """Returns the FetchPlan for our columns, the builder for our rows and what appends a response to it"""
+        from gmail.projection import THREAD_HEADER_COLUMNS, FetchPlan
+        from gmail.rows import MessageRowBuilder
+        from gmail.threads import ThreadRowBuilder
+
+        # Only ask Gmail for the parts of the message our columns need
+        if self._thread_table() == THREADS:
+            plan = FetchPlan(schema.names, THREAD_HEADER_COLUMNS)
+            builder = ThreadRowBuilder(schema)
+            return plan, builder, builder.append_thread
+        plan = FetchPlan.from_schema(schema)
+        builder = MessageRowBuilder(schema, plan.header_columns)
+        return plan, builder, builder.append_message
+
+    def _lookup_cached(self, cache, message_ids, limit=None):
+        """
+        Returns the cached batches, up to `limit` rows of them, the message IDs that are left
+        to fetch and how many rows we still need from them.
+        """
+        with self.metrics.timer('CacheLookup'):
+            cached, missing = cache.lookup(message_ids)
+        if limit is None:
+            return cached, missing, None
+
+        batches = []
+        for batch in cached:
+            if limit <= 0:
+                break
+            batch = batch.slice(0, limit)
+            limit -= batch.num_rows
+            batches.append(batch)
+        return batches, missing, limit
+
+    def _fetch_batches(self, svc, request_kwargs, wants_body, builder, append, meta_query, ids, limit=None):
+        """Fetches the messages (or threads) a page at a time, and yields their rows from `builder`"""
+        from gmail.fetcher import MessageFetcher, quota_bucket
+        from gmail.mime import decode_bodies
+        from gmail.service import thread_http
+        from gmail.splits import PAGE_SIZE, chunked
+
+        thread_table = self._thread_table()
+        metrics = self.metrics
+        # Each mailbox has its own quota, so splits for different accounts never hold each other up
+        fetcher = MessageFetcher(svc, request_kwargs, bucket=quota_bucket(self._account()),
+                                 http_factory=lambda: thread_http(svc),
+                                 resource='messages' if thread_table is None else 'threads')
+
+        for page in chunked(ids, PAGE_SIZE):
+            if limit is not None:
+                if limit <= 0:
+                    break
+                page = page[:limit]
+
+            # Every batch for the page is already in flight, so collecting them doesn't cost us concurrency
+            with metrics.timer('Fetch'):
+                fetched = list(fetcher.fetch(page))
+            rows = fetched
+            if thread_table == THREAD_MESSAGES:
+                rows = [message for thread in fetched for message in thread.get('messages', ())]
+            if wants_body:
+                with metrics.timer('MimeDecode'):
+                    decode_bodies(rows)
+
+            with metrics.timer('RowBuild'):
+                for response in rows:
+                    append(response, meta_query)
+
+            yield from metrics.timed('RowBuild', builder.drain())
+            if limit is not None:
+                # Messages deleted since they were listed mean we may still be short.
+                # For "Thread Messages" this counts threads, so we'll have at least `limit` rows.
+                limit -= len(fetched)
+
+        yield from metrics.timed('RowBuild', builder.drain(final=True))
+        self._count_fetches(fetcher.stats)
+
+    def _count_fetches(self, stats):
+        resource = 'Messages' if self._thread_table() is None else 'Threads'
+        self.metrics.count(resource + 'Fetched', stats.messages)
+        self.metrics.count(resource + 'PerSecond', stats.messages_per_second, 'Count/Second')
+        self.metrics.count('BatchRequests', stats.requests)
+        self.metrics.count('Throttled', stats.throttled)
+        self.metrics.count('Retries', stats.retries)
+        self.metrics.count('NotFound', stats.errors)
 
     def _get_sample_records(self, schema):
+        import pyarrow as pa
+
         # records = {k: [] for k in schema.names}
         records = {'messageId': ["1", "2", "3", "4"],
                    'subject': ["hello", "happy", "boxing", "day"],
                    'from': ["i@loveyou.to", "me@you.ca", "you@somewhere.com", "bob@bob.com"],
-                   'sentDate': ["2020-12-18", "2020-12-20", "2020-12-26", "2020-12-26"],
+                   'sentDate': [1608249600000, 1608422400000, 1608940800000, 1608940800000],
                    'meta_gmailquery': ['', '', '', '']}
         pa_records = pa.RecordBatch.from_arrays(
-            [pa.array(records[name]) for name in schema.names], schema=schema)
+            [pa.array(records[name], type=schema.field(name).type) for name in schema.names], schema=schema)
         return pa_records
 
-    def _get_gmail_service(self):
-        creds = None
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-        service = build('gmail', 'v1', credentials=creds)
+    def _spill_storage(self):
+        # None means S3
+        return None
 
-        return service
+    def _get_gmail_service(self):
+        from gmail.service import get_service
 
-    def _get_messages(self, service):
-        # Perform a basic search
-        return service.users().messages().list(userId='me').execute()
+        # Clients are cached per account across warm invocations
+        return get_service(self._account(), metrics=self.metrics)
 
 
 def lambda_handler(event, context):
-    print(event)
+    # Payloads can be huge, so they're only logged in full at DEBUG
+    log_payloads = should_log_payloads()
+    if log_payloads:
+        log_payload(event)
     request_type = event['@type']
 
     ga = GmailAthena(event)
-    response = getattr(ga, request_type)().as_dict()
-    print(response)
+    metrics = ga.metrics
+    with metrics.timer('Total'):
+        response = getattr(ga, request_type)()
+        with metrics.timer('Encode'):
+            response = response.as_dict()
+
+    metrics.count('BytesIn', payload_size(event), 'Bytes')
+    metrics.count('BytesOut', payload_size(response), 'Bytes')
+    metrics.record_memory()
+    metrics.emit()
+    if log_payloads:
+        log_payload(response)
     return response
@@ -0,0 +1,148 @@
+import json
+import os
+import pickle
+from abc import ABCMeta, abstractmethod
+
+# Where each mailbox's OAuth credentials are kept. Either a local directory with a
+# `<account>.pickle` (as written by quickstart.py) or `<account>.json` file per mailbox,
+# or `secretsmanager://<prefix>` for a secret named `<prefix>/<account>` per mailbox.
+# If it isn't set, there's just the one mailbox, with its token at GMAIL_TOKEN_PATH.
+GMAIL_CREDENTIALS = os.environ.get('GMAIL_CREDENTIALS')
+
+TOKEN_PATH = os.environ.get('GMAIL_TOKEN_PATH', 'token.pickle')
+
+# The schema the only mailbox is exposed as when there's no credential store
+DEFAULT_ACCOUNT = 'personal'
+
+SECRETS_MANAGER = 'secretsmanager://'
+
+
+class UnknownAccountError(Exception):
+    pass
+
+
+def load_credentials(path=TOKEN_PATH):
+    with open(path, 'rb') as token:
+        return pickle.load(token)
+
+
+def credentials_from_json(value):
+    """Credentials from an authorized user JSON document, with `token`, `refresh_token`, `client_id` etc."""
+    from google.oauth2.credentials import Credentials
+    # Without an access token, it's refreshed before its first use
+    return Credentials.from_authorized_user_info(json.loads(value))
+
+
+class CredentialStore(metaclass=ABCMeta):
+    """
+    Where the credentials for each mailbox come from. Every account is exposed as its own schema.
+    """
+
+    @abstractmethod
+    def accounts(self):
+        """The name of every mailbox we have credentials for"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load(self, account):
+        """The Google credentials for one of `accounts()`"""
+        raise NotImplementedError
+
+    def resolve(self, schema_name):
+        """Athena lower-cases schema names, so we look accounts up case-insensitively"""
+        for account in self.accounts():
+            if account.lower() == schema_name.lower():
+                return account
+        raise UnknownAccountError("No credentials for a mailbox named %s" % schema_name)
+
+
+class TokenFileStore(CredentialStore):
+    """A single mailbox, whose token is in one file"""
+
+    def __init__(self, path=TOKEN_PATH, account=DEFAULT_ACCOUNT) -> None:
+        self.path = path
+        self.account = account
+
+    def accounts(self):
+        return [self.account]
+
+    def load(self, account):
+        return load_credentials(self.path)
+
+
+class DirectoryStore(CredentialStore):
+    """A `<account>.pickle` or `<account>.json` file per mailbox"""
+
+    EXTENSIONS = ('.pickle', '.json')
+
+    def __init__(self, directory) -> None:
+        self.directory = directory
+
+    def accounts(self):
+        names = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+        return sorted(set(os.path.splitext(name)[0] for name in names
+                          if os.path.splitext(name)[1] in self.EXTENSIONS))
+
+    def load(self, account):
+        path = os.path.join(self.directory, account)
+        if os.path.exists(path + '.pickle'):
+            return load_credentials(path + '.pickle')
+        if os.path.exists(path + '.json'):
+            with open(path + '.json') as document:
+                return credentials_from_json(document.read())
+        raise UnknownAccountError("No credentials for a mailbox named %s" % account)
+
+
+class SecretsManagerStore(CredentialStore):
+    """An authorized user JSON secret per mailbox, named `<prefix>/<account>`"""
+
+    def __init__(self, prefix, client=None) -> None:
+        self.prefix = prefix.rstrip('/')
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            # boto3 is included in the Lambda runtime, so we only import it if we use it
+            import boto3
+            self._client = boto3.client('secretsmanager')
+        return self._client
+
+    def accounts(self):
+        accounts = []
+        kwargs = {'Filters': [{'Key': 'name', 'Values': [self.prefix + '/']}]}
+        while True:
+            response = self.client.list_secrets(**kwargs)
+            accounts.extend(secret['Name'][len(self.prefix) + 1:] for secret in response.get('SecretList', [])
+                            if secret['Name'].startswith(self.prefix + '/'))
+            if not response.get('NextToken'):
+                return sorted(accounts)
+            kwargs['NextToken'] = response['NextToken']
+
+    def load(self, account):
+        secret = self.client.get_secret_value(SecretId='%s/%s' % (self.prefix, account))
+        return credentials_from_json(secret['SecretString'])
+
+
+def credential_store(location=GMAIL_CREDENTIALS):
+    if not location:
+        return TokenFileStore()
+    if location.startswith(SECRETS_MANAGER):
+        return SecretsManagerStore(location[len(SECRETS_MANAGER):])
+    return DirectoryStore(location)
+
+
+_store = None
+
+
+def default_store():
+    """The store is created once per container"""
+    global _store
+    if _store is None:
+        _store = credential_store()
+    return _store
+
+
+def load_account_credentials(schema_name, store=None):
+    store = store or default_store()
+    return store.load(store.resolve(schema_name))
@@ -0,0 +1,403 @@
+import json
+import os
+import re
+import sys
+import time
+from bisect import bisect_left
+from uuid import uuid4
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from googleapiclient.errors import HttpError
+
+from athena.federation.spill import LocalStorage, S3Storage
+from gmail.projection import HEADER_COLUMNS
+from gmail.rows import MAX_BATCH_ROWS, MessageRowBuilder
+from gmail.schema import table_schema
+
+# Where to keep the message cache, either `s3://bucket/prefix` or a local directory.
+# The cache is disabled if this isn't set.
+MESSAGE_CACHE = os.environ.get('MESSAGE_CACHE')
+
+# Segments older than this are evicted, as are the oldest segments once we cache too many messages
+MAX_AGE_SECONDS = int(os.environ.get('MESSAGE_CACHE_MAX_AGE_DAYS', 30)) * 86400
+MAX_MESSAGES = int(os.environ.get('MESSAGE_CACHE_MAX_MESSAGES', 1000000))
+
+# Once we have this many segments, they're compacted into as few as possible
+MAX_SEGMENTS = 20
+COMPACTED_SEGMENT_ROWS = 50000
+
+# Segments are sorted by messageId, so a split only decodes the row groups that overlap its IDs
+ROW_GROUP_ROWS = 5000
+
+# Bump this whenever the segment schema changes
+CACHE_VERSION = 3
+
+HISTORY_TYPES = ['labelAdded', 'labelRemoved', 'messageDeleted']
+
+# Bodies are too big to keep, and `meta_gmailquery` depends on the query
+UNCACHED_COLUMNS = ['body', 'meta_gmailquery']
+
+# Message IDs are hex, so a segment's range of them can go in its key
+KEY_SAFE_ID = re.compile(r'^[0-9A-Za-z]+$')
+
+
+def segment_schema():
+    """The cached columns of the message tables, plus a marker for deleted messages"""
+    return pa.schema([field for field in table_schema() if field.name not in UNCACHED_COLUMNS]
+                     + [pa.field('deleted', pa.bool_())])
+
+
+def parse_location(location):
+    """Splits a cache location into a (storage, bucket, prefix) tuple"""
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        return S3Storage(), bucket, prefix.rstrip('/')
+    return LocalStorage(location), '', ''
+
+
+def _column(batch, name):
+    return batch.column(batch.schema.get_field_index(name))
+
+
+def _take(batch, indices):
+    indices = pa.array(indices, type=pa.int64())
+    return pa.RecordBatch.from_arrays([column.take(indices) for column in batch.columns], schema=batch.schema)
+
+
+def _overlaps(ordered_ids, first, last):
+    """Whether any of the sorted IDs is in [first, last]. An unknown bound matches anything."""
+    i = bisect_left(ordered_ids, first) if first else 0
+    return i < len(ordered_ids) and (not last or ordered_ids[i] <= last)
+
+
+def project(batch, schema, meta_query=""):
+    """Picks the query's columns out of a batch of cached rows, filling in `meta_gmailquery`"""
+    columns = []
+    for field in schema:
+        if field.name == 'meta_gmailquery':
+            columns.append(pa.array([meta_query] * batch.num_rows, type=field.type))
+        else:
+            columns.append(_column(batch, field.name))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+class Segment:
+    """
+    A Parquet file of cached rows. Everything else we need to know about it is in its key,
+    `segments/<created ms>-<rows>-<first messageId>-<last messageId>-<uuid>.parquet`,
+    so listing the segments is all the manifest there is.
+    """
+
+    def __init__(self, key, created, rows, first, last) -> None:
+        self.key = key
+        self.created = created
+        self.rows = rows
+        self.first = first
+        self.last = last
+
+    @classmethod
+    def parse(cls, key):
+        """Returns the segment with the given key, or None if it isn't one"""
+        name = key.rpartition('/')[2]
+        parts = name[:-len('.parquet')].split('-')
+        if not name.endswith('.parquet') or len(parts) != 5:
+            return None
+        return cls(key, int(parts[0]) / 1000.0, int(parts[1]), parts[2], parts[3])
+
+    @staticmethod
+    def name(created, rows, first, last):
+        first, last = [i if KEY_SAFE_ID.match(i or '') else '' for i in (first, last)]
+        return "%013d-%d-%s-%s-%s.parquet" % (int(created * 1000), rows, first, last, uuid4().hex)
+
+
+class MessageCache:
+    """
+    A cache of message metadata for one mailbox, stored as Parquet segments of the table's own columns.
+
+    Messages are immutable apart from their labels, so once a message is cached we only need to
+    follow `users.history.list` from the last `historyId` we saw to keep label changes and
+    deletions up to date. That happens once per query, when Athena asks for splits (`sync`),
+    which is also when old segments are evicted and small ones compacted.
+
+    Each split writes the messages it had to fetch as a new segment of its own, so concurrent
+    splits never overwrite each other. Splits look their messages up by reading only the
+    segments, and row groups, whose range of message IDs overlaps theirs, and return the cached
+    rows as they are. Where a message is in several segments, the newest one wins.
+    """
+
+    def __init__(self, storage, bucket, prefix, mailbox,
+                 max_age=MAX_AGE_SECONDS, max_messages=MAX_MESSAGES, clock=time.time) -> None:
+        self.storage = storage
+        self.bucket = bucket
+        self.prefix = "/".join(p for p in [prefix, mailbox] if p)
+        self.schema = segment_schema()
+        # What we build fetched messages into, before they're marked as not deleted
+        self.row_schema = pa.schema([field for field in self.schema if field.name != 'deleted'])
+        self.header_columns = {column: header for column, header in HEADER_COLUMNS.items()
+                               if column in self.schema.names}
+        self.max_age = max_age
+        self.max_messages = max_messages
+        self.clock = clock
+
+        self.pending = []
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_mailbox(cls, mailbox, location=None, **kwargs):
+        """Returns the cache for the given email address, or None if caching is disabled"""
+        location = MESSAGE_CACHE if location is None else location
+        if not location or not mailbox:
+            return None
+        storage, bucket, prefix = parse_location(location)
+        return cls(storage, bucket, prefix, mailbox, **kwargs)
+
+    def _key(self, name):
+        return "%s/%s" % (self.prefix, name) if self.prefix else name
+
+    def request_kwargs(self):
+        """We always cache every header we know about, so cached messages can serve any query"""
+        return {'format': 'metadata', 'metadataHeaders': list(self.header_columns.values())}
+
+    def can_serve(self, plan, schema):
+        return (plan.format in ('minimal', 'metadata')
+                and set(plan.header_columns) <= set(self.header_columns)
+                and all(name in self.schema.names or name == 'meta_gmailquery' for name in schema.names))
+
+    def builder(self):
+        """Builds fetched messages into rows for the cache"""
+        return MessageRowBuilder(self.row_schema, self.header_columns)
+
+    def segments(self):
+        segments = [Segment.parse(key) for key in self.storage.list(self.bucket, self._key('segments/'))]
+        return sorted((s for s in segments if s is not None), key=lambda s: (s.created, s.key))
+
+    def _read_state(self):
+        data = self.storage.get(self.bucket, self._key('state.json'))
+        state = json.loads(data) if data else None
+        if state is None or state.get('version') != CACHE_VERSION:
+            return None
+        return state
+
+    def _write_state(self, history_id):
+        state = {'version': CACHE_VERSION, 'historyId': history_id}
+        self.storage.put(self.bucket, self._key('state.json'), json.dumps(state).encode('utf-8'))
+
+    def sync(self, service, history_id):
+        """
+        Brings the cache up to date with the mailbox, whose current historyId is `history_id`.
+        Applies label changes and deletions since the last sync, then evicts and compacts segments.
+        """
+        state = self._read_state()
+        if state is None:
+            # A new cache, or one written by another version that we can't read
+            self.invalidate()
+            self._write_state(history_id)
+            return
+
+        segments = self.segments()
+        if segments and state.get('historyId') is not None:
+            try:
+                history_id = self._apply_history(service, state['historyId'], segments)
+            except HttpError as e:
+                # Gmail only keeps about a week of history, after which we have to start over
+                if int(e.resp.status) != 404:
+                    raise
+                self.invalidate()
+                self._write_state(history_id)
+                return
+            segments = self.segments()
+
+        segments = self._evict(segments)
+        if len(segments) > MAX_SEGMENTS:
+            self.compact(segments)
+        self._write_state(history_id)
+
+    def _history(self, service, start):
+        """Returns (deleted message IDs, {message ID: labelIds}, historyId) for the changes since `start`"""
+        deleted, labels = set(), {}
+        page_token = None
+        while True:
+            response = service.users().history().list(
+                userId='me', startHistoryId=start, historyTypes=HISTORY_TYPES, pageToken=page_token).execute()
+            for record in response.get('history', []):
+                for change in record.get('messagesDeleted', []):
+                    deleted.add(change['message']['id'])
+                    labels.pop(change['message']['id'], None)
+                for change in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                    message = change['message']
+                    if message['id'] not in deleted:
+                        labels[message['id']] = message.get('labelIds', [])
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return deleted, labels, response.get('historyId', start)
+
+    def _apply_history(self, service, start, segments):
+        """Writes changed labels and deletions as a new segment, and returns the historyId they bring us up to"""
+        deleted, labels, history_id = self._history(service, start)
+        if not deleted and not labels:
+            return history_id
+
+        cached, found = self._lookup(set(labels) | deleted, segments)
+        batches = []
+        for batch in cached:
+            ids = _column(batch, 'messageId').to_pylist()
+            batch = _take(batch, [i for i, message_id in enumerate(ids) if message_id in labels])
+            ids = _column(batch, 'messageId').to_pylist()
+            columns = [pa.array([labels[i] for i in ids], type=field.type) if field.name == 'labelIds'
+                       else _column(batch, field.name) for field in self.schema]
+            batches.append(pa.RecordBatch.from_arrays(columns, schema=self.schema))
+        deleted &= found
+        if deleted:
+            # Just enough to hide any older copies of the message
+            ids = sorted(deleted)
+            batches.append(pa.RecordBatch.from_arrays(
+                [pa.array(ids) if field.name == 'messageId'
+                 else pa.array([True] * len(ids)) if field.name == 'deleted'
+                 else pa.array([None] * len(ids), type=field.type) for field in self.schema],
+                schema=self.schema))
+        batches = [batch for batch in batches if batch.num_rows]
+        if batches:
+            self._write_segment(batches, self.clock())
+        return history_id
+
+    def _read(self, segment, ordered_ids=None):
+        """The batches of the segment's row groups that could hold any of the sorted IDs, or all of them"""
+        data = self.storage.get(self.bucket, segment.key)
+        if data is None:
+            # Evicted or compacted since we listed it
+            return []
+        parquet = pq.ParquetFile(pa.BufferReader(data))
+        column = parquet.schema.names.index('messageId')
+        groups = []
+        for i in range(parquet.num_row_groups):
+            statistics = parquet.metadata.row_group(i).column(column).statistics
+            bounds = (statistics.min, statistics.max) if statistics is not None and statistics.has_min_max \
+                else (None, None)
+            if ordered_ids is None or _overlaps(ordered_ids, *bounds):
+                groups.append(i)
+        return parquet.read_row_groups(groups).to_batches() if groups else []
+
+    def _lookup(self, message_ids, segments):
+        """
+        Returns ([RecordBatch of the newest row of each cached message, ...], {message IDs we found}).
+        Messages that were deleted count as found, but have no row.
+        """
+        wanted = set(message_ids)
+        ordered = sorted(wanted)
+        found = set()
+        batches = []
+        for segment in reversed(segments):
+            if len(found) == len(wanted):
+                break
+            if not _overlaps(ordered, segment.first, segment.last):
+                continue
+            for batch in self._read(segment, ordered):
+                ids = _column(batch, 'messageId').to_numpy(zero_copy_only=False)
+                take = np.fromiter((i in wanted and i not in found for i in ids), dtype=bool, count=len(ids))
+                if not take.any():
+                    continue
+                found.update(ids[take])
+                deleted = _column(batch, 'deleted').to_numpy(zero_copy_only=False).astype(bool)
+                indices = np.flatnonzero(take & ~deleted)
+                if len(indices):
+                    batches.append(_take(batch, indices))
+        return batches, found
+
+    def lookup(self, message_ids):
+        """
+        Returns a tuple of ([RecordBatch of cached rows, ...], message IDs we have yet to fetch).
+        Cached rows have the columns of `segment_schema`, in batches of at most MAX_BATCH_ROWS.
+        """
+        batches, found = self._lookup(message_ids, self.segments())
+        missing = [message_id for message_id in message_ids if message_id not in found]
+        self.hits += len(message_ids) - len(missing)
+        self.misses += len(missing)
+        return self._rebatch(batches), missing
+
+    def _rebatch(self, batches):
+        """Joins the little batches we took from each row group into batches of up to MAX_BATCH_ROWS"""
+        rows = sum(batch.num_rows for batch in batches)
+        if len(batches) <= 1 and rows <= MAX_BATCH_ROWS:
+            return batches
+        columns = [pa.concat_arrays([batch.column(i) for batch in batches]) for i in range(len(self.schema))]
+        batch = pa.RecordBatch.from_arrays(columns, schema=self.schema)
+        return [batch.slice(offset, MAX_BATCH_ROWS) for offset in range(0, rows, MAX_BATCH_ROWS)]
+
+    def add(self, batch):
+        """Caches a batch of rows built by `builder`"""
+        self.pending.append(pa.RecordBatch.from_arrays(
+            batch.columns + [pa.array([False] * batch.num_rows)], schema=self.schema))
+
+    def save(self):
+        """Writes the rows we've added as a new segment"""
+        if self.pending:
+            self._write_segment(self.pending, self.clock())
+            self.pending = []
+
+    def _sorted(self, batches):
+        """Concatenates the batches into one, sorted by messageId"""
+        columns = [pa.concat_arrays([batch.column(i) for batch in batches]) for i in range(len(self.schema))]
+        ids = columns[self.schema.get_field_index('messageId')].to_numpy(zero_copy_only=False)
+        order = pa.array(np.argsort(ids, kind='stable'), type=pa.int64())
+        return pa.RecordBatch.from_arrays([column.take(order) for column in columns], schema=self.schema)
+
+    def _write_segment(self, batches, created):
+        batch = self._sorted(batches)
+        ids = _column(batch, 'messageId')
+        name = Segment.name(created, batch.num_rows, ids[0].as_py(), ids[len(ids) - 1].as_py())
+        out = pa.BufferOutputStream()
+        pq.write_table(pa.Table.from_batches([batch]), out, row_group_size=ROW_GROUP_ROWS)
+        self.storage.put(self.bucket, self._key('segments/' + name), out.getvalue().to_pybytes())
+
+    def _evict(self, segments):
+        """Drops segments that are too old, then the oldest ones until we're under our message cap"""
+        now = self.clock()
+        keep = [s for s in segments if now - s.created <= self.max_age]
+        while keep and sum(s.rows for s in keep) > self.max_messages:
+            keep.pop(0)
+
+        for segment in segments:
+            if segment not in keep:
+                self.storage.delete(self.bucket, segment.key)
+        return keep
+
+    def compact(self, segments):
+        """Rewrites the newest row of every message into as few segments as possible"""
+        seen = set()
+        batches = []
+        for segment in reversed(segments):
+            for batch in self._read(segment):
+                ids = _column(batch, 'messageId').to_numpy(zero_copy_only=False)
+                take = np.fromiter((i not in seen for i in ids), dtype=bool, count=len(ids))
+                seen.update(ids)
+                # Deleted messages have nothing older left to hide
+                deleted = _column(batch, 'deleted').to_numpy(zero_copy_only=False).astype(bool)
+                indices = np.flatnonzero(take & ~deleted)
+                if len(indices):
+                    batches.append(_take(batch, indices))
+
+        if batches:
+            batch = self._sorted(batches)
+            # Keep the age of the newest segment, so rows written since we listed them still win
+            created = segments[-1].created
+            for offset in range(0, batch.num_rows, COMPACTED_SEGMENT_ROWS):
+                self._write_segment([batch.slice(offset, COMPACTED_SEGMENT_ROWS)], created)
+        for segment in segments:
+            self.storage.delete(self.bucket, segment.key)
+
+    def invalidate(self):
+        """Throws away everything we have cached for this mailbox"""
+        for key in self.storage.list(self.bucket, self._key('')):
+            self.storage.delete(self.bucket, key)
+        self.pending = []
+
+
+if __name__ == '__main__':
+    # python -m gmail.cache invalidate <email address>
+    if len(sys.argv) != 3 or sys.argv[1] != 'invalidate' or not MESSAGE_CACHE:
+        sys.exit("Usage: MESSAGE_CACHE=<location> python -m gmail.cache invalidate <email address>")
+    MessageCache.for_mailbox(sys.argv[2]).invalidate()
+    print("Invalidated the message cache for %s" % sys.argv[2])
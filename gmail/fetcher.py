@@ -0,0 +1,255 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from googleapiclient.errors import HttpError
+
+from gmail.splits import chunked
+
+# Gmail recommends no more than 100 calls per batch HTTP request
+FETCH_BATCH_SIZE = 100
+
+# How many batch requests we have in flight at once
+FETCH_CONCURRENCY = int(os.environ.get('FETCH_CONCURRENCY', 4))
+
+# The most fetch threads a process has. Lambda only ever runs one invocation per process,
+# which uses FETCH_CONCURRENCY of them, but concurrent local invocations share the pool.
+MAX_FETCH_THREADS = 64
+
+# Gmail allows 250 quota units per user per second. `messages.get` costs 5 of them and
+# `threads.get` 10, however many messages the thread has.
+# Note that concurrent splits for the same mailbox all draw from this same quota,
+# but every mailbox has a quota of its own.
+QUOTA_UNITS_PER_SECOND = int(os.environ.get('GMAIL_QUOTA_UNITS_PER_SEC', 250))
+MESSAGES_GET_UNITS = 5
+THREADS_GET_UNITS = 10
+GET_UNITS = {'messages': MESSAGES_GET_UNITS, 'threads': THREADS_GET_UNITS}
+
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 32
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = (b'rateLimitExceeded', b'userRateLimitExceeded')
+
+
+class FetchError(Exception):
+    """Raised when messages still can't be fetched after all our retries"""
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def shared_executor(workers):
+    """
+    Worker threads live for the life of the process, so any per-thread
+    HTTP connections stay open across warm invocations.
+    """
+    with _executors_lock:
+        if workers not in _executors:
+            _executors[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gmail-fetch')
+        return _executors[workers]
+
+
+def is_not_found(exception):
+    # Messages can be deleted in between listing and fetching them
+    return isinstance(exception, HttpError) and int(exception.resp.status) == 404
+
+
+def is_retryable(exception):
+    if not isinstance(exception, HttpError):
+        # Connection resets, timeouts and the like
+        return isinstance(exception, (OSError, TimeoutError))
+    status = int(exception.resp.status)
+    if status in RETRYABLE_STATUSES:
+        return True
+    return status == 403 and any(r in (exception.content or b'') for r in RATE_LIMIT_REASONS)
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, maximum=BACKOFF_MAX):
+    """Exponential backoff with jitter, `attempt` starts at 1"""
+    return min(maximum, base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+
+class TokenBucket:
+    """
+    Hands out quota units at `rate` units per second.
+    Callers may go into debt, in which case they wait for it to be paid back.
+    """
+
+    def __init__(self, rate=QUOTA_UNITS_PER_SECOND, capacity=None, clock=time.monotonic, sleep=time.sleep) -> None:
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, units):
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= units
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def quota_bucket(account):
+    """
+    Gmail's quota is per user, so every fetch from the same mailbox in this process
+    shares a bucket, while different mailboxes never wait on each other.
+    """
+    with _buckets_lock:
+        if account not in _buckets:
+            _buckets[account] = TokenBucket()
+        return _buckets[account]
+
+
+class FetchStats:
+    def __init__(self) -> None:
+        self.messages = 0
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def messages_per_second(self):
+        return self.messages / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class MessageFetcher:
+    """
+    Fetches messages with several batch HTTP requests in flight at once.
+
+    Each batch spends quota from a shared token bucket first, and any messages that
+    were rate limited or hit a server error are retried with jittered exponential backoff.
+    Messages that no longer exist (404) are skipped, any other error fails the fetch.
+
+    With `resource='threads'` whole conversations are fetched with `threads.get` instead.
+    """
+
+    def __init__(self, service, request_kwargs=None, concurrency=FETCH_CONCURRENCY,
+                 batch_size=FETCH_BATCH_SIZE, bucket=None, http_factory=None, sleep=time.sleep,
+                 resource='messages') -> None:
+        self.service = service
+        self.request_kwargs = request_kwargs or {}
+        self.resource = resource
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.bucket = bucket or TokenBucket()
+        # httplib2 isn't thread safe, so each worker can get its own connection
+        self.http_factory = http_factory or (lambda: None)
+        self.sleep = sleep
+        self.stats = FetchStats()
+
+    def fetch(self, message_ids):
+        """
+        Yields the `messages.get` (or `threads.get`) response for each ID, in no particular order.
+        """
+        if self.concurrency <= 1:
+            for chunk in chunked(message_ids, self.batch_size):
+                yield from self._fetch_batch(chunk)
+            return
+
+        # We keep `concurrency` batches in flight, starting the next as each one finishes
+        executor = shared_executor(MAX_FETCH_THREADS)
+        chunks = chunked(message_ids, self.batch_size)
+        running = set()
+        try:
+            for chunk in chunks:
+                running.add(executor.submit(self._fetch_batch, chunk))
+                if len(running) < self.concurrency:
+                    continue
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        finally:
+            # If we're stopped early, don't bother fetching batches that haven't started yet
+            for future in running:
+                future.cancel()
+
+    def _fetch_batch(self, message_ids):
+        """Fetches one batch worth of messages, retrying failures until they succeed"""
+        responses = []
+        pending = list(message_ids)
+        attempt = 0
+        while pending:
+            attempt += 1
+            failed = self._execute_batch(pending, responses)
+            if not failed:
+                break
+            if attempt >= MAX_ATTEMPTS:
+                raise FetchError("Unable to fetch %d messages after %d attempts: %s" % (
+                    len(failed), attempt, failed[0][1]))
+
+            self.stats.add(retries=len(failed))
+            self.sleep(backoff_delay(attempt))
+            pending = [message_id for message_id, _ in failed]
+
+        self.stats.add(messages=len(responses))
+        return responses
+
+    def _execute_batch(self, message_ids, responses):
+        """Runs a single batch request and returns a list of (message_id, exception) that should be retried"""
+        self.bucket.acquire(GET_UNITS[self.resource] * len(message_ids))
+        self.stats.add(requests=1)
+
+        failed = []
+        fatal = []
+
+        def callback(request_id, response, exception):
+            message_id = message_ids[int(request_id)]
+            if exception is None:
+                responses.append(response)
+            elif is_retryable(exception):
+                self.stats.add(throttled=1)
+                failed.append((message_id, exception))
+            elif is_not_found(exception):
+                self.stats.add(errors=1)
+            else:
+                fatal.append((message_id, exception))
+
+        batch = self.service.new_batch_http_request()
+        for i, message_id in enumerate(message_ids):
+            batch.add(getattr(self.service.users(), self.resource)().get(
+                userId='me', id=message_id, **self.request_kwargs), callback=callback, request_id=str(i))
+        try:
+            batch.execute(http=self.http_factory())
+        except Exception as e:
+            # If the whole batch request failed, retry every message that didn't come back
+            if not is_retryable(e):
+                raise
+            self.stats.add(throttled=1)
+            done = set(r['id'] for r in responses) | set(m for m, _ in failed)
+            failed.extend((m, e) for m in message_ids if m not in done)
+
+        if fatal:
+            raise FetchError("Unable to fetch message %s: %s" % fatal[0])
+        return failed
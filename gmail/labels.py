@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+
+# "All Mail" is a reserved system label that _does not_ show up in `users.labels.list` response
+ALL_MAIL = "All Mail"
+
+# Conversations across all mail, one row per thread, and every message of those threads
+THREADS = "Threads"
+THREAD_MESSAGES = "Thread Messages"
+THREAD_TABLES = [THREADS, THREAD_MESSAGES]
+
+# How long we trust our list of labels before asking Gmail again
+LABEL_CACHE_TTL = int(os.environ.get('LABEL_CACHE_TTL', 300))
+
+
+class UnknownTableError(Exception):
+    pass
+
+
+class LabelIndex:
+    """
+    A cache of Label names to IDs, as we allow people to query by Label name
+    e.g. SELECT * FROM "personal"."Inbox"
+
+    Athena lower-cases table names, so lookups are case-insensitive.
+    There's an index per mailbox at module level, so they're shared across warm invocations.
+    """
+
+    def __init__(self, ttl=LABEL_CACHE_TTL, clock=time.monotonic) -> None:
+        self.ttl = ttl
+        self.clock = clock
+        self._labels = {}
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def labels(self, service):
+        """Returns a dict of label name => label ID"""
+        with self._lock:
+            if self._loaded is None or self.clock() - self._loaded > self.ttl:
+                response = service.users().labels().list(userId='me').execute()
+                self._labels = {label['name']: label['id'] for label in response.get('labels', [])}
+                self._loaded = self.clock()
+            return self._labels
+
+    def table_names(self, service):
+        return [ALL_MAIL] + THREAD_TABLES + sorted(self.labels(service))
+
+    def label_id(self, service, table_name):
+        """
+        Returns the label ID to list for the given table, or None for "All Mail" and the thread tables.
+        """
+        if table_name.lower() in (name.lower() for name in [ALL_MAIL] + THREAD_TABLES):
+            return None
+        for name, label_id in self.labels(service).items():
+            if name.lower() == table_name.lower():
+                return label_id
+        raise UnknownTableError("No label named %s" % table_name)
+
+    def clear(self):
+        with self._lock:
+            self._loaded = None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def labels_for(account):
+    """Every mailbox has its own labels"""
+    with _indexes_lock:
+        if account not in _indexes:
+            _indexes[account] = LabelIndex()
+        return _indexes[account]
+
+
+def clear_labels():
+    with _indexes_lock:
+        for index in _indexes.values():
+            index.clear()
@@ -0,0 +1,185 @@
+import base64
+import binascii
+import html
+import multiprocessing
+import os
+import re
+import threading
+
+# How many processes decode message bodies. Lambda gets a vCPU per 1,769MB of memory.
+MIME_WORKERS = int(os.environ.get('MIME_WORKERS', os.cpu_count() or 1))
+
+# Pages smaller than this are decoded in-process, where pickling them costs more than it saves
+MIN_POOL_MESSAGES = 50
+
+TAG_RE = re.compile(r'<(script|style)\b.*?</\1\s*>|<[^>]+>', re.IGNORECASE | re.DOTALL)
+BLANK_LINES_RE = re.compile(r'\n\s*\n\s*\n+')
+CHARSET_RE = re.compile(r'charset="?([\w.:-]+)', re.IGNORECASE)
+
+
+def _part_header(part, name):
+    for header in part.get('headers', ()):
+        if header['name'].lower() == name:
+            return header['value']
+    return None
+
+
+def _part_text(part):
+    """base64url-decodes a MIME part's body into text, using its declared charset"""
+    data = part.get('body', {}).get('data')
+    if not data:
+        return None
+    try:
+        # Gmail leaves off the padding
+        raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    except (binascii.Error, ValueError):
+        return None
+
+    match = CHARSET_RE.search(_part_header(part, 'content-type') or '')
+    try:
+        return raw.decode(match.group(1) if match else 'utf-8', errors='replace')
+    except LookupError:
+        # An unknown charset
+        return raw.decode('utf-8', errors='replace')
+
+
+def html_to_text(value):
+    text = TAG_RE.sub('', value.replace('<br>', '\n').replace('</p>', '\n'))
+    return BLANK_LINES_RE.sub('\n\n', html.unescape(text)).strip()
+
+
+def extract_body(payload):
+    """
+    Returns the plain-text body of a `format=full` message payload, or None if it doesn't have one.
+
+    We prefer the first text/plain part, falling back to text/html with its tags stripped.
+    Attachments are skipped.
+    """
+    if not payload:
+        return None
+
+    plain, rich = None, None
+    pending = [payload]
+    while pending:
+        part = pending.pop(0)
+        if part.get('parts'):
+            pending[:0] = part['parts']
+            continue
+        if part.get('filename'):
+            continue
+        mime_type = part.get('mimeType', '').lower()
+        if mime_type == 'text/plain' and plain is None:
+            plain = _part_text(part)
+        elif mime_type == 'text/html' and rich is None:
+            rich = _part_text(part)
+
+    if plain is not None:
+        return plain
+    return html_to_text(rich) if rich is not None else None
+
+
+def extract_bodies(payloads):
+    return [extract_body(payload) for payload in payloads]
+
+
+def _serve(connection, fn):
+    """The loop each worker process runs: receive a list of items, send back their results"""
+    while True:
+        try:
+            items = connection.recv()
+        except EOFError:
+            return
+        try:
+            connection.send(fn(items))
+        except Exception as e:
+            connection.send(e)
+
+
+class PipePool:
+    """
+    A minimal process pool that talks to its workers over Pipes.
+
+    `multiprocessing.Pool` and `ProcessPoolExecutor` rely on POSIX semaphores in /dev/shm,
+    which the Lambda runtime doesn't provide, so we can't use them there.
+    `fn` takes a list of items and returns a list of results.
+
+    Workers are spawned rather than forked. The pool is started by the first request that
+    decodes bodies, when the fetcher's threads are already running, and forking a process
+    with threads can leave the child holding a lock that will never be released.
+    `fn` has to be picklable, i.e. defined at the top level of a module.
+
+    Lambda only runs one invocation per process at a time, but several threads can share
+    a pool when the connector is run locally, so only one `map` uses the workers at once.
+    """
+
+    def __init__(self, fn, workers=MIME_WORKERS) -> None:
+        self.fn = fn
+        self.workers = []
+        self._lock = threading.Lock()
+        context = multiprocessing.get_context('spawn')
+        for _ in range(workers):
+            parent, child = context.Pipe()
+            process = context.Process(target=_serve, args=(child, fn), daemon=True)
+            process.start()
+            child.close()
+            self.workers.append((process, parent))
+
+    def map(self, items):
+        """Splits `items` evenly across the workers and returns the results in order"""
+        with self._lock:
+            return self._map(items)
+
+    def _map(self, items):
+        size = -(-len(items) // len(self.workers))
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        for (_, connection), chunk in zip(self.workers, chunks):
+            connection.send(chunk)
+
+        results = []
+        errors = []
+        for (_, connection), chunk in zip(self.workers, chunks):
+            result = connection.recv()
+            if isinstance(result, Exception):
+                errors.append(result)
+            else:
+                results.extend(result)
+        if errors:
+            raise errors[0]
+        return results
+
+    def close(self):
+        for process, connection in self.workers:
+            connection.close()
+            process.join(timeout=1)
+        self.workers = []
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def body_pool(workers):
+    """Worker processes live for the life of the Lambda container, so warm invocations skip starting them"""
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = PipePool(extract_bodies, workers)
+        return _pools[workers]
+
+
+def decode_bodies(messages, workers=MIME_WORKERS):
+    """Sets `body` on each `format=full` message, decoding them across several processes if it's worth it"""
+    payloads = [message.get('payload') for message in messages]
+    bodies = None
+    if workers > 1 and len(messages) >= MIN_POOL_MESSAGES:
+        try:
+            bodies = body_pool(workers).map(payloads)
+        except (EOFError, OSError):
+            # A worker died (most likely out of memory), so start a new pool next time
+            with _pools_lock:
+                pool = _pools.pop(workers, None)
+            if pool is not None:
+                pool.close()
+    if bodies is None:
+        bodies = extract_bodies(payloads)
+    for message, body in zip(messages, bodies):
+        message['body'] = body
@@ -0,0 +1,121 @@
+import calendar
+import time
+
+import pyarrow as pa
+
+from athena.federation.utils import AthenaSDKUtils
+from gmail.splits import MAILBOX_START
+
+# Every table is partitioned by the (UTC) year and month each message was received
+PARTITION_COLUMNS = ['year', 'month']
+PARTITION_TYPE = pa.int32()
+PARTITION_SCHEMA = pa.schema([(name, PARTITION_TYPE) for name in PARTITION_COLUMNS])
+
+# The first partition also holds every message from before `MAILBOX_START`, such as
+# imported mail, so its rows can be from any year up to its own
+EPOCH_YEAR = 1970
+
+
+def month_start(year, month):
+    """Epoch seconds at the start of the given month, in UTC"""
+    return calendar.timegm((year, month, 1, 0, 0, 0))
+
+
+def month_end(year, month):
+    return month_start(year + month // 12, month % 12 + 1)
+
+
+def month_of(epoch_seconds):
+    tm = time.gmtime(epoch_seconds)
+    return tm.tm_year, tm.tm_mon
+
+
+def month_partitions(start=MAILBOX_START, end=None):
+    """Every (year, month) between the `start` and `end` epoch seconds, oldest first"""
+    end = int(time.time()) if end is None else end
+    year, month = month_of(start)
+    last = month_of(max(start, end - 1))
+    partitions = []
+    while (year, month) <= last:
+        partitions.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return partitions
+
+
+def first_partition(start=MAILBOX_START):
+    return month_of(start)
+
+
+def partition_bounds(year, month, start=MAILBOX_START):
+    """The [after, before) window of messages in a partition. The first one has no lower bound."""
+    after = None if (year, month) == first_partition(start) else month_start(year, month)
+    return after, month_end(year, month)
+
+
+def _may_hold(year, month, year_set, month_set, start):
+    """Whether any row in the partition could satisfy the `year` and `month` constraints"""
+    if (year, month) == first_partition(start):
+        years, months = range(EPOCH_YEAR, year + 1), range(1, 13)
+    else:
+        years, months = [year], [month]
+    return ((year_set is None or any(year_set.contains(y) for y in years))
+            and (month_set is None or any(month_set.contains(m) for m in months)))
+
+
+def prunes_exactly(value_sets, start=MAILBOX_START):
+    """
+    Whether pruning partitions applies the `year` and `month` constraints exactly. It doesn't
+    if they keep the first partition, whose older messages can be from any year and month.
+    """
+    year, month = first_partition(start)
+    return not _may_hold(year, month, value_sets.get('year'), value_sets.get('month'), start)
+
+
+def prune_partitions(partitions, value_sets, window=(None, None), start=MAILBOX_START):
+    """
+    Drops every partition that can't hold a matching row, either because of a constraint
+    on `year` or `month` or because it lies outside the [after, before) `window`.
+    """
+    after, before = window
+    year_set = value_sets.get('year')
+    month_set = value_sets.get('month')
+    kept = []
+    for year, month in partitions:
+        low, high = partition_bounds(year, month, start)
+        if (_may_hold(year, month, year_set, month_set, start)
+                and (after is None or high > after)
+                and (before is None or low is None or low < before)):
+            kept.append((year, month))
+    return kept
+
+
+def partition_batch(partitions):
+    return pa.RecordBatch.from_arrays(
+        [pa.array([p[i] for p in partitions], type=PARTITION_TYPE) for i in range(len(PARTITION_COLUMNS))],
+        schema=PARTITION_SCHEMA)
+
+
+def read_partitions(block):
+    """
+    Returns the (year, month) partitions in the Block Athena sends with a GetSplitsRequest,
+    or None if the block isn't partitioned by month.
+    """
+    if not block or not block.get('records'):
+        return None
+    records = AthenaSDKUtils.decode_pyarrow_records(block['schema'], block['records'])
+    if any(name not in records.schema.names for name in PARTITION_COLUMNS):
+        return None
+    columns = records.to_pydict()
+    return list(zip(*[columns[name] for name in PARTITION_COLUMNS]))
+
+
+def partition_windows(partitions, start=MAILBOX_START):
+    """Merges partitions into as few [after, before) windows as possible"""
+    windows = []
+    for year, month in sorted(partitions):
+        after, before = partition_bounds(year, month, start)
+        if windows and windows[-1][1] == after:
+            windows[-1] = (windows[-1][0], before)
+        else:
+            windows.append((after, before))
+    return windows
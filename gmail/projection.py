@@ -0,0 +1,53 @@
+# Columns that are read out of message headers, and the header they come from
+HEADER_COLUMNS = {
+    'subject': 'Subject',
+    'from': 'From',
+    'to': 'To',
+    'cc': 'Cc',
+}
+
+# The same for the threads table, whose columns are aggregated from every message's headers
+THREAD_HEADER_COLUMNS = {
+    'subject': 'Subject',
+    'from': 'From',
+    'participants': 'From',
+    'firstReplySeconds': 'From',
+}
+
+# Columns that even a `minimal` response includes
+MESSAGE_COLUMNS = ['threadId', 'snippet', 'sizeEstimate', 'labelIds']
+
+# Columns that need the whole message
+BODY_COLUMNS = ['body']
+
+
+class FetchPlan:
+    """
+    Works out the cheapest `messages.get` (or `threads.get`) format that can fill the requested columns.
+
+    - `minimal` returns the id, labels, snippet, size and internalDate, but no payload
+    - `metadata` adds just the headers we ask for with `metadataHeaders`
+    - `full` adds every header and the body, which we only ask for if it's projected.
+      Unlike `raw`, it leaves out the data of large attachments.
+    """
+
+    def __init__(self, column_names, header_columns=HEADER_COLUMNS) -> None:
+        self.header_columns = {name: header_columns[name]
+                               for name in column_names if name in header_columns}
+        self.wants_body = any(name in BODY_COLUMNS for name in column_names)
+        if self.wants_body:
+            self.format = 'full'
+        else:
+            self.format = 'metadata' if self.header_columns else 'minimal'
+
+    @classmethod
+    def from_schema(cls, schema):
+        return cls(schema.names)
+
+    def request_kwargs(self):
+        """Keyword arguments to pass along to `messages().get` or `threads().get`"""
+        kwargs = {'format': self.format}
+        if self.format == 'metadata':
+            # Several thread columns come from the same header
+            kwargs['metadataHeaders'] = list(dict.fromkeys(self.header_columns.values()))
+        return kwargs
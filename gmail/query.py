@@ -0,0 +1,169 @@
+import calendar
+import datetime
+import re
+
+from athena.federation.constraints import SortedRangeSet, parse_constraints, parse_like_expressions, parse_limit
+from gmail.partitions import PARTITION_COLUMNS, prunes_exactly
+from gmail.splits import window_query
+
+# A rough check that a value looks like an email address or domain
+ADDRESS_RE = re.compile(r'^[\w.+-]*@?[\w-]+(\.[\w-]+)+$')
+
+
+def to_epoch_seconds(value):
+    """Converts a constraint value on `sentDate` to epoch seconds"""
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            return int(value.timestamp())
+        return calendar.timegm(value.timetuple())
+    if isinstance(value, datetime.date):
+        return calendar.timegm(value.timetuple())
+    return None
+
+
+def _quote(value):
+    return '"%s"' % value.replace('"', '')
+
+
+def _any_of(terms):
+    """Gmail uses braces to OR several terms together"""
+    if len(terms) == 1:
+        return terms[0]
+    return '{%s}' % ' '.join(terms)
+
+
+def _from_term(value):
+    # The `from` column holds the full header, e.g. `Damon <damon@example.com>`
+    match = re.search(r'<([^>]+)>', value)
+    if match:
+        return 'from:%s' % match.group(1)
+    if ADDRESS_RE.match(value):
+        return 'from:%s' % value
+    return 'from:%s' % _quote(value)
+
+
+def _from_like_term(pattern):
+    """
+    Gmail matches whole words, not substrings, so we only translate LIKE patterns
+    where a full address or domain ends the header, e.g. `%@amazonaws.com` or
+    `%<bob@example.com>%`. `%@amazonaws.co%` also matches `@amazonaws.com`, which
+    `from:amazonaws.co` wouldn't find.
+    """
+    core = pattern.lstrip('%')
+    if core.rstrip('%').endswith('>'):
+        # Nothing but the closing bracket can follow the address
+        core = core.rstrip('%')[:-1]
+    if '%' in core or '_' in core:
+        return None
+    if core.startswith('@') and ADDRESS_RE.match(core[1:]):
+        return 'from:%s' % core[1:]
+    if core.startswith('<') and ADDRESS_RE.match(core[1:]):
+        return 'from:%s' % core[1:]
+    return None
+
+
+class GmailSearch:
+    """
+    The Gmail search that a query's constraints translate into.
+
+    Athena still applies the original predicates to whatever we return, so
+    the search only needs to be a superset of the rows that match.
+    """
+
+    def __init__(self, terms=None, after=None, before=None, meta_queries=None, limit=None) -> None:
+        self.terms = terms or []
+        self.after = after
+        self.before = before
+        # Values of `meta_gmailquery` are passed through to Gmail verbatim
+        self.meta_queries = meta_queries or []
+        # The most rows any one split needs to return
+        self.limit = limit
+        # Set when the constraints can't match any rows at all
+        self.empty = False
+
+    @classmethod
+    def from_constraints(cls, constraints):
+        search = cls()
+        summary = parse_constraints(constraints)
+        for column, value_set in summary.items():
+            values = value_set.values()
+            # Gmail can't search for a missing or empty header, so those searches would drop rows that match
+            searchable = values and not value_set.null_allowed and all(values)
+            if values is not None and len(values) == 0 and not value_set.null_allowed:
+                search.empty = True
+            elif column == 'meta_gmailquery' and values:
+                search.meta_queries = [v for v in values if v]
+            elif column == 'from' and searchable:
+                search.terms.append(_any_of([_from_term(v) for v in values]))
+            elif column == 'subject' and searchable:
+                search.terms.append(_any_of(['subject:%s' % _quote(v) for v in values]))
+            elif column == 'sentDate':
+                search._add_date_bounds(value_set, values)
+
+        for column, pattern in parse_like_expressions(constraints):
+            term = _from_like_term(pattern) if column == 'from' else None
+            if term is not None:
+                search.terms.append(term)
+
+        # Since Athena filters whatever we return, a LIMIT is only safe to apply ourselves when
+        # every predicate is evaluated exactly, i.e. by Gmail (`meta_gmailquery`) or partition pruning.
+        # Pruning isn't exact when it keeps the first partition, which also holds older mail.
+        exact = (set(summary) <= {'meta_gmailquery', *PARTITION_COLUMNS}
+                 and not (constraints or {}).get('expression')
+                 and (not summary.keys() & set(PARTITION_COLUMNS) or prunes_exactly(summary)))
+        if exact:
+            search.limit = parse_limit(constraints)
+
+        return search
+
+    def _add_date_bounds(self, value_set, values):
+        if values:
+            low, high = min(values), max(values)
+        elif isinstance(value_set, SortedRangeSet) and value_set.ranges:
+            low_marker, high_marker = value_set.span()
+            low = None if low_marker.unbounded else low_marker.value
+            high = None if high_marker.unbounded else high_marker.value
+        else:
+            return
+
+        # Pad each bound by a second so we never miss messages right on the edge
+        after = to_epoch_seconds(low) if low is not None else None
+        before = to_epoch_seconds(high) if high is not None else None
+        if after is not None:
+            self.after = after - 1
+        if before is not None:
+            self.before = before + 1
+
+    def window(self, after=None, before=None):
+        """Narrows the given [after, before) window by any date constraints"""
+        if self.after is not None:
+            after = self.after if after is None else max(after, self.after)
+        if self.before is not None:
+            before = self.before if before is None else min(before, self.before)
+        return after, before
+
+    def query(self):
+        """The search used to plan splits, without any date bounds"""
+        terms = list(self.terms)
+        if len(self.meta_queries) == 1:
+            terms.append(self.meta_queries[0])
+        elif self.meta_queries:
+            terms.append(' OR '.join('(%s)' % q for q in self.meta_queries))
+        return ' '.join(terms) or None
+
+    def queries(self, after=None, before=None):
+        """
+        Returns a list of (meta_gmailquery, query) tuples to read for the given window.
+
+        Each `meta_gmailquery` value is searched separately so its rows can be
+        returned with the value Athena is filtering on.
+        """
+        after, before = self.window(after, before)
+        if self.empty or (after is not None and before is not None and after >= before):
+            return []
+
+        meta_queries = self.meta_queries or [""]
+        return [
+            (meta_query, window_query(after, before, ' '.join(self.terms + [meta_query]).strip()) or None)
+            for meta_query in meta_queries
+        ]
@@ -0,0 +1,137 @@
+import array
+import os
+from email.utils import getaddresses
+
+import numpy as np
+import pyarrow as pa
+
+# The number of rows we buffer before emitting a RecordBatch
+MAX_BATCH_ROWS = int(os.environ.get('MAX_BATCH_ROWS', 5000))
+# Message bodies can be megabytes each, so when they're selected batches are also capped at
+# roughly this many bytes of body text. Each spilled block is a batch, and Athena caps blocks
+# at its `maxBlockSize` (16MB by default).
+MAX_BATCH_BYTES = int(os.environ.get('MAX_BATCH_BYTES', 4 * 1024 * 1024))
+
+SENT_DATE_TYPE = pa.timestamp('ms', tz='UTC')
+
+# Columns copied straight from a field of the `messages.get` response (or the decoded body)
+MESSAGE_FIELDS = ['threadId', 'snippet', 'sizeEstimate', 'labelIds', 'body']
+
+
+class MessageRowBuilder:
+    """
+    Turns `messages.get` responses into RecordBatches of at most `max_rows` rows and, if
+    `body` is selected, about `max_bytes` bytes of bodies. A single bigger body gets a batch of its own.
+
+    Values are appended straight into per-column buffers, so we never build a dict per row.
+    `sentDate` is kept as raw epoch milliseconds in an int64 buffer and converted to
+    a UTC timestamp column in one go. Missing headers become nulls.
+    """
+
+    def __init__(self, schema, header_columns, max_rows=MAX_BATCH_ROWS, max_bytes=MAX_BATCH_BYTES) -> None:
+        self.schema = schema
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        names = set(schema.names)
+        # Lower-cased header name => column, for the headers we actually need
+        self.headers = {header.lower(): column
+                        for column, header in header_columns.items() if column in names}
+        # Headers like `To` hold several addresses, which we split up if their column is a list
+        self.address_columns = set(column for column in self.headers.values()
+                                   if pa.types.is_list(schema.field(column).type))
+        self.fields = [name for name in MESSAGE_FIELDS if name in names]
+        self.wants_body = 'body' in names
+        self.wants_id = 'messageId' in names
+        # The partition columns are derived from the same date
+        self.wants_date = bool(names & {'sentDate', 'year', 'month'})
+        self.wants_query = 'meta_gmailquery' in names
+        self._reset()
+
+    def _reset(self):
+        self.columns = {name: [] for name in self.headers.values()}
+        for name in ['messageId', 'meta_gmailquery'] + self.fields:
+            if name in self.schema.names:
+                self.columns[name] = []
+        self.dates = array.array('q')
+        self.date_nulls = []
+        self.num_rows = 0
+
+    def __len__(self):
+        return self.num_rows
+
+    def append_message(self, message, meta_query=""):
+        if self.wants_id:
+            self.columns['messageId'].append(message['id'])
+        if self.wants_query:
+            self.columns['meta_gmailquery'].append(meta_query)
+        for name in self.fields:
+            self.columns[name].append(message.get(name))
+
+        if self.headers:
+            found = {}
+            for header in message.get('payload', {}).get('headers', ()):
+                column = self.headers.get(header['name'].lower())
+                if column is not None and column not in found:
+                    found[column] = header['value']
+            for column in self.headers.values():
+                value = found.get(column)
+                if column in self.address_columns and value is not None:
+                    value = [address for _, address in getaddresses([value]) if address]
+                self.columns[column].append(value)
+
+        if self.wants_date:
+            internal_date = message.get('internalDate')
+            self.dates.append(int(internal_date) if internal_date is not None else 0)
+            self.date_nulls.append(internal_date is None)
+
+        self.num_rows += 1
+
+    def _column(self, field, count):
+        if field.name in ('sentDate', 'year', 'month'):
+            values = np.frombuffer(self.dates[:count], dtype=np.int64)
+            mask = np.array(self.date_nulls[:count], dtype=bool)
+            if field.name == 'year':
+                values = values.astype('datetime64[ms]').astype('datetime64[Y]').astype(np.int32) + 1970
+            elif field.name == 'month':
+                values = values.astype('datetime64[ms]').astype('datetime64[M]').astype(np.int32) % 12 + 1
+            return pa.array(values, type=field.type, mask=mask if mask.any() else None)
+        if field.name in self.columns:
+            return pa.array(self.columns[field.name][:count], type=field.type)
+        # A column we don't know how to fill
+        return pa.array([None] * count, type=field.type)
+
+    def _take(self, count):
+        """Builds a RecordBatch from the first `count` rows and drops them from our buffers"""
+        batch = pa.RecordBatch.from_arrays(
+            [self._column(field, count) for field in self.schema], schema=self.schema)
+
+        if count == self.num_rows:
+            self._reset()
+        else:
+            for values in self.columns.values():
+                del values[:count]
+            del self.dates[:count]
+            del self.date_nulls[:count]
+            self.num_rows -= count
+        return batch
+
+    def _batch_size(self, final):
+        """The number of rows in the next batch, or 0 if we should wait for more"""
+        count = min(self.num_rows, self.max_rows)
+        full = count == self.max_rows
+        if self.wants_body and count:
+            sizes = np.cumsum([len(body or '') for body in self.columns['body'][:count]])
+            fits = int(np.searchsorted(sizes, self.max_bytes, side='right'))
+            if fits < count:
+                count, full = max(fits, 1), True
+        return count if full or final else 0
+
+    def drain(self, final=False):
+        """
+        Yields full RecordBatches, by rows or bytes, while we have enough buffered.
+        If `final` is set, any remaining rows are returned as a last, smaller batch.
+        """
+        count = self._batch_size(final)
+        while count:
+            yield self._take(count)
+            count = self._batch_size(final)
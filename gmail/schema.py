@@ -0,0 +1,49 @@
+import functools
+
+import pyarrow as pa
+
+from gmail.partitions import PARTITION_TYPE
+from gmail.rows import SENT_DATE_TYPE
+
+
+@functools.lru_cache(maxsize=None)
+def table_schema():
+    """
+    The schema every message table shares. It's built once per container, so its encoding
+    is only worked out once too (see `AthenaSDKUtils.encode_pyarrow_schema`).
+    """
+    return pa.schema([('messageId', pa.string()),
+                      ('threadId', pa.string()),
+                      ('subject', pa.string()),
+                      ('from', pa.string()),
+                      # Recipients are lists of bare email addresses
+                      ('to', pa.list_(pa.string())),
+                      ('cc', pa.list_(pa.string())),
+                      ('sentDate', SENT_DATE_TYPE),
+                      ('snippet', pa.string()),
+                      ('sizeEstimate', pa.int64()),
+                      ('labelIds', pa.list_(pa.string())),
+                      # Only downloaded if the query actually selects it
+                      ('body', pa.string()),
+                      ('meta_gmailquery', pa.string()),
+                      # Partitions, by the UTC month each message was received
+                      ('year', PARTITION_TYPE),
+                      ('month', PARTITION_TYPE)])
+
+
+@functools.lru_cache(maxsize=None)
+def threads_schema():
+    """The schema of the threads table, with a row per conversation"""
+    return pa.schema([('threadId', pa.string()),
+                      # Of the first message in the thread
+                      ('subject', pa.string()),
+                      ('from', pa.string()),
+                      # Everyone who sent a message in the thread, by email address
+                      ('participants', pa.list_(pa.string())),
+                      ('messageCount', pa.int32()),
+                      ('firstDate', SENT_DATE_TYPE),
+                      ('lastDate', SENT_DATE_TYPE),
+                      # How long until someone other than the sender of the first message replied
+                      ('firstReplySeconds', pa.float64()),
+                      ('labelIds', pa.list_(pa.string())),
+                      ('meta_gmailquery', pa.string())])
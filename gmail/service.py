@@ -0,0 +1,116 @@
+import datetime
+import json
+import os
+import threading
+
+import google_auth_httplib2
+import httplib2
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build_from_document
+
+from athena.federation.metrics import Metrics
+from gmail.accounts import DEFAULT_ACCOUNT, load_account_credentials
+
+# We ship the Gmail discovery document with the connector so building a client
+# never has to fetch it over the network. Refresh it with `make discovery`.
+DISCOVERY_DOCUMENT = os.path.join(os.path.dirname(__file__), 'discovery', 'gmail.v1.json')
+
+# Refresh OAuth tokens this long before they actually expire, so a token
+# doesn't run out halfway through a batch of requests.
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+HTTP_TIMEOUT = 60
+
+
+def load_discovery_document(path=DISCOVERY_DOCUMENT):
+    with open(path) as document:
+        return json.load(document)
+
+
+def needs_refresh(creds, now=None):
+    if not creds.token:
+        return True
+    if creds.expiry is None:
+        return False
+    now = now or datetime.datetime.utcnow()
+    return creds.expiry - REFRESH_MARGIN <= now
+
+
+class ServiceCache:
+    """
+    Keeps a Gmail client per account around for the life of the process, so warm
+    Lambda invocations reuse the parsed discovery document, the OAuth token
+    and the underlying HTTP connections.
+
+    Each account has its own lock, so loading one mailbox's credentials never
+    holds up requests for another.
+    """
+
+    def __init__(self, load_credentials=load_account_credentials) -> None:
+        self.load_credentials = load_credentials
+        self._document = None
+        self._services = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def discovery_document(self):
+        with self._lock:
+            if self._document is None:
+                self._document = load_discovery_document()
+            return self._document
+
+    def get(self, account=DEFAULT_ACCOUNT, metrics=None):
+        metrics = metrics or Metrics()
+        with self._lock:
+            lock = self._locks.setdefault(account, threading.Lock())
+        with lock:
+            cached = self._services.get(account)
+            if cached is None:
+                with metrics.timer('Credentials'):
+                    creds = self.load_credentials(account)
+                with metrics.timer('ServiceBuild'):
+                    cached = (creds, self.build(creds))
+                self._services[account] = cached
+
+            creds, service = cached
+            if needs_refresh(creds):
+                with metrics.timer('Credentials'):
+                    creds.refresh(Request())
+            return service
+
+    def build(self, creds):
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        return build_from_document(self.discovery_document(), http=http)
+
+    def clear(self):
+        with self._lock:
+            self._services = {}
+
+
+services = ServiceCache()
+
+_local = threading.local()
+
+
+def thread_http(service):
+    """
+    Returns an HTTP connection for the current thread that shares the service's credentials.
+    httplib2 isn't thread safe, so concurrent batch requests each need their own.
+    """
+    creds = getattr(getattr(service, '_http', None), 'credentials', None)
+    if creds is None:
+        return None
+
+    # One per account, as a worker thread may fetch from several mailboxes
+    https = getattr(_local, 'https', None)
+    if https is None:
+        https = _local.https = {}
+    http = https.get(id(creds))
+    if http is None or http.credentials is not creds:
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        https[id(creds)] = http
+    return http
+
+
+def get_service(account=DEFAULT_ACCOUNT, metrics=None):
+    return services.get(account, metrics)
@@ -0,0 +1,161 @@
+import base64
+import json
+import os
+from uuid import uuid4
+
+# Gmail launched on April 1st, 2004 so there shouldn't be any mail before then.
+# Imported mail can have older dates, in which case this can be overridden.
+MAILBOX_START = int(os.environ.get('GMAIL_SPLIT_START', 1080777600))
+
+# messages.list returns 100 messages per page by default, but allows up to 500
+PAGE_SIZE = int(os.environ.get('GMAIL_PAGE_SIZE', 500))
+
+# How many messages each ReadRecordsRequest is responsible for
+TARGET_SPLIT_SIZE = int(os.environ.get('GMAIL_SPLIT_SIZE', 2000))
+
+# How many pages of messages.list a single GetSplitsRequest goes through before
+# handing Athena what it has so far, along with a continuation token
+LIST_PAGES_PER_CALL = int(os.environ.get('GMAIL_SPLIT_LIST_PAGES', 20))
+
+
+def chunked(items, size):
+    """Splits a list into lists of at most `size` items"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def window_query(after, before, query=None):
+    """
+    Builds a Gmail search query restricted to messages in the [after, before) window,
+    both bounds being epoch seconds.
+    """
+    parts = [query] if query else []
+    if after is not None:
+        parts.append('after:%d' % after)
+    if before is not None:
+        parts.append('before:%d' % before)
+    return ' '.join(parts)
+
+
+def _continuation(token):
+    """Returns the (query index, page token, messages listed so far) a continuation token stands for"""
+    if not token:
+        return 0, None, 0
+    state = json.loads(token)
+    return state['query'], state.get('page'), state.get('listed', 0)
+
+
+def list_splits(service, queries, label_ids=None, continuation_token=None, split_size=None,
+                max_pages=LIST_PAGES_PER_CALL, limit=None, page_size=PAGE_SIZE, resource='messages'):
+    """
+    Lists the messages matching each (meta_gmailquery, query) search and cuts them into
+    splits of at most `split_size` message IDs. With `resource='threads'`, it lists the
+    IDs of the matching threads instead.
+
+    After `max_pages` calls to messages.list we stop and return a token that picks up where
+    we left off, so Athena can start reading while we keep listing huge mailboxes.
+    Returns a tuple of ([(meta_gmailquery, message IDs), ...], continuation token or None).
+    """
+    split_size = split_size or TARGET_SPLIT_SIZE
+    index, page_token, listed = _continuation(continuation_token)
+    splits = []
+    pages = 0
+    while index < len(queries) and pages < max_pages:
+        meta_query, query = queries[index]
+        message_ids = []
+        while pages < max_pages:
+            wanted = page_size if limit is None else max(1, min(page_size, limit - listed))
+            response = getattr(service.users(), resource)().list(
+                userId='me', q=query, labelIds=label_ids, maxResults=wanted, pageToken=page_token).execute()
+            pages += 1
+            page = [item['id'] for item in response.get(resource, [])]
+            message_ids.extend(page)
+            listed += len(page)
+
+            page_token = response.get('nextPageToken')
+            if not page_token or (limit is not None and listed >= limit):
+                page_token = None
+                break
+
+        splits.extend((meta_query, chunk) for chunk in chunked(message_ids, split_size))
+        if page_token is None:
+            index += 1
+        if limit is not None and listed >= limit:
+            index = len(queries)
+
+    if index >= len(queries):
+        return splits, None
+    return splits, json.dumps({'query': index, 'page': page_token, 'listed': listed}, separators=(',', ':'))
+
+
+def _varint(value, out):
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def pack_message_ids(message_ids):
+    """
+    Packs message IDs into a (Map<String, String>) split property.
+
+    Gmail's IDs are hex encoded 64 bit integers, so we sort them and store the varint
+    encoded gaps between them, which takes 2-4 bytes per message instead of 16.
+    Anything that doesn't look like that is stored as a plain comma separated list.
+    """
+    widths = set(len(message_id) for message_id in message_ids)
+    width = widths.pop() if len(widths) == 1 else 0
+    try:
+        values = sorted(int(message_id, 16) for message_id in message_ids)
+    except ValueError:
+        values = None
+
+    if values is None or sorted('%0*x' % (width, v) for v in values) != sorted(message_ids):
+        return {"idEncoding": "plain", "ids": ",".join(message_ids)}
+
+    packed = bytearray()
+    previous = 0
+    for value in values:
+        _varint(value - previous, packed)
+        previous = value
+    return {"idEncoding": "delta", "idWidth": str(width), "ids": base64.b64encode(bytes(packed)).decode('ascii')}
+
+
+def unpack_message_ids(properties):
+    """The inverse of `pack_message_ids`"""
+    ids = properties.get("ids")
+    if not ids:
+        return []
+    if properties.get("idEncoding") != "delta":
+        return ids.split(",")
+
+    width = int(properties.get("idWidth", 0))
+    message_ids = []
+    value = shift = previous = 0
+    for byte in base64.b64decode(ids):
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            previous += value
+            message_ids.append('%0*x' % (width, previous))
+            value = shift = 0
+    return message_ids
+
+
+def spill_location(bucket, prefix, query_id):
+    """Every split gets its own unique spill key"""
+    return {
+        "@type": "S3SpillLocation",
+        "bucket": bucket,
+        "key": "%s/%s/%s" % (prefix, query_id, uuid4()),
+        "directory": True
+    }
+
+
+def split_properties(meta_query, message_ids, mailbox=None):
+    properties = pack_message_ids(message_ids)
+    properties["meta_gmailquery"] = meta_query
+    if mailbox:
+        # Where to look for cached messages, so splits don't each have to ask Gmail
+        properties["mailbox"] = mailbox
+    return properties
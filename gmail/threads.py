@@ -0,0 +1,116 @@
+import array
+from email.utils import parseaddr
+
+import numpy as np
+import pyarrow as pa
+
+from gmail.rows import MAX_BATCH_ROWS
+
+
+class ThreadRowBuilder:
+    """
+    Turns `threads.get` responses into RecordBatches with one row per conversation.
+
+    Each message's date goes into one flat buffer, with an offset per thread marking where
+    its messages start, so counts, first/last dates and reply latencies are worked out for
+    the whole batch at once on those buffers rather than thread by thread.
+    """
+
+    def __init__(self, schema, max_rows=MAX_BATCH_ROWS) -> None:
+        self.schema = schema
+        self.max_rows = max_rows
+        self._reset()
+
+    def _reset(self):
+        self.columns = {'threadId': [], 'subject': [], 'from': [], 'participants': [],
+                        'labelIds': [], 'meta_gmailquery': []}
+        # Every message's date, oldest first within each thread
+        self.dates = array.array('q')
+        # Where each thread's messages start in `dates`, plus where the next thread would
+        self.offsets = array.array('q', [0])
+        # The position of the first message from someone other than whoever started the thread, or -1
+        self.replies = array.array('q')
+        self.num_rows = 0
+
+    def __len__(self):
+        return self.num_rows
+
+    def append_thread(self, thread, meta_query=""):
+        messages = sorted(thread.get('messages', ()), key=lambda m: int(m.get('internalDate', 0)))
+        if not messages:
+            return
+
+        subject = None
+        senders = []
+        label_ids = []
+        for message in messages:
+            headers = {}
+            for header in message.get('payload', {}).get('headers', ()):
+                headers.setdefault(header['name'].lower(), header['value'])
+            if not senders:
+                # A thread's subject is whatever the first message said
+                subject = headers.get('subject')
+            senders.append(headers.get('from'))
+            label_ids.extend(message.get('labelIds', ()))
+            self.dates.append(int(message.get('internalDate', 0)))
+
+        addresses = [parseaddr(sender)[1] if sender else None for sender in senders]
+        replies = [i for i, address in enumerate(addresses) if address != addresses[0]]
+
+        self.columns['threadId'].append(thread['id'])
+        self.columns['subject'].append(subject)
+        self.columns['from'].append(senders[0])
+        self.columns['participants'].append(list(dict.fromkeys(a for a in addresses if a)))
+        self.columns['labelIds'].append(list(dict.fromkeys(label_ids)))
+        self.columns['meta_gmailquery'].append(meta_query)
+        self.offsets.append(len(self.dates))
+        self.replies.append(replies[0] if replies else -1)
+        self.num_rows += 1
+
+    def _column(self, field, count):
+        offsets = np.frombuffer(self.offsets[:count + 1], dtype=np.int64)
+        dates = np.frombuffer(self.dates[:offsets[-1]], dtype=np.int64)
+        starts, ends = offsets[:-1], offsets[1:]
+        if field.name == 'messageCount':
+            return pa.array((ends - starts).astype(np.int32), type=field.type)
+        if field.name == 'firstDate':
+            return pa.array(dates[starts], type=field.type)
+        if field.name == 'lastDate':
+            return pa.array(dates[ends - 1], type=field.type)
+        if field.name == 'firstReplySeconds':
+            replies = np.frombuffer(self.replies[:count], dtype=np.int64)
+            unanswered = replies < 0
+            latency = (dates[starts + np.where(unanswered, 0, replies)] - dates[starts]) / 1000.0
+            return pa.array(latency, type=field.type, mask=unanswered if unanswered.any() else None)
+        if field.name in self.columns:
+            return pa.array(self.columns[field.name][:count], type=field.type)
+        # A column we don't know how to fill
+        return pa.array([None] * count, type=field.type)
+
+    def _take(self, count):
+        """Builds a RecordBatch from the first `count` threads and drops them from our buffers"""
+        batch = pa.RecordBatch.from_arrays(
+            [self._column(field, count) for field in self.schema], schema=self.schema)
+
+        if count == self.num_rows:
+            self._reset()
+        else:
+            consumed = self.offsets[count]
+            for values in self.columns.values():
+                del values[:count]
+            del self.dates[:consumed]
+            self.offsets = array.array('q', (offset - consumed for offset in self.offsets[count:]))
+            del self.replies[:count]
+            self.num_rows -= count
+        return batch
+
+    def drain(self, final=False):
+        """
+        Yields RecordBatches of exactly `max_rows` rows while we have enough buffered.
+        If `final` is set, any remaining rows are returned as a last, smaller batch.
+        """
+        while self.num_rows >= self.max_rows:
+            yield self._take(self.max_rows)
+
+        if final and self.num_rows > 0:
+            yield self._take(self.num_rows)
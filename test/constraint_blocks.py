@@ -0,0 +1,58 @@
+"""
+Helpers to build constraints the way the Athena Java SDK serializes them.
+"""
+import pyarrow as pa
+
+from athena.federation.utils import AthenaSDKUtils
+
+
+def block(values, pa_type=None):
+    batch = pa.RecordBatch.from_arrays([pa.array(values, type=pa_type)], ['col1'])
+    return {
+        "aId": "test",
+        "schema": AthenaSDKUtils.encode_pyarrow_object(batch.schema),
+        "records": AthenaSDKUtils.encode_pyarrow_object(batch),
+    }
+
+
+def marker(value, bound, pa_type=None):
+    if value is None:
+        return {"@type": "Marker", "valueBlock": block([None], pa_type or pa.string()),
+                "bound": bound, "nullValue": True}
+    return {"@type": "Marker", "valueBlock": block([value], pa_type), "bound": bound, "nullValue": False}
+
+
+def equatable(values, white_list=True, pa_type=None):
+    return {"@type": "EquatableValueSet", "valueBlock": block(values, pa_type),
+            "whiteList": white_list, "nullAllowed": False}
+
+
+def ranges(*bounds, pa_type=None):
+    """Each bound is a ((low, low_bound), (high, high_bound)) pair"""
+    return {
+        "@type": "SortedRangeSet",
+        "type": {},
+        "ranges": [{"low": marker(lo, lo_b, pa_type), "high": marker(hi, hi_b, pa_type)}
+                   for (lo, lo_b), (hi, hi_b) in bounds],
+        "nullAllowed": False
+    }
+
+
+def single_values(*values, pa_type=None):
+    return ranges(*[((v, 'EXACTLY'), (v, 'EXACTLY')) for v in values], pa_type=pa_type)
+
+
+def like(column, pattern):
+    return {
+        "@type": "FunctionCallExpression",
+        "type": {},
+        "functionName": {"functionName": "$like_pattern"},
+        "arguments": [
+            {"@type": "VariableExpression", "columnName": column, "type": {}},
+            {"@type": "ConstantExpression", "type": {}, "valueBlock": block([pattern])},
+        ]
+    }
+
+
+def constraints(summary=None, expression=None):
+    return {"@type": "Constraints", "summary": summary or {}, "expression": expression or []}
@@ -0,0 +1,97 @@
+"""
+Fakes shared by the tests. `FakeGmailService` serves the given messages through the same
+fake Gmail API client the benchmarks use.
+"""
+import re
+
+from bench.fake_gmail import FakeGmail
+
+
+def make_message(message_id, internal_date, subject='hello', sender='me@example.com', **kwargs):
+    message = {
+        'id': message_id,
+        'threadId': kwargs.pop('threadId', message_id),
+        'internalDate': str(internal_date),
+        'payload': {'headers': [
+            {'name': 'Subject', 'value': subject},
+            {'name': 'From', 'value': sender},
+        ]},
+    }
+    message.update(kwargs)
+    return message
+
+
+def format_message(message, format='full', metadataHeaders=None):
+    """Trims a message down to what Gmail returns for the given `format`"""
+    message = dict(message)
+    if format == 'minimal':
+        message.pop('payload', None)
+    elif format == 'metadata':
+        wanted = [h.lower() for h in metadataHeaders or []]
+        message['payload'] = {'headers': [h for h in message['payload']['headers']
+                                          if not wanted or h['name'].lower() in wanted]}
+    return message
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FakeGmailService(FakeGmail):
+    """A mailbox of the given messages, which are referred to by their IDs"""
+
+    def __init__(self, messages) -> None:
+        super().__init__(len(messages), record_requests=True)
+        # Like Gmail, we return the newest messages first
+        self.messages_list = sorted(messages, key=lambda m: -int(m['internalDate']))
+        self.messages_by_id = {m['id']: m for m in messages}
+        self.email_address = 'me@example.com'
+        self.history_id = 1000
+        self.labels_by_name = {'INBOX': 'INBOX', 'SENT': 'SENT', 'Receipts': 'Label_1'}
+
+    def search(self, q):
+        """Supports the subset of the Gmail search syntax the connector generates"""
+        matches = self.messages_list
+        for op, value in re.findall(r'(\w+):(\S+)', q or ''):
+            if op == 'after':
+                matches = [m for m in matches if int(m['internalDate']) // 1000 >= int(value)]
+            elif op == 'before':
+                matches = [m for m in matches if int(m['internalDate']) // 1000 < int(value)]
+        return matches
+
+    def message_key(self, message_id):
+        return message_id
+
+    def message_id(self, message_id):
+        return message_id
+
+    def thread_id(self, message_id):
+        return self.messages_by_id[message_id]['threadId']
+
+    def thread_messages(self, thread_id):
+        return [m['id'] for m in reversed(self.messages_list) if m['threadId'] == thread_id]
+
+    def message(self, message_id, format='full', metadata_headers=None):
+        return format_message(self.messages_by_id[message_id], format, metadata_headers)
+
+    def matching(self, q, label_ids=None):
+        matches = self.search(q)
+        for label_id in label_ids or []:
+            matches = [m for m in matches if label_id in m.get('labelIds', [])]
+        return [m['id'] for m in matches]
+
+    def matching_threads(self, q, label_ids=None):
+        """The newest matching message of each thread"""
+        newest = {}
+        for message_id in self.matching(q, label_ids):
+            newest.setdefault(self.thread_id(message_id), message_id)
+        return list(newest.values())
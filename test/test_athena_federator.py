@@ -2,7 +2,7 @@ import pyarrow as pa
 
 
 from athena.federation.utils import AthenaSDKUtils
-from athena.federation.models import GetTableLayoutResponse, GetTableResponse, ReadRecordsResponse
+from athena.federation.models import GetTableLayoutResponse, GetTableResponse, ListTablesResponse, ReadRecordsResponse
 
 CATALOG_NAME = 'sample_catalog'
 DB_NAME = 'sample_db'
@@ -85,3 +85,36 @@ def test_read_records_response():
     assert decoded_records.schema.names == ['id', 'name']
     assert decoded_records[0].to_pylist() == records['id']
     assert decoded_records[1].to_pylist() == records['name']
+
+
+def test_read_records_response_with_multiple_batches():
+    pya_schema = pa.schema([('id', pa.int64()), ('name', pa.string())])
+    batches = [
+        AthenaSDKUtils.encode_pyarrow_records(pya_schema, {'id': [1], 'name': ['damon']}),
+        AthenaSDKUtils.encode_pyarrow_records(pya_schema, {'id': [2], 'name': ['dacort']}),
+    ]
+
+    resp = ReadRecordsResponse(CATALOG_NAME, pya_schema, iter(batches)).as_dict()
+    decoded_records = AthenaSDKUtils.decode_pyarrow_records(
+        resp.get('records').get('schema'), resp.get('records').get('records'))
+    assert decoded_records[0].to_pylist() == [1, 2]
+    assert decoded_records[1].to_pylist() == ['damon', 'dacort']
+
+    # An empty result set still needs a (zero-row) batch
+    resp = ReadRecordsResponse(CATALOG_NAME, pya_schema, []).as_dict()
+    decoded_records = AthenaSDKUtils.decode_pyarrow_records(
+        resp.get('records').get('schema'), resp.get('records').get('records'))
+    assert decoded_records.num_rows == 0
+
+
+def test_list_tables_response():
+    first = ListTablesResponse(CATALOG_NAME)
+    first.addTableDefinition(DB_NAME, 'All Mail')
+    first.addTableDefinition(DB_NAME, 'INBOX')
+
+    # Responses must not share their list of tables
+    second = ListTablesResponse(CATALOG_NAME)
+    second.addTableDefinition(DB_NAME, 'INBOX')
+
+    assert [t['tableName'] for t in first.as_dict()['tables']] == ['All Mail', 'INBOX']
+    assert second.as_dict()['tables'] == [{'schemaName': DB_NAME, 'tableName': 'INBOX'}]
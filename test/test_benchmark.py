@@ -0,0 +1,102 @@
+import pyarrow as pa
+
+from bench.benchmark import Benchmark
+from bench.fake_gmail import FakeGmail
+from gmail.partitions import first_partition, month_end
+
+from constraint_blocks import single_values
+
+
+def test_fake_gmail_matching():
+    backend = FakeGmail(1000, start=0, interval=60)
+    assert len(backend.matching(None)) == 1000
+    assert list(backend.matching('after:120 before:300')) == [4, 3, 2]
+    assert list(backend.matching(None, ['SENT']))[:3] == [999, 996, 993]
+
+
+def test_benchmark_reads_every_message(tmp_path):
+    backend = FakeGmail(500, throttle_rate=0.01)
+    results = Benchmark(backend, spill_dir=str(tmp_path)).run()
+
+    assert results['rows'] == 500
+    assert results['splits'] >= 1
+    assert results['latency']['ReadRecordsRequest']['count'] == results['splits']
+    assert results['api_calls']['messages.get'] >= 500
+    assert results['peak_rss_bytes'] > 0
+
+
+def test_benchmark_label_table(tmp_path):
+    backend = FakeGmail(500)
+    results = Benchmark(backend, table='receipts', spill_dir=str(tmp_path)).run()
+    assert results['rows'] == len(backend.matching(None, ['Label_1']))
+
+
+def test_thread_tables_fetch_a_conversation_per_call(tmp_path):
+    backend = FakeGmail(600)
+    results = Benchmark(backend, table='threads', spill_dir=str(tmp_path)).run()
+    assert results['rows'] == 200
+    assert results['api_calls'].get('messages.get') is None
+    assert results['api_calls']['threads.get'] == 200
+
+    backend = FakeGmail(600)
+    results = Benchmark(backend, table='thread messages', spill_dir=str(tmp_path),
+                        columns=['messageId', 'threadId', 'from']).run()
+    assert results['rows'] == 600
+    assert results['api_calls']['threads.get'] == 200
+    assert backend.formats == {'metadata'}
+
+
+def test_limit_stops_reading_early(tmp_path):
+    backend = FakeGmail(5000)
+    results = Benchmark(backend, spill_dir=str(tmp_path), limit=10).run()
+
+    assert results['splits'] == 1
+    assert results['rows'] == 10
+    assert results['api_calls']['messages.get'] == 10
+    assert results['api_calls']['messages.list'] == 1
+
+
+def test_limit_on_mail_older_than_the_first_partition(tmp_path):
+    # A message a day from 1999, so most of them are older than the first partition
+    backend = FakeGmail(2000, start=915148800, interval=86400)
+    results = Benchmark(backend, spill_dir=str(tmp_path), limit=10, columns=['messageId', 'year'],
+                        summary={'year': single_values(1999, pa_type=pa.int32())}).run()
+
+    # The first partition is read in full, since Athena has to find 1999 amongst its newer mail
+    assert results['rows'] == len(backend.matching('before:%d' % month_end(*first_partition())))
+
+
+def test_bodies_are_only_fetched_when_selected(tmp_path):
+    backend = FakeGmail(200)
+    results = Benchmark(backend, spill_dir=str(tmp_path), columns=['messageId', 'snippet', 'labelIds']).run()
+    assert results['rows'] == 200
+    assert backend.formats == {'minimal'}
+
+    results = Benchmark(backend, spill_dir=str(tmp_path), columns=['messageId', 'body']).run()
+    assert results['rows'] == 200
+    assert backend.formats == {'minimal', 'full'}
+
+
+def test_messages_are_only_listed_once(tmp_path):
+    backend = FakeGmail(2500)
+    results = Benchmark(backend, spill_dir=str(tmp_path), columns=['messageId']).run()
+    assert results['rows'] == 2500
+    # 500 messages per page, and ReadRecords never lists at all
+    assert results['api_calls']['messages.list'] == 5
+
+
+def test_warm_queries_come_from_the_message_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr('gmail.cache.MESSAGE_CACHE', str(tmp_path / 'cache'))
+    backend = FakeGmail(3000)
+    results = Benchmark(backend, spill_dir=str(tmp_path), columns=['messageId', 'subject', 'year']).run()
+    assert results['rows'] == 3000
+    assert results['api_calls']['messages.get'] == 3000
+
+    backend.calls.clear()
+    results = Benchmark(backend, spill_dir=str(tmp_path), columns=['messageId', 'from', 'meta_gmailquery']).run()
+    assert results['rows'] == 3000
+    assert 'messages.get' not in results['api_calls']
+    # History is only followed once per query, not once per split
+    assert results['splits'] > 1
+    assert results['api_calls']['history.list'] == 1
+    assert results['api_calls']['users.getProfile'] == 1
@@ -0,0 +1,30 @@
+import os
+
+from athena.federation.models import GetTableLayoutResponse
+from bench.coldstart import measure_in_subprocess, run
+
+
+def test_metadata_requests_skip_heavy_imports():
+    # Nor do they need to know where to spill
+    env = {k: v for k, v in os.environ.items() if k != 'TARGET_BUCKET'}
+    for request_type in ['PingRequest', 'ListSchemasRequest']:
+        event = {"@type": request_type, "identity": {}, "catalogName": "gmail", "queryId": "1"}
+        result = measure_in_subprocess({'messages': 10, 'start': 0, 'spill_dir': None, 'event': event}, env=env)
+        assert not result['arrow']
+        assert not result['google']
+
+
+def test_cold_start_benchmark(tmp_path):
+    results = run(200, runs=1, request_types=['GetTableLayoutRequest', 'ReadRecordsRequest'],
+                  spill_dir=str(tmp_path))
+    assert results['GetTableLayoutRequest']['arrow']
+    assert not results['GetTableLayoutRequest']['google']
+    assert results['ReadRecordsRequest']['google']
+    assert results['ReadRecordsRequest']['call_ms'] > 0
+
+
+def test_default_layout_is_reused():
+    first = GetTableLayoutResponse('gmail', 'personal', 'all mail').as_dict()['partitions']
+    second = GetTableLayoutResponse('gmail', 'personal', 'all mail').as_dict()['partitions']
+    assert first['aId'] != second['aId']
+    assert first['records'] == second['records']
@@ -0,0 +1,69 @@
+from athena.federation.constraints import (AllOrNoneValueSet, EquatableValueSet, SortedRangeSet,
+                                           parse_constraints, parse_like_expressions, parse_limit)
+
+from constraint_blocks import constraints, equatable, like, ranges, single_values
+
+
+def test_parse_equatable_value_set():
+    parsed = parse_constraints(constraints({'from': equatable(['a@b.com', 'c@d.com'])}))
+    assert isinstance(parsed['from'], EquatableValueSet)
+    assert parsed['from'].values() == ['a@b.com', 'c@d.com']
+
+    parsed = parse_constraints(constraints({'from': equatable(['a@b.com'], white_list=False)}))
+    assert parsed['from'].values() is None
+
+
+def test_parse_sorted_range_set():
+    parsed = parse_constraints(constraints({
+        'sentDate': ranges((('2020-01-01', 'EXACTLY'), (None, 'BELOW')))
+    }))
+    value_set = parsed['sentDate']
+    assert isinstance(value_set, SortedRangeSet)
+    assert value_set.values() is None
+
+    low, high = value_set.span()
+    assert low.value == '2020-01-01' and low.inclusive
+    assert high.unbounded
+
+    parsed = parse_constraints(constraints({'subject': single_values('hello', 'world')}))
+    assert parsed['subject'].values() == ['hello', 'world']
+
+
+def test_parse_all_or_none():
+    parsed = parse_constraints(constraints({
+        'subject': {"@type": "AllOrNoneValueSet", "type": {}, "all": False, "nullAllowed": False}
+    }))
+    assert isinstance(parsed['subject'], AllOrNoneValueSet)
+    assert parsed['subject'].values() == []
+
+
+def test_missing_constraints():
+    assert parse_constraints(None) == {}
+    assert parse_constraints({}) == {}
+
+
+def test_parse_like_expressions():
+    assert parse_like_expressions(constraints(expression=[like('from', '%@amazonaws.com%')])) == [
+        ('from', '%@amazonaws.com%')]
+    assert parse_like_expressions(None) == []
+
+
+def test_parse_limit():
+    assert parse_limit(None) is None
+    assert parse_limit(constraints()) is None
+    assert parse_limit(dict(constraints(), limit=-1)) is None
+    assert parse_limit(dict(constraints(), limit=10)) == 10
+    # Top-N queries need every row
+    assert parse_limit(dict(constraints(), limit=10, orderByClause=[{'column': 'sentDate'}])) is None
+
+
+def test_value_set_contains():
+    value_sets = parse_constraints(constraints({
+        'a': ranges(((1, 'ABOVE'), (5, 'EXACTLY')), ((10, 'EXACTLY'), (None, 'BELOW'))),
+        'b': equatable(['x']),
+        'c': equatable(['x'], white_list=False),
+    }))
+    assert [v for v in range(12) if value_sets['a'].contains(v)] == [2, 3, 4, 5, 10, 11]
+    assert value_sets['b'].contains('x') and not value_sets['b'].contains('y')
+    assert value_sets['c'].contains('y') and not value_sets['c'].contains('x')
+    assert not AllOrNoneValueSet(False).contains(1)
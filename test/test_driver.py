@@ -0,0 +1,38 @@
+import pytest
+
+from bench.driver import ScanError, ScanResult, check_rows
+from bench.loadtest import run
+
+
+def test_splits_are_read_concurrently(tmp_path):
+    results = run(messages=300, accounts=2, split_size=50, workers=4, spill_dir=str(tmp_path))
+
+    assert results['rows'] == 600
+    assert results['splits'] >= 12
+    assert results['peak_concurrency'] > 1
+    assert results['spilled_splits'] == 0
+
+
+def test_spilled_blocks_are_decoded(tmp_path):
+    results = run(messages=40, accounts=1, split_size=20, workers=2, columns=['messageId', 'body'],
+                  spill_dir=str(tmp_path), max_inline_block_size=1)
+    assert results['rows'] == 40
+    assert results['spilled_splits'] == results['splits'] == 2
+
+
+def test_thread_tables(tmp_path):
+    results = run(messages=90, accounts=2, split_size=10, workers=4, table='threads', spill_dir=str(tmp_path))
+    assert results['rows'] == 60
+
+
+def test_check_rows():
+    result = ScanResult()
+    result.add_split(0, [], False)
+    check_rows(result, 0)
+    with pytest.raises(ScanError):
+        check_rows(result, 1)
+
+
+def test_label_tables(tmp_path):
+    results = run(messages=200, accounts=2, split_size=20, workers=4, table='receipts', spill_dir=str(tmp_path))
+    assert results['rows'] == 2 * 40
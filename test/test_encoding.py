@@ -2,6 +2,8 @@ import base64
 
 import pyarrow as pa
 
+from athena.federation.utils import AthenaSDKUtils
+
 ENCODED_SCHEMA = 'ZAEAABAAAAAAAAoADgAGAA0ACAAKAAAAAAADABAAAAAAAQoADAAAAAgABAAKAAAACAAAAAgAAAAAAAAABQAAAPAAAACkAAAAbAAAADgAAAAEAAAANv///xQAAAAUAAAAFAAAAAAABQEQAAAAAAAAAAAAAAAk////BQAAAHBob25lAAAAZv///xQAAAAUAAAAFAAAAAAABQEQAAAAAAAAAAAAAABU////BQAAAGVtYWlsAAAAlv///xQAAAAUAAAAFAAAAAAABQEQAAAAAAAAAAAAAACE////CQAAAGxhc3RfbmFtZQAAAMr///8UAAAAFAAAABQAAAAAAAUBEAAAAAAAAAAAAAAAuP///woAAABmaXJzdF9uYW1lAAAAABIAGAAUABMAEgAMAAAACAAEABIAAAAUAAAAFAAAABgAAAAAAAUBFAAAAAAAAAAAAAAABAAEAAQAAAAKAAAAY29udGFjdF9pZAAA'  # noqa
 KNOWNGOOD_ENCODED_RECORDS = 'mAEAABQAAAAAAAAADAAWAAYABQAIAAwADAAAAAADAwAYAAAA+AAAAAAAAAAAAAoAGAAMAAQACAAKAAAADAEAABAAAAAEAAAAAAAAAAAAAAAPAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAGAAAAAAAAAAYAAAAAAAAAAgAAAAAAAAAIAAAAAAAAAAAAAAAAAAAACAAAAAAAAAAGAAAAAAAAAA4AAAAAAAAABAAAAAAAAAASAAAAAAAAAAAAAAAAAAAAEgAAAAAAAAAGAAAAAAAAABgAAAAAAAAABAAAAAAAAAAcAAAAAAAAAAAAAAAAAAAAHAAAAAAAAAAGAAAAAAAAACIAAAAAAAAACgAAAAAAAAAsAAAAAAAAAAAAAAAAAAAALAAAAAAAAAAGAAAAAAAAADIAAAAAAAAADAAAAAAAAAAAAAAAAUAAAAEAAAAAAAAAAAAAAAAAAAABAAAAAAAAAAAAAAAAAAAAAQAAAAAAAAAAAAAAAAAAAAEAAAAAAAAAAAAAAAAAAAABAAAAAAAAAAAAAAAAAAAAAAAAAABAAAAAgAAAAMAAAAEAAAAAAAAADEyMzQAAAAAAAAAAAUAAAAJAAAADQAAABAAAAAAAAAARGFtb25Kb2huV2FsbEV2ZQAAAAAHAAAACgAAAAsAAAANAAAAAAAAAENvcnRlc2lEb2VFYWgAAAAAAAAAEwAAABwAAAAiAAAAJwAAAAAAAABkYW1vbkBzb21ld2hlcmUuY29tam9obkAuY29td0BsbC5lZUB2LmUAAAAAAAwAAAAYAAAAKAAAADAAAAAAAAAAMjA2LTEyMy00NTY3MjA2LTc2NS00MzIxNDcuNjA2Mi0xMjIuMzMyMTY5NC0zMjc4'  # noqa
 
@@ -30,5 +32,18 @@ def test_encoding():
     assert pya_records == KNOWNGOOD_ENCODED_RECORDS
 
 
+def test_schema_encoding_is_memoized():
+    schema = AthenaSDKUtils.parse_encoded_schema(ENCODED_SCHEMA)
+    assert AthenaSDKUtils.parse_encoded_schema(ENCODED_SCHEMA) is schema
+    assert AthenaSDKUtils.encode_pyarrow_object(schema) == ENCODED_SCHEMA
+
+    # Equal, but distinct, schemas are still encoded correctly
+    other = pa.schema([('id', pa.string())])
+    expected = base64.b64encode(other.serialize().slice(4)).decode("utf-8")
+    assert AthenaSDKUtils.encode_pyarrow_object(other) == expected
+    assert AthenaSDKUtils.encode_pyarrow_object(other) == expected
+    assert AthenaSDKUtils.encode_pyarrow_object(other.with_metadata({'a': 'b'})) != expected
+
+
 if __name__ == "__main__":
     test_encoding()
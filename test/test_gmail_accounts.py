@@ -0,0 +1,103 @@
+import datetime
+import json
+import pickle
+import threading
+
+import pytest
+from google.oauth2.credentials import Credentials
+
+from gmail.accounts import (CredentialStore, DirectoryStore, SecretsManagerStore, TokenFileStore, UnknownAccountError,
+                            credential_store, load_account_credentials)
+from gmail.fetcher import quota_bucket
+from gmail.labels import labels_for
+from gmail.service import ServiceCache
+
+AUTHORIZED_USER = {'refresh_token': 'refresh', 'client_id': 'id', 'client_secret': 'secret'}
+
+
+def _credentials(token='token'):
+    creds = Credentials(token=token, refresh_token='refresh')
+    creds.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    return creds
+
+
+def test_directory_store(tmp_path):
+    with open(str(tmp_path / 'Alice.pickle'), 'wb') as token:
+        pickle.dump(_credentials('alice'), token)
+    (tmp_path / 'bob.json').write_text(json.dumps(AUTHORIZED_USER))
+    (tmp_path / 'notes.txt').write_text('not a mailbox')
+
+    store = DirectoryStore(str(tmp_path))
+    assert store.accounts() == ['Alice', 'bob']
+    assert load_account_credentials('alice', store).token == 'alice'
+    # Tokens stored as JSON are refreshed before they're used
+    bob = load_account_credentials('bob', store)
+    assert bob.token is None and bob.refresh_token == 'refresh'
+    with pytest.raises(UnknownAccountError):
+        load_account_credentials('carol', store)
+
+
+class FakeSecretsManager:
+    def __init__(self, secrets) -> None:
+        self.secrets = secrets
+
+    def list_secrets(self, Filters, NextToken=None):
+        prefix = Filters[0]['Values'][0]
+        names = sorted(name for name in self.secrets if name.startswith(prefix))
+        start = int(NextToken or 0)
+        response = {'SecretList': [{'Name': name} for name in names[start:start + 1]]}
+        if start + 1 < len(names):
+            response['NextToken'] = str(start + 1)
+        return response
+
+    def get_secret_value(self, SecretId):
+        return {'SecretString': self.secrets[SecretId]}
+
+
+def test_secrets_manager_store():
+    secret = json.dumps(AUTHORIZED_USER)
+    client = FakeSecretsManager({'gmail/alice': secret, 'gmail/bob': secret, 'other/carol': secret})
+    store = SecretsManagerStore('gmail/', client=client)
+    assert store.accounts() == ['alice', 'bob']
+    assert load_account_credentials('bob', store).client_id == 'id'
+
+
+def test_credential_store_locations():
+    assert isinstance(credential_store(None), TokenFileStore)
+    assert credential_store(None).accounts() == ['personal']
+    assert credential_store('secretsmanager://gmail').prefix == 'gmail'
+    assert credential_store('/var/task/tokens').directory == '/var/task/tokens'
+
+    # Stores have to say which accounts they hold and how to load them
+    with pytest.raises(TypeError):
+        CredentialStore()
+
+
+def test_each_account_is_loaded_on_its_own():
+    loading = threading.Event()
+    release = threading.Event()
+
+    def load_credentials(account):
+        if account == 'slow':
+            loading.set()
+            release.wait(5)
+        return _credentials(account)
+
+    cache = ServiceCache(load_credentials)
+    slow = threading.Thread(target=cache.get, args=('slow',))
+    slow.start()
+    loading.wait(5)
+    # Another mailbox doesn't wait for the slow one's credentials
+    fast = cache.get('fast')
+    assert not release.is_set()
+    release.set()
+    slow.join()
+
+    assert cache.get('fast') is fast
+    assert cache.get('slow') is not fast
+
+
+def test_quota_and_labels_are_per_account():
+    assert quota_bucket('alice') is quota_bucket('alice')
+    assert quota_bucket('alice') is not quota_bucket('bob')
+    assert labels_for('alice') is not labels_for('bob')
@@ -0,0 +1,198 @@
+import datetime
+
+from athena.federation.spill import LocalStorage
+from gmail.cache import MessageCache, project
+from gmail.projection import FetchPlan
+from gmail.schema import table_schema
+
+from gmail_fakes import FakeGmailService, make_message
+
+
+def _mailbox():
+    return FakeGmailService([make_message(str(i), 1000 * i, subject='subject %d' % i, labelIds=['INBOX'])
+                             for i in range(10)])
+
+
+def _cache(tmp_path, svc, **kwargs):
+    """A cache that's been synced with the mailbox, as GetSplits leaves it"""
+    profile = svc.users().getProfile(userId='me').execute()
+    cache = MessageCache.for_mailbox(profile['emailAddress'], location=str(tmp_path), **kwargs)
+    cache.sync(svc, profile['historyId'])
+    return cache
+
+
+def _fill(cache, svc, message_ids):
+    builder = cache.builder()
+    for message_id in message_ids:
+        builder.append_message(svc.users().messages().get(userId='me', id=message_id, **cache.request_kwargs()).execute())
+    for batch in builder.drain(final=True):
+        cache.add(batch)
+    cache.save()
+
+
+def _lookup(cache, message_ids):
+    """Returns ({message ID: cached row}, missing message IDs)"""
+    batches, missing = cache.lookup(message_ids)
+    rows = {}
+    for batch in batches:
+        columns = batch.to_pydict()
+        for i, message_id in enumerate(columns['messageId']):
+            rows[message_id] = {name: values[i] for name, values in columns.items()}
+    return rows, missing
+
+
+class CountingStorage(LocalStorage):
+    def __init__(self, root) -> None:
+        super().__init__(root)
+        self.reads = []
+
+    def get(self, bucket, key):
+        self.reads.append(key)
+        return super().get(bucket, key)
+
+
+def test_disabled_without_location():
+    assert MessageCache.for_mailbox('me@example.com', location='') is None
+    assert MessageCache.for_mailbox(None, location='/tmp') is None
+
+
+def test_cached_messages_are_served_from_disk(tmp_path):
+    svc = _mailbox()
+    cache = _cache(tmp_path, svc)
+    assert cache.lookup(['1', '2']) == ([], ['1', '2'])
+    _fill(cache, svc, ['1', '2'])
+
+    # A brand new cache (e.g. another Lambda) sees the same messages
+    cache = _cache(tmp_path, svc)
+    batches, missing = cache.lookup(['1', '2', '3'])
+    assert missing == ['3']
+    assert cache.hits == 2 and cache.misses == 1
+
+    schema = table_schema()
+    schema = schema.remove(schema.get_field_index('body'))
+    batch = project(batches[0], schema, 'is:inbox')
+    rows = batch.to_pydict()
+    assert rows['messageId'] == ['1', '2']
+    assert rows['subject'] == ['subject 1', 'subject 2']
+    assert rows['labelIds'] == [['INBOX'], ['INBOX']]
+    assert rows['sentDate'][0] == datetime.datetime(1970, 1, 1, 0, 0, 1, tzinfo=datetime.timezone.utc)
+    assert rows['meta_gmailquery'] == ['is:inbox', 'is:inbox']
+    assert (rows['year'], rows['month']) == ([1970, 1970], [1, 1])
+
+    assert (tmp_path / 'me@example.com' / 'state.json').exists()
+    assert len(list((tmp_path / 'me@example.com' / 'segments').iterdir())) == 1
+
+
+def test_can_serve():
+    cache = MessageCache(LocalStorage('/tmp'), '', '', 'me')
+    schema = table_schema()
+    assert cache.can_serve(FetchPlan(['messageId', 'subject']), schema.remove(schema.get_field_index('body')))
+    assert not cache.can_serve(FetchPlan(['messageId', 'body']), schema)
+
+
+def test_only_overlapping_segments_are_read(tmp_path):
+    svc = _mailbox()
+    _fill(_cache(tmp_path, svc), svc, ['1', '2'])
+    _fill(_cache(tmp_path, svc), svc, ['7', '8'])
+
+    cache = _cache(tmp_path, svc)
+    cache.storage = CountingStorage(str(tmp_path))
+    rows, missing = _lookup(cache, ['8', '9'])
+    assert list(rows) == ['8'] and missing == ['9']
+    assert len(cache.storage.reads) == 1
+    assert '-7-8-' in cache.storage.reads[0]
+
+
+def test_concurrent_splits_keep_each_others_segments(tmp_path):
+    svc = _mailbox()
+    first, second = _cache(tmp_path, svc), _cache(tmp_path, svc)
+    _fill(first, svc, ['1'])
+    _fill(second, svc, ['2'])
+
+    rows, missing = _lookup(_cache(tmp_path, svc), ['1', '2'])
+    assert sorted(rows) == ['1', '2'] and missing == []
+
+
+def test_history_sync_applies_labels_and_deletions(tmp_path):
+    svc = _mailbox()
+    cache = _cache(tmp_path, svc)
+    _fill(cache, svc, ['1', '2', '3'])
+
+    svc.record_history(messagesDeleted=[{'message': {'id': '1'}}])
+    svc.record_history(labelsAdded=[{'message': {'id': '2', 'labelIds': ['INBOX', 'STARRED']},
+                                     'labelIds': ['STARRED']}])
+
+    cache = _cache(tmp_path, svc)
+    rows, missing = _lookup(cache, ['1', '2', '3'])
+    # Deleted messages aren't fetched again either
+    assert sorted(rows) == ['2', '3'] and missing == []
+    assert rows['2']['labelIds'] == ['INBOX', 'STARRED']
+    # Only syncs once the cache holds something, and from where the last one left off
+    assert svc.call_count('history.list') == 1
+    _cache(tmp_path, svc)
+    assert [c[1]['startHistoryId'] for c in svc.requests if c[0] == 'history.list'] == ['1000', '1002']
+
+
+def test_expired_history_invalidates(tmp_path):
+    svc = _mailbox()
+    _fill(_cache(tmp_path, svc), svc, ['1'])
+
+    svc.oldest_history_id = svc.history_id + 1
+    cache = _cache(tmp_path, svc)
+    assert cache.lookup(['1']) == ([], ['1'])
+
+
+def test_eviction_by_age_and_size(tmp_path):
+    svc = _mailbox()
+    now = [0]
+
+    def clock():
+        return now[0]
+
+    _fill(_cache(tmp_path, svc, clock=clock, max_messages=3, max_age=100), svc, ['1', '2'])
+    now[0] = 50
+    _fill(_cache(tmp_path, svc, clock=clock, max_messages=3, max_age=100), svc, ['3', '4'])
+
+    # The oldest segment is dropped to stay under max_messages
+    cache = _cache(tmp_path, svc, clock=clock, max_messages=3, max_age=100)
+    assert cache.lookup(['1', '3'])[1] == ['1']
+
+    # And everything is too old after a while
+    now[0] = 500
+    cache = _cache(tmp_path, svc, clock=clock, max_messages=3, max_age=100)
+    assert cache.lookup(['3'])[1] == ['3']
+    assert cache.segments() == []
+
+
+def test_invalidate(tmp_path):
+    svc = _mailbox()
+    cache = _cache(tmp_path, svc)
+    _fill(cache, svc, ['1'])
+    cache.invalidate()
+
+    cache = _cache(tmp_path, svc)
+    assert cache.lookup(['1']) == ([], ['1'])
+    assert cache.storage.list('', 'me@example.com/') == ['me@example.com/state.json']
+
+
+def test_caches_from_other_versions_are_thrown_away(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    storage.put('', 'me@example.com/manifest.json', b'{"version": 2, "segments": []}')
+    storage.put('', 'me@example.com/segment-1.parquet', b'')
+
+    _cache(tmp_path, _mailbox())
+    assert storage.list('', 'me@example.com/') == ['me@example.com/state.json']
+
+
+def test_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr('gmail.cache.MAX_SEGMENTS', 2)
+    svc = _mailbox()
+    for message_id in ['1', '2', '3']:
+        _fill(_cache(tmp_path, svc), svc, [message_id])
+    svc.record_history(messagesDeleted=[{'message': {'id': '3'}}])
+
+    cache = _cache(tmp_path, svc)
+    assert len(cache.segments()) == 1
+    assert cache.segments()[0].rows == 2
+    rows, missing = _lookup(cache, ['1', '2', '3'])
+    assert sorted(rows) == ['1', '2'] and missing == ['3']
@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+from bench.fake_gmail import http_error
+from gmail.fetcher import FetchError, MessageFetcher, TokenBucket, backoff_delay, is_retryable
+
+from gmail_fakes import FakeClock, FakeGmailService, make_message
+
+
+def _mailbox(count):
+    return FakeGmailService([make_message(str(i), 1000 * i) for i in range(count)])
+
+
+def test_token_bucket_waits_when_in_debt():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=250, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire(250) == 0
+    assert bucket.acquire(500) == pytest.approx(2.0)
+    clock.now += 10
+    assert bucket.acquire(100) == 0
+
+
+def test_backoff_delay_grows_and_is_capped():
+    assert 0.25 <= backoff_delay(1) <= 0.75
+    assert 2 <= backoff_delay(4) <= 6
+    assert backoff_delay(20) <= 48
+
+
+def test_is_retryable():
+    assert is_retryable(http_error(429))
+    assert is_retryable(http_error(503))
+    assert not is_retryable(http_error(404))
+    assert not is_retryable(http_error(400))
+
+
+@pytest.mark.parametrize('concurrency', [1, 4])
+def test_fetch_chunks_into_batches(concurrency):
+    svc = _mailbox(250)
+    fetcher = MessageFetcher(svc, {'format': 'minimal'}, concurrency=concurrency,
+                             bucket=TokenBucket(rate=1e9))
+    responses = list(fetcher.fetch([str(i) for i in range(250)]))
+
+    assert sorted(int(r['id']) for r in responses) == list(range(250))
+    assert 'payload' not in responses[0]
+    assert fetcher.stats.messages == 250
+    assert fetcher.stats.messages_per_second > 0
+
+
+def test_fetch_keeps_at_most_concurrency_batches_in_flight():
+    fetcher = MessageFetcher(_mailbox(500), concurrency=2, batch_size=10, bucket=TokenBucket(rate=1e9))
+    lock = threading.Lock()
+    in_flight = [0]
+    peak = [0]
+    fetch_batch = fetcher._fetch_batch
+
+    def counting(message_ids):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.001)
+        try:
+            return fetch_batch(message_ids)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    fetcher._fetch_batch = counting
+    assert len(list(fetcher.fetch([str(i) for i in range(500)]))) == 500
+    assert peak[0] == 2
+
+
+def test_throttled_messages_are_retried():
+    svc = _mailbox(10)
+    svc.fail_with(429, 500, 429)
+    sleeps = []
+    fetcher = MessageFetcher(svc, concurrency=1, bucket=TokenBucket(rate=1e9), sleep=sleeps.append)
+    responses = list(fetcher.fetch([str(i) for i in range(10)]))
+
+    assert sorted(int(r['id']) for r in responses) == list(range(10))
+    assert fetcher.stats.throttled == 3
+    assert fetcher.stats.retries == 3
+    assert len(sleeps) == 1
+
+
+def test_deleted_messages_are_skipped_and_other_errors_raise():
+    svc = _mailbox(3)
+    svc.fail_with(404)
+    fetcher = MessageFetcher(svc, concurrency=1, bucket=TokenBucket(rate=1e9))
+    assert len(list(fetcher.fetch(['0', '1', '2']))) == 2
+    assert fetcher.stats.errors == 1
+
+    svc.fail_with(400)
+    with pytest.raises(FetchError):
+        list(fetcher.fetch(['0', '1', '2']))
+
+
+def test_gives_up_after_max_attempts():
+    svc = _mailbox(1)
+    svc.fail_with(*[429] * 10)
+    fetcher = MessageFetcher(svc, concurrency=1, bucket=TokenBucket(rate=1e9), sleep=lambda s: None)
+    with pytest.raises(FetchError):
+        list(fetcher.fetch(['0']))
+
+
+def test_fetches_whole_threads():
+    svc = FakeGmailService([make_message(str(i), 1000 * i, threadId=str(i - i % 3)) for i in range(9)])
+    bucket = TokenBucket(rate=1e9)
+    spent = []
+    bucket.acquire = spent.append
+    fetcher = MessageFetcher(svc, {'format': 'minimal'}, concurrency=1, bucket=bucket, resource='threads')
+    threads = list(fetcher.fetch(['0', '3', '6']))
+
+    assert [[m['id'] for m in t['messages']] for t in threads] == [['0', '1', '2'], ['3', '4', '5'], ['6', '7', '8']]
+    assert svc.call_count('threads.get') == 3
+    assert svc.call_count('messages.get') == 0
+    # threads.get costs 10 quota units
+    assert spent == [30]
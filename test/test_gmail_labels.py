@@ -0,0 +1,44 @@
+import pytest
+
+from gmail.labels import ALL_MAIL, THREAD_MESSAGES, THREADS, LabelIndex, UnknownTableError
+from gmail.splits import list_splits
+
+from gmail_fakes import FakeGmailService, make_message
+
+
+def test_table_names_include_all_mail_and_threads():
+    index = LabelIndex()
+    assert index.table_names(FakeGmailService([])) == [ALL_MAIL, THREADS, THREAD_MESSAGES, 'INBOX', 'Receipts', 'SENT']
+
+
+def test_label_lookups_are_case_insensitive():
+    index = LabelIndex()
+    svc = FakeGmailService([])
+    assert index.label_id(svc, 'all mail') is None
+    assert index.label_id(svc, 'threads') is None
+    assert index.label_id(svc, 'receipts') == 'Label_1'
+    assert index.label_id(svc, 'INBOX') == 'INBOX'
+    with pytest.raises(UnknownTableError):
+        index.label_id(svc, 'nope')
+
+
+def test_labels_are_cached_until_the_ttl_expires():
+    now = [0]
+    index = LabelIndex(ttl=60, clock=lambda: now[0])
+    svc = FakeGmailService([])
+
+    index.label_id(svc, 'inbox')
+    index.label_id(svc, 'receipts')
+    assert svc.call_count('labels.list') == 1
+
+    svc.labels_by_name['Travel'] = 'Label_2'
+    now[0] = 61
+    assert index.label_id(svc, 'travel') == 'Label_2'
+    assert svc.call_count('labels.list') == 2
+
+
+def test_label_tables_list_by_label_id():
+    svc = FakeGmailService([make_message('1', 1000, labelIds=['INBOX']),
+                            make_message('2', 2000, labelIds=['Label_1'])])
+    splits, _ = list_splits(svc, [("", None)], label_ids=['Label_1'])
+    assert [message_ids for _, message_ids in splits] == [['2']]
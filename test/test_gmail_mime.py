@@ -0,0 +1,103 @@
+import base64
+import threading
+
+import pytest
+
+from gmail.mime import PipePool, decode_bodies, extract_bodies, extract_body
+
+
+def _part(mime_type, text, charset='utf-8', filename='', encoding=None):
+    data = base64.urlsafe_b64encode(text.encode(encoding or charset)).decode('ascii').rstrip('=')
+    return {'mimeType': mime_type, 'filename': filename,
+            'headers': [{'name': 'Content-Type', 'value': '%s; charset="%s"' % (mime_type, charset)}],
+            'body': {'data': data}}
+
+
+def test_plain_text_is_preferred():
+    payload = {'mimeType': 'multipart/mixed', 'parts': [
+        {'mimeType': 'multipart/alternative', 'parts': [
+            _part('text/html', '<p>Hello</p>'),
+            _part('text/plain', 'Hello there'),
+        ]},
+        _part('text/plain', 'not the body', filename='notes.txt'),
+    ]}
+    assert extract_body(payload) == 'Hello there'
+
+
+def test_html_only_bodies_are_stripped():
+    payload = _part('text/html', '<style>p {}</style><p>Caf&eacute;<br>menu</p>')
+    assert extract_body(payload) == 'Café\nmenu'
+
+
+def test_charsets_are_honoured():
+    assert extract_body(_part('text/plain', 'Grüße', charset='iso-8859-1')) == 'Grüße'
+    assert extract_body(_part('text/plain', 'hi', charset='x-made-up', encoding='utf-8')) == 'hi'
+
+
+def test_no_body():
+    assert extract_body(None) is None
+    assert extract_body({'mimeType': 'text/plain', 'body': {'size': 0}}) is None
+
+
+def _fail(items):
+    raise ValueError("bad message")
+
+
+def test_pipe_pool_preserves_order():
+    payloads = [_part('text/plain', 'message %d' % i) for i in range(25)]
+    pool = PipePool(extract_bodies, workers=3)
+    try:
+        assert pool.map(payloads) == ['message %d' % i for i in range(25)]
+        # Workers stick around for the next batch
+        assert pool.map(payloads[:2]) == ['message 0', 'message 1']
+    finally:
+        pool.close()
+
+
+def test_pipe_pool_errors_are_raised():
+    pool = PipePool(_fail, workers=2)
+    try:
+        with pytest.raises(ValueError, match="bad message"):
+            pool.map([1, 2, 3])
+    finally:
+        pool.close()
+
+
+_held = threading.Lock()
+
+
+def _acquires_lock(items):
+    acquired = _held.acquire(timeout=1)
+    if acquired:
+        _held.release()
+    return [acquired for _ in items]
+
+
+def test_pipe_pool_workers_dont_inherit_locks():
+    # Another thread (e.g. a fetcher's) holds the lock when the pool starts. A forked
+    # worker would get a copy of the held lock that nothing will ever release.
+    holding, done = threading.Event(), threading.Event()
+
+    def hold():
+        with _held:
+            holding.set()
+            done.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    holding.wait()
+    try:
+        pool = PipePool(_acquires_lock, workers=1)
+    finally:
+        done.set()
+        thread.join()
+    try:
+        assert pool.map([1, 2]) == [True, True]
+    finally:
+        pool.close()
+
+
+def test_decode_bodies():
+    messages = [{'id': str(i), 'payload': _part('text/plain', 'message %d' % i)} for i in range(60)]
+    decode_bodies(messages, workers=2)
+    assert [m['body'] for m in messages] == ['message %d' % i for i in range(60)]
@@ -0,0 +1,68 @@
+import pyarrow as pa
+
+from athena.federation.constraints import parse_constraints
+from athena.federation.models import GetTableLayoutResponse
+from gmail.partitions import (month_end, month_partitions, month_start, partition_batch, partition_windows,
+                              prune_partitions, read_partitions)
+from gmail.splits import MAILBOX_START
+
+from constraint_blocks import constraints, equatable, ranges, single_values
+
+
+def test_month_partitions():
+    start = month_start(2020, 11) + 86400
+    assert month_partitions(start, month_start(2021, 2)) == [(2020, 11), (2020, 12), (2021, 1)]
+    assert month_partitions(start, start + 1) == [(2020, 11)]
+    assert month_end(2020, 12) == month_start(2021, 1)
+
+
+def test_prune_by_partition_columns():
+    partitions = month_partitions(month_start(2019, 1), month_start(2022, 1))
+    value_sets = parse_constraints(constraints({
+        'year': single_values(2020, 2021, pa_type=pa.int32()),
+        'month': ranges(((6, 'EXACTLY'), (8, 'BELOW')), pa_type=pa.int32()),
+    }))
+    assert prune_partitions(partitions, value_sets) == [(2020, 6), (2020, 7), (2021, 6), (2021, 7)]
+
+    value_sets = parse_constraints(constraints({
+        'month': equatable([1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11], white_list=False, pa_type=pa.int32()),
+    }))
+    assert prune_partitions(partitions, value_sets) == [(2019, 12), (2020, 12), (2021, 12)]
+
+
+def test_prune_by_date_window():
+    partitions = month_partitions(month_start(2019, 1), month_start(2022, 1))
+    window = (month_start(2020, 2) + 5, month_start(2020, 4))
+    assert prune_partitions(partitions, {}, window) == [(2020, 2), (2020, 3)]
+    assert prune_partitions(partitions, {}, (month_start(2021, 12), None)) == [(2021, 12)]
+
+
+def test_partition_windows_are_merged():
+    assert partition_windows([(2020, 3), (2020, 1), (2020, 2), (2020, 12), (2021, 1), (2021, 5)]) == [
+        (month_start(2020, 1), month_start(2020, 4)),
+        (month_start(2020, 12), month_start(2021, 2)),
+        (month_start(2021, 5), month_start(2021, 6)),
+    ]
+
+
+def test_first_partition_holds_older_mail():
+    partitions = month_partitions()
+    first = partitions[0]
+    assert partition_windows(partitions[:2]) == [(None, month_end(*partitions[1]))]
+
+    # Imported mail from before the mailbox started is only found by listing the first partition
+    old = parse_constraints(constraints({'year': single_values(1999, pa_type=pa.int32())}))
+    assert prune_partitions(partitions, old) == [first]
+    assert prune_partitions(partitions, {}, (None, MAILBOX_START - 86400 * 365)) == [first]
+    assert prune_partitions(partitions, {}, (MAILBOX_START - 86400 * 365, None)) == partitions
+
+
+def test_partitions_round_trip_through_layout():
+    partitions = [(2020, 12), (2021, 1)]
+    layout = GetTableLayoutResponse('gmail', 'personal', 'All Mail', partition_batch(partitions)).as_dict()
+    assert read_partitions(layout['partitions']) == partitions
+
+    # The unpartitioned default doesn't tell us anything
+    layout = GetTableLayoutResponse('gmail', 'personal', 'All Mail').as_dict()
+    assert read_partitions(layout['partitions']) is None
+    assert read_partitions(None) is None
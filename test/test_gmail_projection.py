@@ -0,0 +1,35 @@
+import pyarrow as pa
+
+from gmail.projection import THREAD_HEADER_COLUMNS, FetchPlan
+
+
+def test_message_id_only_is_minimal():
+    plan = FetchPlan(['messageId', 'sentDate', 'meta_gmailquery'])
+    assert plan.format == 'minimal'
+    assert plan.request_kwargs() == {'format': 'minimal'}
+    assert plan.header_columns == {}
+
+
+def test_header_columns_use_metadata():
+    schema = pa.schema([('messageId', pa.string()), ('from', pa.string()), ('subject', pa.string())])
+    plan = FetchPlan.from_schema(schema)
+    assert plan.format == 'metadata'
+    assert plan.request_kwargs() == {'format': 'metadata', 'metadataHeaders': ['From', 'Subject']}
+
+
+def test_body_uses_full():
+    plan = FetchPlan(['messageId', 'from', 'body'])
+    assert plan.wants_body
+    assert plan.request_kwargs() == {'format': 'full'}
+    assert plan.header_columns == {'from': 'From'}
+
+    # These come back with every format
+    plan = FetchPlan(['snippet', 'sizeEstimate', 'labelIds'])
+    assert not plan.wants_body
+    assert plan.format == 'minimal'
+
+
+def test_thread_columns_share_headers():
+    plan = FetchPlan(['threadId', 'from', 'participants', 'firstReplySeconds', 'messageCount'], THREAD_HEADER_COLUMNS)
+    assert plan.request_kwargs() == {'format': 'metadata', 'metadataHeaders': ['From']}
+    assert FetchPlan(['threadId', 'messageCount'], THREAD_HEADER_COLUMNS).format == 'minimal'
@@ -0,0 +1,120 @@
+import datetime
+
+import pyarrow as pa
+
+from gmail.query import GmailSearch
+from gmail.rows import SENT_DATE_TYPE
+
+from constraint_blocks import constraints, equatable, like, ranges, single_values
+
+
+def test_no_constraints():
+    search = GmailSearch.from_constraints(None)
+    assert search.query() is None
+    assert search.queries() == [("", None)]
+
+
+def test_meta_gmailquery_is_passed_through():
+    search = GmailSearch.from_constraints(constraints({
+        'meta_gmailquery': single_values('from:amazonaws.com')
+    }))
+    assert search.query() == 'from:amazonaws.com'
+    assert search.queries() == [('from:amazonaws.com', 'from:amazonaws.com')]
+
+    search = GmailSearch.from_constraints(constraints({
+        'meta_gmailquery': equatable(['label:work', 'is:starred'])
+    }))
+    assert search.query() == '(label:work) OR (is:starred)'
+    assert search.queries(10, 20) == [('label:work', 'label:work after:10 before:20'),
+                                      ('is:starred', 'is:starred after:10 before:20')]
+
+
+def test_from_and_subject_equality():
+    search = GmailSearch.from_constraints(constraints({
+        'from': single_values('Damon <damon@example.com>', 'bob@example.com'),
+        'subject': single_values('Hi "there"'),
+    }))
+    assert search.query() == '{from:damon@example.com from:bob@example.com} subject:"Hi there"'
+
+
+def test_from_like():
+    search = GmailSearch.from_constraints(constraints(expression=[
+        like('from', '%@amazonaws.com'),
+        like('from', '%<bob@example.com>%'),
+        # Substring matches can't be expressed in Gmail search
+        like('from', '%amazon%'),
+        like('from', '%@amazonaws.co%'),
+        like('from', '%@example.com%'),
+        like('subject', '%@amazonaws.com'),
+    ]))
+    assert search.query() == 'from:amazonaws.com from:bob@example.com'
+
+
+def test_null_or_empty_values_are_not_searched():
+    nullable = dict(single_values('x'), nullAllowed=True)
+    search = GmailSearch.from_constraints(constraints({
+        'subject': nullable,
+        'from': single_values('', 'bob@example.com'),
+    }))
+    assert search.query() is None
+    assert search.queries() == [("", None)]
+
+
+def test_sent_date_ranges():
+    start = datetime.datetime(2020, 12, 1, tzinfo=datetime.timezone.utc)
+    end = datetime.datetime(2020, 12, 31, tzinfo=datetime.timezone.utc)
+    search = GmailSearch.from_constraints(constraints({
+        'sentDate': ranges(((start, 'EXACTLY'), (end, 'BELOW')), pa_type=SENT_DATE_TYPE)
+    }))
+    after = int(start.timestamp()) - 1
+    before = int(end.timestamp()) + 1
+    assert search.window() == (after, before)
+    assert search.queries() == [("", 'after:%d before:%d' % (after, before))]
+
+    # Split windows are intersected with the constraint
+    assert search.window(after - 100, after + 100) == (after, after + 100)
+    assert search.queries(0, after) == []
+
+
+def test_sent_date_timestamps():
+    start = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+    search = GmailSearch.from_constraints(constraints({
+        'sentDate': ranges(((start, 'ABOVE'), (None, 'BELOW')))
+    }))
+    assert search.window() == (1609459200 - 1, None)
+
+
+def test_empty_value_set():
+    search = GmailSearch.from_constraints(constraints({
+        'subject': {"@type": "AllOrNoneValueSet", "type": {}, "all": False, "nullAllowed": False}
+    }))
+    assert search.empty
+    assert search.queries() == []
+
+
+def test_limit_only_applies_to_exact_searches():
+    search = GmailSearch.from_constraints(dict(constraints({
+        'meta_gmailquery': single_values('is:starred')
+    }), limit=10))
+    assert search.limit == 10
+
+    # Gmail's `subject:` matches words, so Athena may throw some of our rows away
+    search = GmailSearch.from_constraints(dict(constraints({
+        'subject': single_values('hello')
+    }), limit=10))
+    assert search.limit is None
+
+    search = GmailSearch.from_constraints(dict(constraints(expression=[like('from', '%@example.com%')]), limit=10))
+    assert search.limit is None
+
+
+def test_limit_with_partition_constraints():
+    def limit(**summary):
+        return GmailSearch.from_constraints(dict(constraints(
+            {column: single_values(value, pa_type=pa.int32()) for column, value in summary.items()}), limit=10)).limit
+
+    assert limit(year=2020) == 10
+    assert limit(year=2020, month=3) == 10
+    # The first partition also holds older mail, which Athena filters by its own year and month
+    assert limit(year=1999) is None
+    assert limit(month=3) is None
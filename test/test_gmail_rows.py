@@ -0,0 +1,118 @@
+import datetime
+
+import pyarrow as pa
+
+from gmail.rows import SENT_DATE_TYPE, MessageRowBuilder
+
+from gmail_fakes import make_message
+
+HEADER_COLUMNS = {'subject': 'Subject', 'from': 'From'}
+SCHEMA = pa.schema([('messageId', pa.string()),
+                    ('subject', pa.string()),
+                    ('from', pa.string()),
+                    ('sentDate', SENT_DATE_TYPE),
+                    ('meta_gmailquery', pa.string())])
+
+
+def test_builds_typed_columns():
+    builder = MessageRowBuilder(SCHEMA, HEADER_COLUMNS)
+    builder.append_message(make_message('1', 1608249600000, subject='hi', sender='a@b.com'), 'from:b.com')
+    (batch,) = builder.drain(final=True)
+
+    assert batch.schema == SCHEMA
+    assert batch.to_pydict() == {
+        'messageId': ['1'],
+        'subject': ['hi'],
+        'from': ['a@b.com'],
+        'sentDate': [datetime.datetime(2020, 12, 18, tzinfo=datetime.timezone.utc)],
+        'meta_gmailquery': ['from:b.com'],
+    }
+
+
+def test_missing_headers_are_null():
+    builder = MessageRowBuilder(SCHEMA, HEADER_COLUMNS)
+    message = make_message('1', 0)
+    message['payload']['headers'] = [{'name': 'FROM', 'value': 'a@b.com'}]
+    builder.append_message(message)
+    builder.append_message({'id': '2'})
+    (batch,) = builder.drain(final=True)
+
+    assert batch.column(1).to_pylist() == [None, None]
+    assert batch.column(2).to_pylist() == ['a@b.com', None]
+    assert batch.column(3).null_count == 1
+
+
+def test_projected_columns_only():
+    schema = pa.schema([('messageId', pa.string())])
+    builder = MessageRowBuilder(schema, HEADER_COLUMNS)
+    assert builder.headers == {}
+    builder.append_message({'id': '1'})
+    (batch,) = builder.drain(final=True)
+    assert batch.to_pydict() == {'messageId': ['1']}
+
+
+def test_caps_batch_size():
+    builder = MessageRowBuilder(SCHEMA, HEADER_COLUMNS, max_rows=3)
+
+    batches = []
+    for i in range(8):
+        builder.append_message(make_message(str(i), 1000 * i))
+        batches.extend(builder.drain())
+    assert [b.num_rows for b in batches] == [3, 3]
+    assert len(builder) == 2
+
+    batches.extend(builder.drain(final=True))
+    assert [b.num_rows for b in batches] == [3, 3, 2]
+    assert [v for b in batches for v in b[0].to_pylist()] == [str(i) for i in range(8)]
+    assert [v.timestamp() for b in batches for v in b[3].to_pylist()] == [float(i) for i in range(8)]
+    assert len(builder) == 0
+
+
+def test_message_fields():
+    schema = pa.schema([('messageId', pa.string()),
+                        ('to', pa.list_(pa.string())),
+                        ('snippet', pa.string()),
+                        ('sizeEstimate', pa.int64()),
+                        ('labelIds', pa.list_(pa.string())),
+                        ('body', pa.string())])
+    builder = MessageRowBuilder(schema, {'to': 'To'})
+    message = make_message('1', 0, snippet='Hi...', sizeEstimate=2048, labelIds=['INBOX', 'SENT'], body='Hi there')
+    message['payload']['headers'].append({'name': 'To', 'value': 'You <you@example.com>, "Doe, Jo" <jo@example.com>'})
+    builder.append_message(message)
+    builder.append_message({'id': '2'})
+    (batch,) = builder.drain(final=True)
+
+    assert batch.to_pydict() == {
+        'messageId': ['1', '2'],
+        'to': [['you@example.com', 'jo@example.com'], None],
+        'snippet': ['Hi...', None],
+        'sizeEstimate': [2048, None],
+        'labelIds': [['INBOX', 'SENT'], None],
+        'body': ['Hi there', None],
+    }
+
+
+def test_partition_columns():
+    schema = pa.schema([('year', pa.int32()), ('month', pa.int32())])
+    builder = MessageRowBuilder(schema, HEADER_COLUMNS)
+    # 2020-12-31 23:59:59.999 and 2021-01-01 UTC
+    builder.append_message(make_message('1', 1609459199999))
+    builder.append_message(make_message('2', 1609459200000))
+    builder.append_message({'id': '3'})
+    (batch,) = builder.drain(final=True)
+
+    assert batch.schema == schema
+    assert batch.to_pydict() == {'year': [2020, 2021, None], 'month': [12, 1, None]}
+
+
+def test_caps_batch_bytes_when_bodies_are_selected():
+    schema = pa.schema([('messageId', pa.string()), ('body', pa.string())])
+    builder = MessageRowBuilder(schema, {}, max_bytes=100)
+
+    batches = []
+    for i, size in enumerate([40, 40, 40, 500, 10]):
+        builder.append_message({'id': str(i), 'body': 'x' * size})
+        batches.extend(builder.drain())
+    batches.extend(builder.drain(final=True))
+    # A body bigger than the cap gets a batch to itself
+    assert [b[0].to_pylist() for b in batches] == [['0', '1'], ['2'], ['3'], ['4']]
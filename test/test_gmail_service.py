@@ -0,0 +1,48 @@
+import datetime
+
+from google.oauth2.credentials import Credentials
+
+from gmail.service import ServiceCache, needs_refresh
+
+
+def _credentials(expires_in):
+    creds = Credentials(token='token', refresh_token='refresh')
+    creds.expiry = datetime.datetime.utcnow() + expires_in
+    return creds
+
+
+def test_needs_refresh():
+    assert not needs_refresh(_credentials(datetime.timedelta(hours=1)))
+    assert needs_refresh(_credentials(datetime.timedelta(minutes=1)))
+    assert needs_refresh(Credentials(token=None))
+    assert not needs_refresh(Credentials(token='token'))
+
+
+def test_service_is_built_once_per_token():
+    loads = []
+
+    def load_credentials(path):
+        loads.append(path)
+        return _credentials(datetime.timedelta(hours=1))
+
+    cache = ServiceCache(load_credentials)
+    first = cache.get('token.pickle')
+    assert first is cache.get('token.pickle')
+    assert loads == ['token.pickle']
+
+    # The client is built from the bundled discovery document
+    assert first.users().messages().list(userId='me').uri.startswith('https://gmail.googleapis.com/')
+
+    cache.clear()
+    assert cache.get('token.pickle') is not first
+    assert loads == ['token.pickle', 'token.pickle']
+
+
+def test_expiring_tokens_are_refreshed(monkeypatch):
+    creds = _credentials(datetime.timedelta(minutes=1))
+    refreshes = []
+    monkeypatch.setattr(Credentials, 'refresh', lambda self, request: refreshes.append(request))
+
+    cache = ServiceCache(lambda path: creds)
+    cache.get('token.pickle')
+    assert len(refreshes) == 1
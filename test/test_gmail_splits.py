@@ -0,0 +1,94 @@
+from gmail.splits import chunked, list_splits, spill_location, split_properties, unpack_message_ids, window_query
+
+from gmail_fakes import FakeGmailService, make_message
+
+DAY = 86400
+
+
+def _mailbox(days, per_day):
+    return FakeGmailService([
+        make_message('%d-%d' % (d, i), 1000 * (d * DAY + i))
+        for d in days for i in range(per_day)
+    ])
+
+
+def test_window_query():
+    assert window_query(10, 20) == 'after:10 before:20'
+    assert window_query(10, 20, 'from:me') == 'from:me after:10 before:20'
+    assert window_query(None, None) == ''
+
+
+def test_list_splits_covers_every_message_once():
+    svc = _mailbox(range(0, 64), 10)
+    queries = [('', window_query(0, 32 * DAY)), ('', window_query(32 * DAY, 64 * DAY))]
+    splits, token = list_splits(svc, queries, split_size=50, page_size=100)
+
+    assert token is None
+    assert all(0 < len(ids) <= 50 for _, ids in splits)
+    listed = [message_id for _, ids in splits for message_id in ids]
+    assert sorted(listed) == sorted(m['id'] for m in svc.messages_list)
+
+
+def test_list_splits_continues_where_it_left_off():
+    svc = _mailbox(range(0, 10), 10)
+    queries = [('a', window_query(0, 5 * DAY)), ('b', window_query(5 * DAY, 10 * DAY))]
+
+    listed, token, calls = [], None, 0
+    while True:
+        splits, token = list_splits(svc, queries, continuation_token=token, max_pages=2, page_size=20)
+        listed.extend((meta_query, message_id) for meta_query, ids in splits for message_id in ids)
+        calls += 1
+        if token is None:
+            break
+
+    # 50 messages per query at 20 per page is 3 pages each
+    assert calls == 3
+    assert len(listed) == len(set(listed)) == 100
+    assert [m for q, m in listed if q == 'a'] == [m['id'] for m in svc.search(queries[0][1])]
+
+
+def test_list_splits_stops_at_limit():
+    svc = _mailbox(range(0, 10), 10)
+    splits, token = list_splits(svc, [('', None)], limit=15, page_size=10)
+    assert token is None
+    assert sum(len(ids) for _, ids in splits) == 15
+    assert [c[1]['maxResults'] for c in svc.requests] == [10, 5]
+
+
+def test_list_splits_of_threads():
+    svc = FakeGmailService([make_message(str(i), 1000 * i, threadId=str(i // 4)) for i in range(20)])
+    splits, token = list_splits(svc, [('', None)], split_size=2, resource='threads')
+    assert token is None
+    assert [ids for _, ids in splits] == [['4', '3'], ['2', '1'], ['0']]
+    assert svc.call_count('threads.list') == 1
+
+
+def test_message_ids_are_delta_encoded():
+    message_ids = ['17a3f0c2d1e4b5a6', '17a3f0c2d1e4b5a9', '17a3f0c2d1e00000', '17a3f0c2d1e4b5a7']
+    properties = split_properties('is:starred', message_ids)
+    assert properties['idEncoding'] == 'delta'
+    assert properties['meta_gmailquery'] == 'is:starred'
+    assert len(properties['ids']) < len(','.join(message_ids)) / 2
+    assert sorted(unpack_message_ids(properties)) == sorted(message_ids)
+
+    # Leading zeros are kept, as long as every ID is the same width
+    assert unpack_message_ids(split_properties('', ['0001', '00ff'])) == ['0001', '00ff']
+
+
+def test_other_message_ids_are_kept_verbatim():
+    for message_ids in (['1-1', '1-2'], ['01', 'fff']):
+        properties = split_properties('', message_ids)
+        assert properties['idEncoding'] == 'plain'
+        assert unpack_message_ids(properties) == message_ids
+    assert unpack_message_ids({}) == []
+
+
+def test_spill_locations_are_unique():
+    first = spill_location('bucket', 'athena-spill', 'query-1')
+    second = spill_location('bucket', 'athena-spill', 'query-1')
+    assert first['key'].startswith('athena-spill/query-1/')
+    assert first['key'] != second['key']
+
+
+def test_chunked():
+    assert list(chunked([1, 2, 3, 4, 5], 2)) == [[1, 2], [3, 4], [5]]
@@ -0,0 +1,55 @@
+import datetime
+
+from gmail.schema import threads_schema
+from gmail.threads import ThreadRowBuilder
+
+from gmail_fakes import make_message
+
+
+def _thread(thread_id, *messages):
+    return {'id': thread_id, 'messages': [
+        make_message('%s-%d' % (thread_id, i), date, subject='%s at %d' % (thread_id, date),
+                     sender=sender, threadId=thread_id, labelIds=labels)
+        for i, (date, sender, labels) in enumerate(messages)
+    ]}
+
+
+def test_aggregates_each_thread():
+    builder = ThreadRowBuilder(threads_schema())
+    builder.append_thread(_thread('a',
+                                  (3000, 'Bob <bob@example.com>', ['INBOX']),
+                                  (1000, 'Ann <ann@example.com>', ['SENT']),
+                                  (2000, 'ann@example.com', ['SENT'])), 'is:starred')
+    builder.append_thread(_thread('b', (5000, 'carl@example.com', ['INBOX'])))
+    # Threads whose messages were all deleted are skipped
+    builder.append_thread({'id': 'c', 'messages': []})
+    (batch,) = builder.drain(final=True)
+
+    columns = batch.to_pydict()
+    assert columns['threadId'] == ['a', 'b']
+    # The first message, by date, started the thread
+    assert columns['subject'] == ['a at 1000', 'b at 5000']
+    assert columns['from'] == ['Ann <ann@example.com>', 'carl@example.com']
+    assert columns['participants'] == [['ann@example.com', 'bob@example.com'], ['carl@example.com']]
+    assert columns['messageCount'] == [3, 1]
+    assert columns['firstDate'][0] == datetime.datetime(1970, 1, 1, 0, 0, 1, tzinfo=datetime.timezone.utc)
+    assert columns['lastDate'][0] == datetime.datetime(1970, 1, 1, 0, 0, 3, tzinfo=datetime.timezone.utc)
+    # Ann following up on her own message isn't a reply
+    assert columns['firstReplySeconds'] == [2.0, None]
+    assert columns['labelIds'] == [['SENT', 'INBOX'], ['INBOX']]
+    assert columns['meta_gmailquery'] == ['is:starred', '']
+
+
+def test_caps_batch_size():
+    builder = ThreadRowBuilder(threads_schema(), max_rows=2)
+    batches = []
+    for t in range(5):
+        builder.append_thread(_thread(str(t), *[(1000 * (t + i), 'p%d@example.com' % i, []) for i in range(t + 1)]))
+        batches.extend(builder.drain())
+    batches.extend(builder.drain(final=True))
+
+    assert [b.num_rows for b in batches] == [2, 2, 1]
+    counts = [c for b in batches for c in b.column(4).to_pylist()]
+    replies = [r for b in batches for r in b.column(7).to_pylist()]
+    assert counts == [1, 2, 3, 4, 5]
+    assert replies == [None, 1.0, 1.0, 1.0, 1.0]
@@ -0,0 +1,65 @@
+import json
+
+from athena.federation.metrics import Metrics, payload_size, should_log_payloads, truncate
+from athena.federation.spill import BlockSpiller, LocalStorage
+from gmail_fakes import FakeClock
+from test_spill import SCHEMA, SPILL_LOCATION, _batch
+
+
+def test_timers_accumulate():
+    clock = FakeClock()
+    metrics = Metrics(clock=clock)
+    for _ in range(3):
+        with metrics.timer('Fetch'):
+            clock.now += 0.5
+
+    def pages():
+        clock.now += 0.25
+        yield 'page'
+
+    assert list(metrics.timed('List', pages())) == ['page']
+    assert metrics['FetchTime'] == 1500
+    assert metrics['ListTime'] == 250
+
+
+def test_emf_document(capsys):
+    metrics = Metrics('Test', {'Connector': 'gmail', 'RequestType': 'PingRequest'})
+    metrics.count('ListCalls', 2)
+    metrics.peak('ArrowAllocatedBytes', 10)
+    metrics.peak('ArrowAllocatedBytes', 5)
+    metrics.emit()
+
+    document = json.loads(capsys.readouterr().out)
+    directive = document['_aws']['CloudWatchMetrics'][0]
+    assert directive['Namespace'] == 'Test'
+    assert directive['Dimensions'] == [['Connector', 'RequestType']]
+    assert {'Name': 'ListCalls', 'Unit': 'Count'} in directive['Metrics']
+    assert document['RequestType'] == 'PingRequest'
+    assert document['ListCalls'] == 2
+    assert document['ArrowAllocatedBytes'] == 10
+
+
+def test_payloads_are_truncated():
+    payload = {'records': {'records': 'x' * 10000}, 'queryId': 'abc', 'splits': [{'n': 1}]}
+    truncated = truncate(payload, limit=16)
+    assert truncated['records']['records'] == 'x' * 16 + '...<10000 chars>'
+    assert truncated['queryId'] == 'abc'
+    assert truncated['splits'] == [{'n': 1}]
+    assert payload_size(payload) > 10000
+
+
+def test_payload_logging_levels():
+    assert should_log_payloads('DEBUG', 0.0)
+    assert should_log_payloads('INFO', 1.0)
+    assert not should_log_payloads('INFO', 0.0)
+    assert not should_log_payloads('WARNING', 1.0)
+
+
+def test_spilling_is_measured(tmp_path):
+    metrics = Metrics()
+    spiller = BlockSpiller(SPILL_LOCATION, LocalStorage(str(tmp_path)), max_inline_bytes=1024, metrics=metrics)
+    spiller.response('catalog', SCHEMA, [_batch(i * 100, 100) for i in range(3)])
+
+    assert metrics['Rows'] == 300
+    assert metrics['SpilledBytes'] > 0
+    assert 'SpillTime' in metrics and 'EncodeTime' in metrics
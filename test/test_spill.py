@@ -0,0 +1,82 @@
+import pyarrow as pa
+import pytest
+
+from athena.federation.spill import BlockSpiller, LocalStorage, decode_block, encode_block
+from athena.federation.utils import AthenaSDKUtils
+
+SCHEMA = pa.schema([('id', pa.int64()), ('name', pa.string())])
+SPILL_LOCATION = {"@type": "S3SpillLocation", "bucket": "spill-bucket",
+                  "key": "athena-spill/query-1/split-1", "directory": True}
+
+
+def _batch(start, count):
+    return AthenaSDKUtils.encode_pyarrow_records(SCHEMA, {
+        'id': list(range(start, start + count)),
+        'name': ['name-%d' % i for i in range(start, start + count)],
+    })
+
+
+def test_small_results_are_returned_inline(tmp_path):
+    spiller = BlockSpiller(SPILL_LOCATION, LocalStorage(str(tmp_path)))
+    resp = spiller.response('catalog', SCHEMA, [_batch(0, 10), _batch(10, 10)]).as_dict()
+
+    assert resp['@type'] == 'ReadRecordsResponse'
+    records = AthenaSDKUtils.decode_pyarrow_records(resp['records']['schema'], resp['records']['records'])
+    assert records.num_rows == 20
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_large_results_are_spilled(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    spiller = BlockSpiller(SPILL_LOCATION, storage, max_inline_bytes=1024)
+    batches = [_batch(i * 100, 100) for i in range(5)]
+    resp = spiller.response('catalog', SCHEMA, iter(batches)).as_dict()
+
+    assert resp['@type'] == 'RemoteReadRecordsResponse'
+    assert resp['encryptionKey'] is None
+    assert AthenaSDKUtils.parse_encoded_schema(resp['schema']['schema']) == SCHEMA
+
+    blocks = resp['remoteBlocks']
+    assert len(blocks) == 5
+    assert len(set(b['key'] for b in blocks)) == 5
+    for block, batch in zip(blocks, batches):
+        assert block['bucket'] == 'spill-bucket'
+        assert block['key'].startswith('athena-spill/query-1/split-1/')
+        assert block['directory'] is False
+        assert decode_block(SCHEMA, storage.get(block['bucket'], block['key'])).equals(batch)
+
+
+def test_without_spill_location_everything_is_inline():
+    spiller = BlockSpiller(None, max_inline_bytes=1)
+    resp = spiller.response('catalog', SCHEMA, [_batch(0, 100)]).as_dict()
+    assert resp['@type'] == 'ReadRecordsResponse'
+
+
+def test_encrypted_blocks():
+    pytest.importorskip('cryptography')
+    key = {'key': 'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=', 'nonce': 'AAAAAAAAAAAAAAAA'}
+    batch = _batch(0, 10)
+    data = encode_block(batch, encryption_key=key)
+    assert decode_block(SCHEMA, data, encryption_key=key).equals(batch)
+
+
+def test_local_storage_lists_keys_under_a_prefix(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    for key in ['me/segments/1.parquet', 'me/segments/2.parquet', 'me/state.json', 'you/state.json']:
+        storage.put('bucket', key, b'data')
+    assert storage.list('bucket', 'me/segments/') == ['me/segments/1.parquet', 'me/segments/2.parquet']
+    assert storage.list('bucket', 'me/') == ['me/segments/1.parquet', 'me/segments/2.parquet', 'me/state.json']
+    assert storage.list('bucket', 'nobody/') == []
+
+
+def test_spilled_blocks_respect_max_block_size(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    batch = _batch(0, 1000)
+    spiller = BlockSpiller(SPILL_LOCATION, storage, max_inline_bytes=1,
+                           max_block_bytes=pa.ipc.get_record_batch_size(batch) // 3)
+    resp = spiller.response('catalog', SCHEMA, [batch]).as_dict()
+
+    blocks = [decode_block(SCHEMA, storage.get(b['bucket'], b['key'])) for b in resp['remoteBlocks']]
+    assert len(blocks) == 4
+    assert all(pa.ipc.get_record_batch_size(b) <= spiller.max_block_bytes for b in blocks)
+    assert [v for b in blocks for v in b[0].to_pylist()] == list(range(1000))